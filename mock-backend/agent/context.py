@@ -0,0 +1,219 @@
+"""Context window management for the agent.
+
+The full conversation stays in the graph state (and in the chat history), but
+the model only sees a window of it:
+- tool outputs from before the most recent CONTEXT_KEEP_RECENT_TURNS user turns
+  are cut to CONTEXT_TOOL_OUTPUT_MAX_TOKENS,
+- once the window grows past CONTEXT_TOKEN_BUDGET, the oldest turns are folded
+  into a rolling summary kept in the graph state (`summary`), and the window
+  restarts after them (`summarized_through` is the id of the last folded message).
+
+Environment variables:
+- CONTEXT_TOKEN_BUDGET: Approximate token limit for the messages sent to the model, on top of the
+  system prompt and the summary (default 24000)
+- CONTEXT_KEEP_RECENT_TURNS: Number of recent user turns whose tool outputs are kept whole (default 2);
+  with 0, only the outputs of the latest round of tool calls are
+- CONTEXT_TOOL_OUTPUT_MAX_TOKENS: Size of older tool outputs once trimmed (default 300)
+- CONTEXT_SUMMARY_MAX_TOKENS: Target size of the rolling summary (default 1000)
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.constants import TAG_NOSTREAM
+from dotenv import load_dotenv
+
+from .model import get_model
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "24000"))
+CONTEXT_KEEP_RECENT_TURNS = int(os.getenv("CONTEXT_KEEP_RECENT_TURNS", "2"))
+CONTEXT_TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("CONTEXT_TOOL_OUTPUT_MAX_TOKENS", "300"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "1000"))
+
+# After summarizing, keep the window at most this fraction of the budget, so that
+# summaries are not needed again on every step
+SUMMARY_TARGET_RATIO = 0.5
+
+# Rough number of characters per token, for cutting text to a token count
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant that uses search and code tools.
+Update the summary with the new messages. Keep the user's goals, decisions, facts and figures found with tools,
+document ids ([doc-(id)]) and URLs ([link-(url)]) that were cited, and open questions. Drop small talk and raw tool output.
+Answer with the updated summary only, in at most {max_tokens} tokens."""
+
+
+def _summary_model():
+    # The summarizer's tokens must not be streamed to the client as part of the answer
+    return get_model().with_config(tags=[TAG_NOSTREAM], run_name="summarize_context")
+
+
+def _cut(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"\n[... {(len(text) - max_chars) // CHARS_PER_TOKEN} more tokens of tool output trimmed]"
+
+
+def _trim_tool_output(message: ToolMessage, max_tokens: int) -> ToolMessage:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    trimmed = _cut(content, max_tokens)
+    if trimmed is content:
+        return message
+    return message.model_copy(update={"content": trimmed})
+
+
+def _turn_starts(messages: List[BaseMessage]) -> List[int]:
+    """Indexes of the messages that start a user turn."""
+    return [index for index, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def get_window(state: Dict[str, Any]) -> List[BaseMessage]:
+    """Get the messages after the ones already folded into the summary."""
+    messages = state["messages"]
+    summarized_through = state.get("summarized_through")
+    if summarized_through:
+        for index, message in enumerate(messages):
+            if message.id == summarized_through:
+                return messages[index + 1:]
+    return messages
+
+
+def _last_ai_index(messages: List[BaseMessage]) -> int:
+    """Index of the latest AI message, whose tool calls the tool outputs after it answer, or -1."""
+    return max((index for index, message in enumerate(messages) if isinstance(message, AIMessage)), default=-1)
+
+
+def _trim_window(window: List[BaseMessage]) -> List[BaseMessage]:
+    """Trim the tool outputs of a window, keeping the recent turns (or at least the latest tool round) whole."""
+    turn_starts = _turn_starts(window)
+    if CONTEXT_KEEP_RECENT_TURNS <= 0:
+        keep_from = max(_last_ai_index(window), 0)
+    elif len(turn_starts) >= CONTEXT_KEEP_RECENT_TURNS:
+        keep_from = turn_starts[-CONTEXT_KEEP_RECENT_TURNS]
+    else:
+        keep_from = 0
+
+    messages = [
+        _trim_tool_output(message, CONTEXT_TOOL_OUTPUT_MAX_TOKENS)
+        if isinstance(message, ToolMessage) and index < keep_from else message
+        for index, message in enumerate(window)
+    ]
+
+    if count_tokens_approximately(messages) > CONTEXT_TOKEN_BUDGET:
+        # Keep only the results of the latest round of tool calls whole
+        last_ai = _last_ai_index(messages)
+        messages = [
+            _trim_tool_output(message, CONTEXT_TOOL_OUTPUT_MAX_TOKENS)
+            if isinstance(message, ToolMessage) and index < last_ai else message
+            for index, message in enumerate(messages)
+        ]
+    return messages
+
+
+def build_context(state: Dict[str, Any]) -> List[BaseMessage]:
+    """Build the conversation to send to the model: the rolling summary plus the trimmed window.
+
+    Tool outputs from before the recent turns are trimmed; if the window is still
+    over the budget (one very long turn), all but the latest tool outputs are trimmed
+    too. If the window still does not fit (summarizing failed), the oldest turns are left out.
+    """
+    messages = _trim_window(get_window(state))
+
+    first = 0
+    for start in _turn_starts(messages)[1:]:
+        if count_tokens_approximately(messages[first:]) <= CONTEXT_TOKEN_BUDGET:
+            break
+        first = start
+    messages = messages[first:]
+
+    summary = state.get("summary")
+    if summary:
+        messages = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + messages
+    return messages
+
+
+def _render_transcript(messages: List[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {message.content}")
+        elif isinstance(message, AIMessage):
+            if message.content:
+                lines.append(f"Assistant: {message.content}")
+            for tool_call in message.tool_calls:
+                lines.append(f"Assistant called {tool_call['name']} with {tool_call['args']}")
+        elif isinstance(message, ToolMessage):
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            lines.append(f"Tool {message.name} returned: {_cut(content, CONTEXT_TOOL_OUTPUT_MAX_TOKENS)}")
+    return "\n".join(lines)
+
+
+def summarize(summary: Optional[str], messages: List[BaseMessage]) -> str:
+    """Fold messages into a rolling summary with the model, a batch of at most the token budget at a time."""
+    batches: List[List[BaseMessage]] = [[]]
+    batch_tokens = 0
+    for message in messages:
+        tokens = count_tokens_approximately([message])
+        if batches[-1] and batch_tokens + tokens > CONTEXT_TOKEN_BUDGET:
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(message)
+        batch_tokens += tokens
+
+    summary_model = _summary_model()
+    for batch in batches:
+        response = summary_model.invoke([
+            SystemMessage(content=SUMMARY_PROMPT.format(max_tokens=CONTEXT_SUMMARY_MAX_TOKENS)),
+            HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{_render_transcript(batch)}"),
+        ])
+        summary = str(response.content).strip()
+    return summary
+
+
+def manage_context(state: Dict[str, Any], config=None) -> Dict[str, Any]:
+    """Graph node that folds the oldest turns into the rolling summary when the window is over budget.
+
+    Whole user turns are folded, so tool results always stay next to the tool calls
+    they answer, and the latest turn is never folded.
+
+    Args:
+        state: Current agent state
+        config: Configuration dictionary
+
+    Returns:
+        Dict containing the updated summary, or nothing if the window fits
+    """
+    window = get_window(state)
+    if count_tokens_approximately(_trim_window(window)) <= CONTEXT_TOKEN_BUDGET:
+        return {}
+
+    turn_starts = _turn_starts(window)
+    if len(turn_starts) < 2:
+        # Only the current turn is left; build_context trims its tool outputs instead
+        return {}
+
+    # Fold the oldest turns until the rest fits the summary target
+    target = CONTEXT_TOKEN_BUDGET * SUMMARY_TARGET_RATIO
+    split = turn_starts[-1]
+    for start in turn_starts[1:]:
+        if count_tokens_approximately(_trim_window(window[start:])) <= target:
+            split = start
+            break
+
+    folded = window[:split]
+    try:
+        summary = summarize(state.get("summary"), folded)
+    except Exception as e:
+        # Answering matters more than the summary; build_context still trims the window
+        logger.error(f"Failed to summarize conversation context: {str(e)}")
+        return {}
+
+    logger.info(f"Folded {len(folded)} messages into the conversation summary")
+    return {"summary": summary, "summarized_through": folded[-1].id}
@@ -1,19 +1,28 @@
 """LangGraph agent implementation."""
-from typing import Dict, List, Literal, TypedDict, Annotated
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from typing import Any, Dict, List, Literal, Optional, TypedDict, Annotated
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import ToolNode
 import aiosqlite
 
+from lib.checkpoint_serde import get_checkpoint_serializer
+from lib.database import db_manager
+from lib.tracing import TRACING_ENABLED, span
+from lib.storage import CHECKPOINT_DB_PATH, CHECKPOINT_TABLES, prepare_database
 from .tools import AVAILABLE_TOOLS
-from .model import model
+from .model import get_model
+from .context import build_context, manage_context
 
 class AgentState(TypedDict):
     """State for the agent graph."""
     messages: Annotated[List[BaseMessage], add_messages]
+    # Rolling summary of the messages up to and including `summarized_through` (see context.py)
+    summary: Optional[str]
+    summarized_through: Optional[str]
 
 
 def should_continue(state: AgentState) -> Literal["tools", "end"]:
@@ -45,8 +54,6 @@ def call_model(state: AgentState, config = None) -> Dict[str, List[BaseMessage]]
     Returns:
         Dict containing the updated messages
     """
-    messages = state["messages"]
-
     system_prompt = """
 # Your Role
 You are a helpful AI assistant. You must reason step by step, use multiple tools when needed, and continue iterating until the user’s request is fully satisfied.  
@@ -59,6 +66,7 @@ You are a helpful AI assistant. You must reason step by step, use multiple tools
   Combine and synthesize information from multiple sources.  
   You must look up with azure based search and web search to get the most relevant and recent information.
   Use the following tools for search:
+  - `hybrid_search` (preferred for documents: keyword and vector search in one call, so do not also call `azure_search_documents`, `azure_search_semantic` or `azure_search_vector` with the same query)  
   - `azure_search_documents`  
   - `azure_search_semantic`  
   - `azure_search_filter`  
@@ -119,29 +127,58 @@ If you cannot find supporting documents: explicitly say "No matching documents f
     """
 
     system_msg = SystemMessage(content=system_prompt.strip())
-    messages = [system_msg] + state["messages"]
+    messages = [system_msg] + build_context(state)
         
     # Bind tools to the model
-    model_with_tools = model.bind_tools(AVAILABLE_TOOLS)
+    model_with_tools = get_model().bind_tools(AVAILABLE_TOOLS)
     response = model_with_tools.invoke(messages)
     
     # Return the response
     return {"messages": [response]}
 
 
-# Initialize checkpointer
-db = aiosqlite.connect("./mock.db")
-checkpointer = AsyncSqliteSaver(db)
+class TracedAsyncSqliteSaver(AsyncSqliteSaver):
+    """Checkpointer recording a span for each checkpoint read and write made within a traced request or run.
+
+    The sync methods, used by the sync routes, run the async ones in the event loop in
+    a copy of the caller's context, so their spans have the right parent too.
+    """
+
+    @staticmethod
+    def _attributes(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+        return {"conversation_id": thread_id} if thread_id else {}
+
+    async def aget_tuple(self, config):
+        with span("checkpoint.get_tuple", self._attributes(config), child_only=True):
+            return await super().aget_tuple(config)
+
+    async def alist(self, config, **kwargs):
+        # Not the current span: the sync list() resumes this generator from a new context for every item
+        with span("checkpoint.list", self._attributes(config), child_only=True, current=False):
+            async for checkpoint_tuple in super().alist(config, **kwargs):
+                yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with span("checkpoint.put", self._attributes(config), child_only=True):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with span("checkpoint.put_writes", {**self._attributes(config), "checkpoint.writes": len(writes)}, child_only=True):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
 
 # Create the graph
 workflow = StateGraph(AgentState)
 
 # Add nodes
+workflow.add_node("context", manage_context)
 workflow.add_node("agent", call_model)
 workflow.add_node("tools", ToolNode(AVAILABLE_TOOLS))
 
-# Set the entrypoint as agent
-workflow.set_entry_point("agent")
+# Set the entrypoint as context, which keeps the conversation within budget before each model call
+workflow.set_entry_point("context")
+workflow.add_edge("context", "agent")
 
 # Add conditional edges
 workflow.add_conditional_edges(
@@ -153,8 +190,89 @@ workflow.add_conditional_edges(
     },
 )
 
-# Add edge from tools back to agent
-workflow.add_edge("tools", "agent")
+# Add edge from tools back to agent, through context
+workflow.add_edge("tools", "context")
+
+# Checkpointer connection and compiled graph, set up by init_graph() at server startup
+db: Optional[aiosqlite.Connection] = None
+graph: Optional[CompiledStateGraph] = None
+
+
+def init_graph() -> CompiledStateGraph:
+    """Open the checkpointer and compile the graph.
+
+    Must run in the event loop of the server (AsyncSqliteSaver runs its sync methods
+    there), so it is called by the app's lifespan rather than at import.
+
+    Returns:
+        CompiledStateGraph: The agent graph
+    """
+    global db, graph
+    if graph is None:
+        # Checkpoints are compressed (see lib/checkpoint_serde.py)
+        prepare_database(CHECKPOINT_DB_PATH, CHECKPOINT_TABLES, incremental_vacuum=True)
+        db = aiosqlite.connect(CHECKPOINT_DB_PATH)
+        # Traced only when tracing is on, as the wrappers cost a little on every checkpoint
+        saver_class = TracedAsyncSqliteSaver if TRACING_ENABLED else AsyncSqliteSaver
+        checkpointer = saver_class(db, serde=get_checkpoint_serializer())
+        graph = workflow.compile(checkpointer=checkpointer)
+    return graph
+
+
+def get_graph() -> CompiledStateGraph:
+    """Get the agent graph set up by init_graph()."""
+    if graph is None:
+        raise RuntimeError("The agent graph is not initialized; init_graph() runs at server startup")
+    return graph
+
+
+async def close_graph() -> None:
+    """Close the checkpointer connection, whose thread would otherwise keep the process alive."""
+    global db, graph
+    if db is not None:
+        await db.close()
+    db = graph = None
+
+
+async def close_stopped_run(config: Dict[str, Any], partial_message: Optional[AIMessage]) -> None:
+    """Leave the conversation of a stopped run in a state the next message can continue from.
+
+    Saves the text an interrupted model call had streamed so far, answers tool calls
+    that did not get a result (the model rejects unanswered tool calls), and ends the run.
+    Nothing is saved when the run was stopped because its conversation was deleted, as
+    its checkpoints are being deleted.
+
+    Args:
+        config: Configuration of the stopped run
+        partial_message: Text streamed so far by the interrupted model call, if any
+    """
+    thread_id, userid = config["configurable"]["thread_id"], config["configurable"].get("userid")
+    if not db_manager.conversation_exists(thread_id, userid):
+        return
+
+    thread_config = {"configurable": {"thread_id": thread_id}}
+    graph = get_graph()
+    snapshot = await graph.aget_state(thread_config)
+    if not snapshot.next:
+        # The run had already finished
+        return
+
+    messages = snapshot.values.get("messages", [])
+    answered = {message.tool_call_id for message in messages if isinstance(message, ToolMessage)}
+    last_ai_message = next((message for message in reversed(messages) if isinstance(message, AIMessage)), None)
+
+    updates: List[BaseMessage] = []
+    if last_ai_message is not None:
+        updates += [
+            ToolMessage(content="Stopped by the user before this tool call finished.", tool_call_id=tool_call["id"], name=tool_call["name"])
+            for tool_call in last_ai_message.tool_calls
+            if tool_call["id"] not in answered
+        ]
+    if partial_message is not None and partial_message.id not in {message.id for message in messages}:
+        updates.append(partial_message)
+    else:
+        updates.append(AIMessage(content="(Response stopped.)"))
+
+    # As the agent's final answer, so the graph ends here
+    await graph.aupdate_state(thread_config, {"messages": updates}, as_node="agent")
 
-# Compile the graph
-graph = workflow.compile(checkpointer=checkpointer)
\ No newline at end of file
@@ -1,14 +1,17 @@
 """Model configuration for Azure OpenAI integration."""
 import os
-from typing import Any, Dict
-from langchain_openai import AzureChatOpenAI
+import threading
+from typing import TYPE_CHECKING, Any, Dict
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from langchain_openai import AzureChatOpenAI
+
 # Load environment variables
 load_dotenv()
 
 
-def create_azure_model(**kwargs) -> AzureChatOpenAI:
+def create_azure_model(**kwargs) -> "AzureChatOpenAI":
     """Create an Azure OpenAI model instance.
     
     Args:
@@ -17,6 +20,9 @@ def create_azure_model(**kwargs) -> AzureChatOpenAI:
     Returns:
         AzureChatOpenAI: Configured Azure OpenAI model
     """
+    # Imported here: langchain_openai and openai take about a second to import
+    from langchain_openai import AzureChatOpenAI
+
     return AzureChatOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
         azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
@@ -24,9 +30,22 @@ def create_azure_model(**kwargs) -> AzureChatOpenAI:
         api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
         # temperature=0.5,
         streaming=True,
+        # Report token usage on streamed responses too (usage_metadata on the last chunk)
+        stream_usage=True,
         **kwargs
     )
 
 
-# Default model instance
-model = create_azure_model()
\ No newline at end of file
+# Default model instance, created on first use
+model = None
+_model_lock = threading.Lock()
+
+
+def get_model() -> "AzureChatOpenAI":
+    """Get the default model instance, creating it on first use."""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = create_azure_model()
+    return model
@@ -6,12 +6,20 @@ This module provides various tools that can be used by the LangGraph agent:
 2. SessionsPythonREPLTool: Execute Python code (requires AZURE_SESSIONPOOL_ENDPOINT)
 3. web_search: Perform web search using SearxNG (requires SEARXNG_URL)
 4. Azure AI Search tools (require AZURE_SEARCH_* environment variables):
+   All of them only search the documents of the current user, read from the
+   `userid` in the run's configurable config (see utils/stream_protocol.py).
    - azure_search_documents: Text-based search
    - azure_search_semantic: Semantic search with AI ranking
    - azure_search_filter: Search with OData filters
    - azure_search_vector: Vector similarity search (requires Azure OpenAI)
+   - hybrid_search: Concurrent text + vector search fused with RRF (requires Azure OpenAI)
+   Their results are formatted within a token budget (see utils/search_results.py).
+
+The duration and status of every call of the tools defined here are recorded in the
+agent_tool_call_duration_seconds metric (see lib/metrics.py).
 
 Environment Variables Required:
+- SEARCH_BACKEND: "azure" (default) or "local" for the offline index in lib/search (no AZURE_SEARCH_* needed)
 - AZURE_SEARCH_ENDPOINT: Your Azure AI Search service endpoint
 - AZURE_SEARCH_KEY: Your Azure AI Search admin key
 - AZURE_SEARCH_INDEX_NAME: The search index to query
@@ -20,15 +28,17 @@ Environment Variables Required:
 - AZURE_OPENAI_ENDPOINT: Azure OpenAI endpoint (for vector search)
 - AZURE_OPENAI_KEY: Azure OpenAI key (for vector search)
 - AZURE_OPENAI_EMBEDDING_MODEL: Embedding model name (optional, defaults to 'text-embedding-ada-002')
+- SEARCH_RESULT_TOKEN_BUDGET: Approximate size limit of each search tool output in tokens (optional, defaults to 4000)
 """
 import os
 from datetime import datetime
+from typing import Optional
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from langchain_azure_dynamic_sessions import SessionsPythonREPLTool
-from langchain_community.utilities import SearxSearchWrapper
-from azure.search.documents import SearchClient
-from azure.search.documents.models import VectorizedQuery
-from azure.core.credentials import AzureKeyCredential
+from lib.azure_clients import azure_clients
+from lib.metrics import timed, tool_call_duration_seconds
+from lib.search import get_search_backend, is_search_configured, scope_filter_to_user
+from utils.search_results import format_search_results
 from dotenv import load_dotenv
 # Load environment variables from .env file if present
 load_dotenv()
@@ -36,7 +46,21 @@ load_dotenv()
 
 tool_generator = []
 
+
+def measured(func):
+    """Observe the duration of every call of a tool function in agent_tool_call_duration_seconds.
+
+    The search tools return their errors to the model as results starting with "Error",
+    so those results count as errors too.
+    """
+    def is_error(result):
+        return isinstance(result, str) and result.startswith("Error")
+
+    return timed(tool_call_duration_seconds, is_error=is_error, tool=func.__name__)(func)
+
+
 @tool
+@measured
 def get_current_time() -> str:
     """Get the current date and time.
     
@@ -47,16 +71,28 @@ def get_current_time() -> str:
 tool_generator.append(get_current_time)
 
 
+# The clients below are imported only when configured, and built on first use where possible
 if os.getenv("AZURE_SESSIONPOOL_ENDPOINT"):
+    from langchain_azure_dynamic_sessions import SessionsPythonREPLTool
+
     code_tool = SessionsPythonREPLTool(
         pool_management_endpoint=os.getenv("AZURE_SESSIONPOOL_ENDPOINT")
     )
     tool_generator.append(code_tool)
 
 if os.getenv("SEARXNG_URL"):
-    search = SearxSearchWrapper(searx_host=os.getenv("SEARXNG_URL"))
+    search = None
+
+    def get_web_search():
+        """Get the SearxNG client, building it on first use."""
+        global search
+        if search is None:
+            from langchain_community.utilities import SearxSearchWrapper
+            search = SearxSearchWrapper(searx_host=os.getenv("SEARXNG_URL"))
+        return search
 
     @tool
+    @measured
     def web_search(query: str) -> str:
         """Perform a web search using SearxNG.
         
@@ -66,7 +102,7 @@ if os.getenv("SEARXNG_URL"):
         Returns:
             str: Search results
         """
-        results = search.results(
+        results = get_web_search().results(
             query,
             num_results=5,
         )
@@ -87,19 +123,19 @@ if os.getenv("SEARXNG_URL"):
 
     tool_generator.append(web_search)
 
-# Azure AI Search tools
-if (os.getenv("AZURE_SEARCH_ENDPOINT") and 
-    os.getenv("AZURE_SEARCH_API_KEY") and 
-    os.getenv("AZURE_SEARCH_INDEX_NAME")):
-    
-    search_client = SearchClient(
-        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
-        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
-    )
+# Azure AI Search tools (served by the backend selected with SEARCH_BACKEND)
+if is_search_configured():
+
+    def user_filter(config: RunnableConfig, filter_expression: Optional[str] = None) -> str:
+        """Scope a search to the documents of the user the agent is answering."""
+        userid = (config or {}).get("configurable", {}).get("userid")
+        if not userid:
+            raise ValueError("Missing user context; document search is only available in a user conversation")
+        return scope_filter_to_user(userid, filter_expression)
 
     @tool
-    def azure_search_documents(query: str, top: int = 5) -> str:
+    @measured
+    def azure_search_documents(query: str, config: RunnableConfig, top: int = 5) -> str:
         """Search documents in Azure AI Search using text-based search.
         
         Args:
@@ -111,39 +147,12 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
         """
         try:
             top = min(max(1, top), 50)  # Ensure top is between 1 and 50
-            results = search_client.search(
-                search_text=query,
-                top=top,
-                include_total_count=True
-            )
-            
-            formatted_results = []
-            for result in results:
-                formatted_result = {
-                    "score": getattr(result, "@search.score", "N/A"),
-                    "title": result.get("title", "No title"),
-                    "content": result.get("content", "No content"),
-                    "metadata": {k: v for k, v in result.items() if not k.startswith("@") and k not in ["title", "content"]}
-                }
-                formatted_results.append(formatted_result)
+            results = get_search_backend().text_search(query, top=top, filter=user_filter(config))
             
-            if not formatted_results:
+            if not results:
                 return f"No results found for query: '{query}'"
             
-            # Format results as readable text
-            output = f"Found {len(formatted_results)} results for '{query}':\n\n"
-            for result in formatted_results:
-                filename = result['metadata'].get('filename', 'Unknown')
-                chunk_index = result['metadata'].get('chunk_index', 0)
-                id_ = result['metadata'].get('id', 'Unknown')
-                content = result['content']
-                output += f"# {filename} {chunk_index}\n"
-                output += f"- chunk_id/id: {id_}\n"
-                output += "Content:\n```\n"
-                output += f"{content}\n"
-                output += "```\n\n"
-            
-            return output
+            return format_search_results(results, f"Found {len(results)} results for '{query}':")
             
         except Exception as e:
             return f"Error searching Azure AI Search: {str(e)}"
@@ -151,7 +160,8 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
     tool_generator.append(azure_search_documents)
 
     @tool
-    def azure_search_semantic(query: str, top: int = 5) -> str:
+    @measured
+    def azure_search_semantic(query: str, config: RunnableConfig, top: int = 5) -> str:
         """Search documents in Azure AI Search using semantic search capabilities.
         
         Args:
@@ -164,51 +174,12 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
         try:
             top = min(max(1, top), 50)  # Ensure top is between 1 and 50
             
-            # Check if semantic search is configured
-            semantic_config = "my-semantic-config"
-            
-            results = search_client.search(
-                search_text=query,
-                top=top,
-                query_type="semantic",
-                semantic_configuration_name=semantic_config,
-                query_caption="extractive",
-                query_answer="extractive",
-                include_total_count=True
-            )
+            results = get_search_backend().semantic_search(query, top=top, filter=user_filter(config))
             
-            formatted_results = []
-            for result in results:
-                # Get semantic captions if available
-                captions = getattr(result, "@search.captions", [])
-                caption_text = captions[0].text if captions else result.get("content", "No content")[:300]
-                
-                formatted_result = {
-                    "score": getattr(result, "@search.score", "N/A"),
-                    "title": result.get("title", "No title"),
-                    "caption": caption_text,
-                    "content": result.get("content", "No content"),
-                    "metadata": {k: v for k, v in result.items() if not k.startswith("@") and k not in ["title", "content"]}
-                }
-                formatted_results.append(formatted_result)
-            
-            if not formatted_results:
+            if not results:
                 return f"No semantic results found for query: '{query}'"
             
-            # Format results as readable text
-            output = f"Found {len(formatted_results)} semantic results for '{query}':\n\n"
-            for result in formatted_results:
-                filename = result['metadata'].get('filename', 'Unknown')
-                chunk_index = result['metadata'].get('chunk_index', 0)
-                id_ = result['metadata'].get('id', 'Unknown')
-                content = result['content']
-                output += f"# {filename} {chunk_index}\n"
-                output += f"- chunk_id/id: {id_}\n"
-                output += "Content:\n```\n"
-                output += f"{content}\n"
-                output += "```\n\n"
-            
-            return output
+            return format_search_results(results, f"Found {len(results)} semantic results for '{query}':")
             
         except Exception as e:
             return f"Error performing semantic search: {str(e)}"
@@ -216,7 +187,8 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
     tool_generator.append(azure_search_semantic)
 
     @tool
-    def azure_search_filter(query: str, filter_expression: str, top: int = 5) -> str:
+    @measured
+    def azure_search_filter(query: str, filter_expression: str, config: RunnableConfig, top: int = 5) -> str:
         """Search documents in Azure AI Search with OData filter expressions.
         
         Args:
@@ -229,40 +201,12 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
         """
         try:
             top = min(max(1, top), 50)  # Ensure top is between 1 and 50
-            results = search_client.search(
-                search_text=query,
-                filter=filter_expression,
-                top=top,
-                include_total_count=True
-            )
+            results = get_search_backend().text_search(query, top=top, filter=user_filter(config, filter_expression))
             
-            formatted_results = []
-            for result in results:
-                formatted_result = {
-                    "score": getattr(result, "@search.score", "N/A"),
-                    "title": result.get("title", "No title"),
-                    "content": result.get("content", "No content"),
-                    "metadata": {k: v for k, v in result.items() if not k.startswith("@") and k not in ["title", "content"]}
-                }
-                formatted_results.append(formatted_result)
-            
-            if not formatted_results:
+            if not results:
                 return f"No results found for query: '{query}' with filter: '{filter_expression}'"
             
-            # Format results as readable text
-            output = f"Found {len(formatted_results)} filtered results for '{query}' (Filter: {filter_expression}):\n\n"
-            for result in formatted_results:
-                filename = result['metadata'].get('filename', 'Unknown')
-                chunk_index = result['metadata'].get('chunk_index', 0)
-                id_ = result['metadata'].get('id', 'Unknown')
-                content = result['content']
-                output += f"# {filename} {chunk_index}\n"
-                output += f"- chunk_id/id: {id_}\n"
-                output += "Content:\n```\n"
-                output += f"{content}\n"
-                output += "```\n\n"
-            
-            return output
+            return format_search_results(results, f"Found {len(results)} filtered results for '{query}' (Filter: {filter_expression}):")
             
         except Exception as e:
             return f"Error performing filtered search: {str(e)}"
@@ -271,85 +215,76 @@ if (os.getenv("AZURE_SEARCH_ENDPOINT") and
 
     # Vector search tool (requires vector embeddings)
     if os.getenv("AZURE_OPENAI_ENDPOINT") and os.getenv("AZURE_OPENAI_API_KEY"):
-        try:
-            from openai import AzureOpenAI
-            
-            openai_client = AzureOpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        def embed_query(query: str) -> list:
+            """Generate the embedding for a search query."""
+            embedding_model = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME", "text-embedding-ada-002")
+            # The shared client, built on first use
+            response = azure_clients.openai_client.embeddings.create(
+                input=query,
+                model=embedding_model
             )
-            
-            @tool
-            def azure_search_vector(query: str, top: int = 5) -> str:
-                """Search documents in Azure AI Search using vector similarity.
-                
-                Args:
-                    query: Search query string to convert to vector
-                    top: Number of results to return (default: 5, max: 50)
-                    
-                Returns:
-                    str: Formatted vector search results with similarity scores
-                """
-                try:
-                    top = min(max(1, top), 50)  # Ensure top is between 1 and 50
-                    
-                    # Generate embedding for the query
-                    embedding_model = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME", "text-embedding-ada-002")
-                    response = openai_client.embeddings.create(
-                        input=query,
-                        model=embedding_model
-                    )
-                    query_vector = response.data[0].embedding
-                    
-                    # Perform vector search
-                    vector_field = "content_vector"
-                    vector_query = VectorizedQuery(
-                        vector=query_vector,
-                        k_nearest_neighbors=top,
-                        fields=vector_field
-                    )
-                    
-                    results = search_client.search(
-                        search_text=None,
-                        vector_queries=[vector_query],
-                        top=top
-                    )
-                    
-                    formatted_results = []
-                    for result in results:
-                        formatted_result = {
-                            "title": result.get("title", "No title"),
-                            "content": result.get("content", "No content"),
-                            "metadata": {k: v for k, v in result.items() if not k.startswith("@") and k not in ["title", "content", vector_field]}
-                        }
-                        formatted_results.append(formatted_result)
-                    
-                    if not formatted_results:
-                        return f"No vector results found for query: '{query}'"
-                    
-                    # Format results as readable text
-                    output = f"Found {len(formatted_results)} vector similarity results for '{query}':\n\n"
-                    for result in formatted_results:
-                        filename = result['metadata'].get('filename', 'Unknown')
-                        chunk_index = result['metadata'].get('chunk_index', 0)
-                        id_ = result['metadata'].get('id', 'Unknown')
-                        content = result['content']
-                        output += f"# {filename} {chunk_index}\n"
-                        output += f"- chunk_id/id: {id_}\n"
-                        output += "Content:\n```\n"
-                        output += f"{content}\n"
-                        output += "```\n\n"
-                    
-                    return output
-                    
-                except Exception as e:
-                    return f"Error performing vector search: {str(e)}"
-
-            tool_generator.append(azure_search_vector)
-            
-        except ImportError:
-            pass  # OpenAI client not available
+            return response.data[0].embedding
+
+        @tool
+        @measured
+        def azure_search_vector(query: str, config: RunnableConfig, top: int = 5) -> str:
+            """Search documents in Azure AI Search using vector similarity.
+
+            Args:
+                query: Search query string to convert to vector
+                top: Number of results to return (default: 5, max: 50)
+
+            Returns:
+                str: Formatted vector search results with similarity scores
+            """
+            try:
+                top = min(max(1, top), 50)  # Ensure top is between 1 and 50
+
+                # Generate embedding for the query
+                query_vector = embed_query(query)
+
+                # Perform vector search
+                results = get_search_backend().vector_search(query_vector, top=top, filter=user_filter(config))
+
+                if not results:
+                    return f"No vector results found for query: '{query}'"
+
+                return format_search_results(results, f"Found {len(results)} vector similarity results for '{query}':")
+
+            except Exception as e:
+                return f"Error performing vector search: {str(e)}"
+
+        tool_generator.append(azure_search_vector)
+
+        @tool
+        @measured
+        def hybrid_search(query: str, config: RunnableConfig, top: int = 5) -> str:
+            """Search documents with keyword (BM25) and vector similarity search at once.
+
+            Both searches run concurrently and their rankings are fused with reciprocal
+            rank fusion, so each chunk appears once. Prefer this over calling
+            azure_search_documents, azure_search_semantic and azure_search_vector separately.
+
+            Args:
+                query: Search query string
+                top: Number of results to return (default: 5, max: 50)
+
+            Returns:
+                str: Formatted fused search results
+            """
+            try:
+                top = min(max(1, top), 50)  # Ensure top is between 1 and 50
+                results = get_search_backend().hybrid_search(query, embed_query, top=top, filter=user_filter(config))
+
+                if not results:
+                    return f"No hybrid results found for query: '{query}'"
+
+                return format_search_results(results, f"Found {len(results)} hybrid results for '{query}':")
+
+            except Exception as e:
+                return f"Error performing hybrid search: {str(e)}"
+
+        tool_generator.append(hybrid_search)
 
 
 print(f"✓ Tools loaded. Tools available: {[tool.name for tool in tool_generator]}")
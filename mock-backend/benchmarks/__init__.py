@@ -0,0 +1,4 @@
+"""Offline benchmarks for the mock backend.
+
+Run them from the mock-backend directory, e.g. `uv run python -m benchmarks.azure_client_setup`.
+"""
@@ -0,0 +1,72 @@
+"""Benchmark the per-activity Azure client setup overhead.
+
+Compares building all five Azure clients on every activity run (the old
+`get_azure_clients()` behaviour) with fetching only the needed client from the
+shared `azure_clients` registry. Client construction does not touch the network,
+so placeholder credentials are used when none are configured; the numbers
+therefore exclude the TLS handshakes the shared clients also save.
+
+Usage:
+    uv run python -m benchmarks.azure_client_setup [--iterations 200]
+"""
+import os
+import argparse
+import time
+import tracemalloc
+
+PLACEHOLDER_ENV = {
+    "AZURE_STORAGE_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net",
+    "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT": "https://benchmark.cognitiveservices.azure.com/",
+    "AZURE_DOCUMENT_INTELLIGENCE_API_KEY": "benchmark",
+    "AZURE_OPENAI_ENDPOINT": "https://benchmark.openai.azure.com/",
+    "AZURE_OPENAI_API_KEY": "benchmark",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_SEARCH_ENDPOINT": "https://benchmark.search.windows.net",
+    "AZURE_SEARCH_API_KEY": "benchmark",
+    "AZURE_SEARCH_INDEX_NAME": "benchmark",
+}
+for key, value in PLACEHOLDER_ENV.items():
+    os.environ.setdefault(key, value)
+
+from lib import azure_clients as azure_clients_module
+from lib.azure_clients import AzureClientRegistry
+
+
+def build_all_clients():
+    """What every activity used to do: build all five clients from scratch."""
+    return tuple(factory() for factory, _ in azure_clients_module._CLIENT_SPECS.values())
+
+
+def measure(label: str, func, iterations: int) -> None:
+    func()  # warm up imports and lazy initialization
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {elapsed / iterations * 1e6:>10.1f} us/activity   peak {peak / 1024:>8.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    registry = AzureClientRegistry()
+    print(f"Per-activity client setup over {args.iterations} iterations:")
+    measure("get_azure_clients() (build all 5)", build_all_clients, args.iterations)
+    measure("registry, one client (store_embeddings)", lambda: registry.search_client, args.iterations)
+    measure("registry, all 5 clients", lambda: (
+        registry.blob_service,
+        registry.doc_intelligence,
+        registry.openai_client,
+        registry.search_client,
+        registry.search_index_client,
+    ), args.iterations)
+    registry.reset()
+
+
+if __name__ == "__main__":
+    main()
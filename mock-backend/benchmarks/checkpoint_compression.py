@@ -0,0 +1,170 @@
+"""Benchmark checkpoint compression: database size and checkpointer latency.
+
+Replays a corpus of conversations into an AsyncSqliteSaver once per compression
+setting, the way the agent graph writes them (a checkpoint with the full message
+list after every step, plus the step's pending writes), then reads the latest
+checkpoint of every conversation back. Reports the database size and the p50/p99
+latency of checkpoint writes and reads.
+
+The corpus is generated by default: conversations whose turns run a document search
+with formatted results (prose from this repository's README), like the search tools
+do. With --source, the checkpoints and writes of an existing database are replayed
+instead, e.g. a copy of checkpoints.db.
+
+Usage:
+    uv run python -m benchmarks.checkpoint_compression [--conversations 50] [--turns 8] [--reads 5] [--source checkpoints.db]
+"""
+import os
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.base.id import uuid6
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from lib.checkpoint_serde import CompressedSerializer
+from utils.search_results import format_search_results
+
+SETTINGS = ["none", "zlib", "zstd"]
+
+
+def prose_sentences():
+    readme = Path(__file__).resolve().parent.parent / "README.md"
+    text = readme.read_text(encoding="utf-8").replace("\n", " ")
+    return [sentence.strip() + "." for sentence in text.split(". ") if len(sentence.strip()) > 20]
+
+
+def generated_corpus(conversations, turns, seed=7):
+    """Yield (thread_id, steps), each step being the messages the step adds."""
+    rng = random.Random(seed)
+    sentences = prose_sentences()
+
+    def paragraph(count):
+        return " ".join(rng.choice(sentences) for _ in range(count))
+
+    for conversation in range(conversations):
+        steps = []
+        for turn in range(turns):
+            call_id = f"call_{conversation}_{turn}"
+            results = [
+                {"id": f"file{rng.randrange(40)}_{index}", "filename": f"report-{rng.randrange(40)}.pdf", "chunk_index": index, "content": paragraph(6)}
+                for index in range(5)
+            ]
+            steps.append([HumanMessage(content=paragraph(1), id=str(uuid6()))])
+            steps.append([AIMessage(content="", id=str(uuid6()), tool_calls=[{"id": call_id, "name": "search_documents", "args": {"query": paragraph(1)[:60]}}],
+                                    usage_metadata={"input_tokens": 1200, "output_tokens": 25, "total_tokens": 1225})])
+            steps.append([ToolMessage(content=format_search_results(results, "Found 5 results:"), tool_call_id=call_id, name="search_documents", id=str(uuid6()))])
+            steps.append([AIMessage(content=paragraph(4), id=str(uuid6()),
+                                    usage_metadata={"input_tokens": 3400, "output_tokens": 180, "total_tokens": 3580})])
+        yield f"conversation-{conversation:04d}", steps
+
+
+def source_rows(path):
+    """Yield the checkpoint and write rows of an existing database, oldest first."""
+    reader = CompressedSerializer(compression="none")
+    conn = sqlite3.connect(path)
+    try:
+        checkpoints = conn.execute(
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata FROM checkpoints ORDER BY thread_id, checkpoint_id"
+        ).fetchall()
+        for thread_id, checkpoint_ns, checkpoint_id, parent_id, typ, blob, metadata in checkpoints:
+            writes = conn.execute(
+                "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id)
+            ).fetchall()
+            yield (
+                thread_id, checkpoint_ns, parent_id, reader.loads_typed((typ, blob)), json.loads(metadata) if metadata else {},
+                [(task_id, channel, reader.loads_typed((write_typ, value))) for task_id, channel, write_typ, value in writes]
+            )
+    finally:
+        conn.close()
+
+
+def replayed_rows(conversations, turns):
+    """Turn the generated corpus into the rows the agent graph would write."""
+    for thread_id, steps in generated_corpus(conversations, turns):
+        messages = []
+        parent_id = None
+        for step, added in enumerate(steps):
+            messages = messages + added
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": messages, "summary": None}
+            checkpoint["channel_versions"] = {"messages": step + 1}
+            yield thread_id, "", parent_id, checkpoint, {"source": "loop", "step": step}, [("task", "messages", added)]
+            parent_id = checkpoint["id"]
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def measure(setting, rows, reads, directory):
+    path = os.path.join(directory, f"{setting}.db")
+    serializer = CompressedSerializer(compression=setting)
+    async with aiosqlite.connect(path) as conn:
+        saver = AsyncSqliteSaver(conn, serde=serializer)
+        await saver.setup()
+
+        write_times = []
+        latest = {}
+        for thread_id, checkpoint_ns, parent_id, checkpoint, metadata, writes in rows:
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}}
+            if parent_id:
+                config["configurable"]["checkpoint_id"] = parent_id
+            start = time.perf_counter()
+            saved = await saver.aput(config, checkpoint, metadata, {})
+            for task_id, channel, value in writes:
+                await saver.aput_writes(saved, [(channel, value)], task_id)
+            write_times.append(time.perf_counter() - start)
+            latest[thread_id] = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}}
+
+        read_times = []
+        for _ in range(reads):
+            for config in latest.values():
+                start = time.perf_counter()
+                await saver.aget_tuple(config)
+                read_times.append(time.perf_counter() - start)
+
+        await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        blob_bytes = (await (await conn.execute("SELECT SUM(LENGTH(checkpoint)) FROM checkpoints")).fetchone())[0]
+
+    size = os.path.getsize(path)
+    print(
+        f"{setting:<6} {serializer.codec_name or '-':<8} {size / 1024 / 1024:>9.2f} MiB {blob_bytes / 1024 / 1024:>9.2f} MiB"
+        f" {statistics.median(write_times) * 1000:>8.2f} p99 {percentile(write_times, 0.99) * 1000:>5.2f}"
+        f" {statistics.median(read_times) * 1000:>8.2f} p99 {percentile(read_times, 0.99) * 1000:>5.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--reads", type=int, default=5)
+    parser.add_argument("--source", help="replay the checkpoints of this database instead of a generated corpus")
+    args = parser.parse_args()
+
+    if args.source:
+        rows = list(source_rows(args.source))
+        print(f"Replaying {len(rows)} checkpoints from {args.source}")
+    else:
+        rows = list(replayed_rows(args.conversations, args.turns))
+        print(f"Replaying {len(rows)} checkpoints of {args.conversations} generated conversations of {args.turns} turns")
+
+    print(f"{'':<6} {'codec':<8} {'db file':>13} {'checkpoints':>13} {'write ms p50':>17} {'read ms p50':>17}")
+    with tempfile.TemporaryDirectory(prefix="checkpoint-compression-") as directory:
+        for setting in SETTINGS:
+            await measure(setting, rows, args.reads, directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,232 @@
+"""Deterministic local stand-ins for the model and the Azure services, for offline benchmarks.
+
+- FakeChatModel: streaming chat model emitting tokens at a set rate, which calls the
+  search tool for a share of the questions (decided by a hash of the question) and
+  answers once it has the tool result, reporting token usage like Azure OpenAI;
+- FakeOpenAIClient: embeddings from hashed word counts, so texts sharing words are near;
+- FakeBlobService: blob storage in memory;
+- FakeDocumentIntelligence: "extracts" uploaded text files as they are.
+
+install_fakes() puts them in place of the real clients, and the local search backend
+(lib/search/local_search.py) in a directory of choice in place of Azure AI Search.
+"""
+import re
+import json
+import asyncio
+import time
+import zlib
+import threading
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+EMBEDDING_DIMENSIONS = 1536
+
+# The first of these the agent has is called for the questions that need a search
+SEARCH_TOOLS = ["hybrid_search", "azure_search_documents"]
+
+WORDS = (
+    "The quarterly report shows revenue growth across all regions , driven by new contracts and"
+    " a steady renewal rate . Costs rose more slowly than sales , so the operating margin improved"
+    " for the third quarter in a row ."
+).split()
+
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """Embed text as its normalized, hashed word counts."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode()) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def fake_document(seed: int, paragraphs: int = 20) -> str:
+    """A deterministic text document of `paragraphs` paragraphs."""
+    rng = np.random.default_rng(seed)
+    return "\n\n".join(
+        " ".join(WORDS[index] for index in rng.integers(0, len(WORDS), size=120)) for _ in range(paragraphs)
+    )
+
+
+class FakeChatModel(BaseChatModel):
+    """Streaming chat model with a set token rate, for running the agent graph without Azure OpenAI."""
+
+    tokens_per_second: float = 100.0
+    response_tokens: int = 100
+    first_token_seconds: float = 0.0
+    tool_call_ratio: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        tool_names = [convert_to_openai_tool(tool)["function"]["name"] for tool in tools]
+        return self.bind(tool_names=tool_names, **kwargs)
+
+    def _search_tool(self, messages: List[BaseMessage], tool_names: Sequence[str]) -> Optional[str]:
+        """The tool to call for this turn, if the question is answered with a search."""
+        if not messages or not isinstance(messages[-1], HumanMessage):
+            return None
+        tool = next((name for name in SEARCH_TOOLS if name in tool_names), None)
+        question = str(messages[-1].content)
+        if tool is None or zlib.crc32(question.encode()) % 1000 >= self.tool_call_ratio * 1000:
+            return None
+        return tool
+
+    def _chunks(self, messages: List[BaseMessage], tool_names: Sequence[str]) -> Iterator[ChatGenerationChunk]:
+        """The chunks of the answer, the last one carrying the usage and finish reason."""
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        tool = self._search_tool(messages, tool_names)
+        if tool is not None:
+            question = str(messages[-1].content)
+            args = json.dumps({"query": question[:80]})
+            call_id = f"call_{zlib.crc32(question.encode()):08x}"
+            for index, piece in enumerate([args[:len(args) // 2], args[len(args) // 2:]]):
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                    "name": tool if index == 0 else None,
+                    "args": piece,
+                    "id": call_id if index == 0 else None,
+                    "index": 0,
+                }]))
+            output_tokens, finish_reason = len(args) // 4, "tool_calls"
+        else:
+            for index in range(self.response_tokens):
+                word = WORDS[index % len(WORDS)]
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word if index == 0 else f" {word}"))
+            output_tokens, finish_reason = self.response_tokens, "stop"
+
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            response_metadata={"finish_reason": finish_reason, "model_name": "fake-chat"},
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens},
+        ))
+
+    def _delays(self) -> Iterator[float]:
+        """Seconds to wait before each chunk, keeping to the token rate."""
+        start = time.monotonic() + self.first_token_seconds
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        index = 0
+        while True:
+            yield max(0.0, start + index * interval - time.monotonic())
+            index += 1
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        tool_names: Sequence[str] = (),
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for delay, chunk in zip(self._delays(), self._chunks(messages, tool_names)):
+            time.sleep(delay)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        tool_names: Sequence[str] = (),
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # Waits on the event loop, like the HTTP streaming of the real model, rather than in a thread
+        for delay, chunk in zip(self._delays(), self._chunks(messages, tool_names)):
+            await asyncio.sleep(delay)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, **kwargs))
+
+
+class _FakeEmbeddings:
+    def create(self, input: Any, model: Optional[str] = None, **kwargs: Any) -> SimpleNamespace:
+        texts = [input] if isinstance(input, str) else list(input)
+        return SimpleNamespace(data=[SimpleNamespace(index=index, embedding=fake_embedding(text)) for index, text in enumerate(texts)])
+
+
+class FakeOpenAIClient:
+    """The embeddings API of AzureOpenAI."""
+
+    def __init__(self):
+        self.embeddings = _FakeEmbeddings()
+
+    def close(self) -> None:
+        pass
+
+
+class _FakeBlobClient:
+    def __init__(self, service: "FakeBlobService", key: str):
+        self._service = service
+        self._key = key
+
+    def upload_blob(self, data: Any, overwrite: bool = False, **kwargs: Any) -> None:
+        with self._service._lock:
+            self._service.blobs[self._key] = bytes(data)
+
+    def download_blob(self, **kwargs: Any) -> SimpleNamespace:
+        with self._service._lock:
+            data = self._service.blobs[self._key]
+        return SimpleNamespace(readall=lambda: data)
+
+    def delete_blob(self, **kwargs: Any) -> None:
+        with self._service._lock:
+            self._service.blobs.pop(self._key, None)
+
+
+class FakeBlobService:
+    """BlobServiceClient keeping the blobs in memory."""
+
+    account_name = "benchmark"
+    credential = SimpleNamespace(account_key="YmVuY2htYXJr")
+
+    def __init__(self):
+        self.blobs: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def create_container(self, name: str) -> None:
+        pass
+
+    def get_blob_client(self, container: str, blob: str) -> _FakeBlobClient:
+        return _FakeBlobClient(self, f"{container}/{blob}")
+
+    def close(self) -> None:
+        pass
+
+
+class FakeDocumentIntelligence:
+    """DocumentIntelligenceClient returning uploaded text files as their content."""
+
+    def begin_analyze_document(self, model_id: str, body: Any, **kwargs: Any) -> SimpleNamespace:
+        content = body.bytes_source.decode("utf-8", errors="replace")
+        return SimpleNamespace(result=lambda: SimpleNamespace(content=content, pages=[]))
+
+    def close(self) -> None:
+        pass
+
+
+def install_fakes(chat_model: BaseChatModel, search_dir: str) -> None:
+    """Replace the model, the Azure clients and the search backend of this process with local stand-ins.
+
+    Args:
+        chat_model: Model the agent graph uses
+        search_dir: Directory of the local search index
+    """
+    from agent import model as agent_model
+    from lib.azure_clients import azure_clients
+    from lib.search import set_search_backend
+    from lib.search.local_search import LocalSearchBackend
+
+    agent_model.model = chat_model
+    azure_clients.override("openai_client", FakeOpenAIClient())
+    azure_clients.override("blob_service", FakeBlobService())
+    azure_clients.override("doc_intelligence", FakeDocumentIntelligence())
+    set_search_backend(LocalSearchBackend(path=search_dir))
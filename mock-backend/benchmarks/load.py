@@ -0,0 +1,317 @@
+"""Load benchmark of the whole server with local stand-ins for the model and Azure.
+
+Starts the FastAPI app with uvicorn in a child process whose model, Azure clients and
+search backend are the deterministic stand-ins of benchmarks/fakes.py: a streaming chat
+model answering at --tokens-per-second (calling the search tool for --tool-call-ratio of
+the questions), hashed embeddings, the local search index, an in-memory blob store and
+Document Intelligence returning the uploaded text.
+
+After uploading --seed-files documents and waiting for them to be indexed, --users
+clients run for --seconds, each repeatedly picking a request with the --mix weights:
+
+- chat: a new conversation (POST /chat) or a new turn of one listed before, read to the end;
+- history: GET /conversations/{id};
+- list: GET /conversations (which also refreshes the known conversations) or GET /api/v1/files;
+- upload: POST /api/v1/files with a generated text document, indexed in the background.
+
+Reports per request type the requests per second and the p50/p99 latency, the p50/p99
+time to the first text token of the chat answers, the server's memory (RSS at the end
+and peak), and how many uploads were indexed by the end.
+
+Usage:
+    uv run python -m benchmarks.load [--seconds 30] [--users 16] [--mix chat=4,history=3,list=2,upload=1]
+"""
+import os
+import sys
+import json
+import random
+import logging
+import socket
+import argparse
+import asyncio
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmarks.fakes import fake_document
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PLACEHOLDER_ENV = {
+    "AZURE_OPENAI_ENDPOINT": "https://benchmark.openai.azure.com/",
+    "AZURE_OPENAI_API_KEY": "benchmark",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_DEPLOYMENT_NAME": "benchmark",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME": "benchmark",
+    "AZURE_STORAGE_CONTAINER_NAME": "benchmark",
+    "BACKEND_AUTH_USERNAME": "benchmark",
+    "BACKEND_AUTH_PASSWORD": "benchmark",
+    "SEARCH_BACKEND": "local",
+}
+AUTH = ("benchmark", "benchmark")
+QUESTIONS = [
+    "How did revenue develop across the regions?",
+    "What drove the growth in sales this quarter?",
+    "Summarize the operating margin trend.",
+    "Which costs rose, and how fast compared to sales?",
+    "What does the report say about the renewal rate?",
+    "List the new contracts mentioned in the documents.",
+]
+
+
+def serve(args):
+    """Run the server with the stand-ins in this process (the --serve child)."""
+    directory = args.directory
+    os.environ.update({
+        **PLACEHOLDER_ENV,
+        "APP_DB_PATH": os.path.join(directory, "app.db"),
+        "CHECKPOINT_DB_PATH": os.path.join(directory, "checkpoints.db"),
+        "ORCHESTRATION_DB_PATH": os.path.join(directory, "orchestration.db"),
+        "LOCAL_SEARCH_DIR": os.path.join(directory, "search"),
+    })
+    os.environ.pop("WORKER_LEADER_LOCK_PATH", None)
+    os.chdir(directory)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import uvicorn
+    from benchmarks.fakes import FakeChatModel, install_fakes
+
+    chat_model = FakeChatModel(
+        streaming=True,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        first_token_seconds=args.first_token_ms / 1000,
+        tool_call_ratio=args.tool_call_ratio,
+    )
+    install_fakes(chat_model, os.path.join(directory, "search"))
+    # The routes and activities log every request and indexing step at INFO
+    logging.disable(logging.INFO)
+    uvicorn.Server(uvicorn.Config("main:app", port=args.port, log_level="warning")).run()
+
+
+class Recorder:
+    """Latencies and errors per request type, and chat times to first token."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.first_token = []
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def headers(user):
+    return {"userid": user}
+
+
+async def read_chat(response, start, recorder):
+    """Read a chat stream to the end, recording the time to its first text frame."""
+    first = None
+    async for line in response.aiter_lines():
+        if first is None and line.startswith("0:"):
+            first = time.perf_counter() - start
+    if first is not None:
+        recorder.first_token.append(first)
+
+
+async def chat(client, user, conversations, rng, recorder):
+    question = {"role": "user", "content": f"{rng.choice(QUESTIONS)} ({uuid.uuid4().hex[:8]})"}
+    known = conversations[user]
+    if known and rng.random() < 0.7:
+        url = f"/conversations/{rng.choice(known)}/chat"
+    else:
+        url = "/chat"
+    start = time.perf_counter()
+    async with client.stream("POST", url, json={"messages": [question]}, headers=headers(user)) as response:
+        # 409: the conversation is answering another client of the same user
+        if response.status_code == 409:
+            return True
+        response.raise_for_status()
+        await read_chat(response, start, recorder)
+    return False
+
+
+async def history(client, user, conversations, rng):
+    if not conversations[user]:
+        return True
+    response = await client.get(f"/conversations/{rng.choice(conversations[user])}", headers=headers(user))
+    response.raise_for_status()
+    return False
+
+
+async def listing(client, user, conversations, rng):
+    if rng.random() < 0.5:
+        response = await client.get("/conversations", headers=headers(user))
+        response.raise_for_status()
+        conversations[user] = [conversation["id"] for conversation in response.json()]
+    else:
+        response = await client.get("/api/v1/files", headers=headers(user))
+        response.raise_for_status()
+    return False
+
+
+async def upload(client, user, rng, paragraphs):
+    content = fake_document(rng.randrange(1 << 30), paragraphs).encode()
+    files = {"file": (f"report-{uuid.uuid4().hex[:8]}.txt", content, "text/plain")}
+    response = await client.post("/api/v1/files", files=files, headers=headers(user))
+    response.raise_for_status()
+    return False
+
+
+async def run_user(index, client, deadline, mix, conversations, recorder, args):
+    user = f"user-{index % args.user_ids}"
+    rng = random.Random(index)
+    names, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if name == "chat":
+                skipped = await chat(client, user, conversations, rng, recorder)
+            elif name == "history":
+                skipped = await history(client, user, conversations, rng)
+            elif name == "list":
+                skipped = await listing(client, user, conversations, rng)
+            else:
+                skipped = await upload(client, user, rng, args.paragraphs)
+        except (httpx.HTTPError, json.JSONDecodeError):
+            recorder.errors[name] += 1
+            continue
+        if not skipped:
+            recorder.latencies[name].append(time.perf_counter() - start)
+
+
+def memory_kb(pid):
+    """Current and peak resident memory of a process, from /proc (Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status)
+    except OSError:
+        return None, None
+    return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+
+
+async def wait_for_indexing(client, users, timeout):
+    """Wait until no file of the users is pending or in progress; return the files per status."""
+    deadline = time.monotonic() + timeout
+    while True:
+        counts = defaultdict(int)
+        for user in users:
+            response = await client.get("/api/v1/files", headers=headers(user))
+            response.raise_for_status()
+            for file in response.json()["files"]:
+                counts[file["status"]] += 1
+        if counts["pending"] + counts["in_progress"] == 0 or time.monotonic() > deadline:
+            return counts
+        await asyncio.sleep(0.5)
+
+
+async def drive(args, port, server):
+    mix = {}
+    for item in args.mix.split(","):
+        name, weight = item.split("=")
+        if name not in ("chat", "history", "list", "upload"):
+            raise ValueError(f"Unknown request type in --mix: {name}")
+        mix[name] = float(weight)
+
+    limits = httpx.Limits(max_connections=args.users + 4)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", auth=AUTH, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("The server exited before answering /health")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+        print(f"server up in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        users = [f"user-{index}" for index in range(min(args.users, args.user_ids))]
+        seed = random.Random(0)
+        for index in range(args.seed_files):
+            await upload(client, users[index % len(users)], seed, args.paragraphs)
+        counts = await wait_for_indexing(client, users, timeout=120)
+        print(f"seeded {args.seed_files} files: {dict(counts)}")
+
+        conversations = defaultdict(list)
+        recorder = Recorder()
+        deadline = time.monotonic() + args.seconds
+        await asyncio.gather(*(run_user(index, client, deadline, mix, conversations, recorder, args) for index in range(args.users)))
+        elapsed = args.seconds
+        rss, hwm = memory_kb(server.pid)
+
+        print(f"\n{args.users} users for {args.seconds:.0f}s, mix {args.mix}")
+        print(f"  {'request':<10} {'count':>7} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p99 ms':>9}")
+        for name in mix:
+            latencies = recorder.latencies[name]
+            if latencies:
+                p50, p99 = statistics.median(latencies) * 1000, percentile(latencies, 0.99) * 1000
+            else:
+                p50 = p99 = float("nan")
+            print(f"  {name:<10} {len(latencies):>7} {recorder.errors[name]:>7} {len(latencies) / elapsed:>8.1f} {p50:>9.1f} {p99:>9.1f}")
+        total = sum(len(latencies) for latencies in recorder.latencies.values())
+        print(f"  {'total':<10} {total:>7} {sum(recorder.errors.values()):>7} {total / elapsed:>8.1f}")
+        if recorder.first_token:
+            print(
+                f"time to first token: p50 {statistics.median(recorder.first_token) * 1000:.1f} ms"
+                f"   p99 {percentile(recorder.first_token, 0.99) * 1000:.1f} ms"
+            )
+        if rss is not None:
+            print(f"server memory: RSS {rss / 1024:.0f} MB, peak {hwm / 1024:.0f} MB")
+
+        counts = await wait_for_indexing(client, sorted(set(f"user-{index % args.user_ids}" for index in range(args.users))), timeout=args.drain_seconds)
+        print(f"files after draining indexing: {dict(counts)}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--users", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--user-ids", type=int, default=8, help="distinct userid headers the clients use")
+    parser.add_argument("--mix", default="chat=4,history=3,list=2,upload=1", help="weights of the request types")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="token rate of the model")
+    parser.add_argument("--response-tokens", type=int, default=150, help="tokens per model answer")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="model latency before its first token")
+    parser.add_argument("--tool-call-ratio", type=float, default=0.5, help="share of the questions answered with a search")
+    parser.add_argument("--seed-files", type=int, default=8, help="documents indexed before the run")
+    parser.add_argument("--paragraphs", type=int, default=20, help="paragraphs per uploaded document")
+    parser.add_argument("--drain-seconds", type=float, default=120, help="how long to wait for indexing after the run")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="load-") as directory:
+        command = [sys.executable, "-m", "benchmarks.load", "--serve", "--port", str(port), "--directory", directory] + sys.argv[1:]
+        server = subprocess.Popen(command, cwd=BACKEND_DIR)
+        try:
+            asyncio.run(drive(args, port, server))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
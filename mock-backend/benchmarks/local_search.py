@@ -0,0 +1,112 @@
+"""Benchmark the local search backend: exact versus IVF vector search, and text search.
+
+Builds an index of --vectors clustered, L2-normalised vectors of --dim dimensions (points
+scattered around --clusters random centres, like embeddings of documents on a few
+topics) in a temporary directory, then runs --queries queries near stored vectors with
+the exact (brute force) and the IVF index. Reports the median time per query of each,
+and the recall@--top of IVF: the share of the exact top results it also returns.
+Also times BM25 text search and hybrid search over the same documents.
+
+Usage:
+    uv run python -m benchmarks.local_search [--vectors 50000] [--dim 256] [--nprobe N]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from lib.search.local_search import LocalSearchBackend, IVF_MIN_VECTORS
+
+WORDS = [f"term{index}" for index in range(5000)]
+
+
+def make_documents(count, dim, clusters, seed=0):
+    """Documents with clustered vectors, and content drawn from a Zipf-like vocabulary."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centres[labels] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    word_ranks = np.minimum(rng.zipf(1.3, size=(count, 60)), len(WORDS)) - 1
+    return [
+        {
+            "id": f"doc-{index}",
+            "content": " ".join(WORDS[rank] for rank in word_ranks[index]),
+            "file_id": f"file-{index // 50}",
+            "filename": f"file-{index // 50}.txt",
+            "userid": f"user-{index % 10}",
+            "chunk_index": index % 50,
+            "content_vector": vectors[index].tolist(),
+        }
+        for index in range(count)
+    ], vectors
+
+
+def build_index(path, documents, index_type, nprobe=None):
+    backend = LocalSearchBackend(path=path, index_type=index_type, nprobe=nprobe)
+    for start in range(0, len(documents), 5000):
+        backend.upload_documents(documents[start:start + 5000])
+    return backend
+
+
+def timed_queries(search, queries):
+    """Results and median milliseconds per query, after one warm-up query (which trains IVF)."""
+    search(queries[0])
+    results, times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        times.append((time.perf_counter() - start) * 1000)
+    return results, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=100, help="centres the vectors are scattered around")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, help="IVF clusters scanned per query (default: ~10%% of clusters)")
+    args = parser.parse_args()
+
+    if args.vectors < IVF_MIN_VECTORS:
+        print(f"note: with fewer than {IVF_MIN_VECTORS} vectors the backend's auto mode would not use IVF")
+
+    documents, vectors = make_documents(args.vectors, args.dim, args.clusters)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, args.vectors, size=args.queries)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries = [query.tolist() for query in queries]
+
+    with tempfile.TemporaryDirectory(prefix="local-search-") as brute_dir, tempfile.TemporaryDirectory(prefix="local-search-") as ivf_dir:
+        start = time.perf_counter()
+        brute = build_index(brute_dir, documents, "brute")
+        print(f"indexed {args.vectors} documents ({args.dim}-d vectors) in {time.perf_counter() - start:.1f} s")
+        ivf = build_index(ivf_dir, documents, "ivf", args.nprobe)
+
+        exact, brute_ms = timed_queries(lambda query: brute.vector_search(query, top=args.top), queries)
+        approximate, ivf_ms = timed_queries(lambda query: ivf.vector_search(query, top=args.top), queries)
+        recall = statistics.mean(
+            len({result["id"] for result in found} & {result["id"] for result in expected}) / len(expected)
+            for found, expected in zip(approximate, exact)
+        )
+        print(f"vector search, brute force: {brute_ms:.2f} ms per query")
+        print(f"vector search, IVF:         {ivf_ms:.2f} ms per query, recall@{args.top} {recall:.3f}")
+
+        texts = [" ".join(WORDS[rank] for rank in rng.integers(0, 200, size=4)) for _ in range(args.queries)]
+        _, text_ms = timed_queries(lambda text: brute.text_search(text, top=args.top), texts)
+        _, filtered_ms = timed_queries(lambda text: brute.text_search(text, top=args.top, filter="userid eq 'user-3'"), texts)
+        pairs = list(zip(texts, queries))
+        _, hybrid_ms = timed_queries(lambda pair: ivf.hybrid_search(pair[0], lambda _: pair[1], top=args.top), pairs)
+        print(f"text search (BM25):         {text_ms:.2f} ms per query, {filtered_ms:.2f} ms filtered to one user")
+        print(f"hybrid search (IVF):        {hybrid_ms:.2f} ms per query")
+
+        brute.close()
+        ivf.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Benchmark server startup: import time of main.py and time to the first /health response.
+
+Imports main.py in a fresh interpreter with `python -X importtime`, --runs times, and
+reports the median total import time and the packages costing most of it (the self
+time of their modules). Then starts
+uvicorn --runs times and measures the time from launching the process until GET /health
+first answers. Each run uses a new working directory, so the databases start empty.
+
+With --max-health-ms, exits with status 1 when the median time to /health is above it,
+to catch startup regressions in CI.
+
+Usage:
+    uv run python -m benchmarks.startup [--runs 5] [--top 12] [--max-health-ms 3000]
+"""
+import os
+import sys
+import argparse
+import http.client
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PLACEHOLDER_ENV = {
+    "AZURE_OPENAI_ENDPOINT": "https://benchmark.openai.azure.com/",
+    "AZURE_OPENAI_API_KEY": "benchmark",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_DEPLOYMENT_NAME": "benchmark",
+}
+
+
+# Both import main.py in a running event loop, as it used to need one
+IMPORT_MAIN = "import asyncio\nasync def load():\n    import main\nasyncio.run(load())"
+SERVE_MAIN = "import uvicorn\nuvicorn.Server(uvicorn.Config('main:app', port={port}, log_level='warning')).run()"
+
+
+def server_env():
+    env = {**PLACEHOLDER_ENV, **os.environ, "PYTHONPATH": str(BACKEND_DIR)}
+    # Keep the startup from picking up the databases of a local .env
+    for key in ("APP_DB_PATH", "CHECKPOINT_DB_PATH", "ORCHESTRATION_DB_PATH", "WORKER_LEADER_LOCK_PATH"):
+        env.pop(key, None)
+    return env
+
+
+def parse_importtime(stderr):
+    """Return the total import time and the import time of each top-level package, in ms.
+
+    A package's time is the self time of its modules, so the times of the packages add up
+    to the total, rather than including the packages they import.
+    """
+    packages = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1000
+    return sum(packages.values()), packages
+
+
+def measure_imports(runs, top):
+    totals = []
+    packages = defaultdict(list)
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="startup-") as directory:
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", IMPORT_MAIN],
+                cwd=directory, env=server_env(), capture_output=True, text=True, timeout=300
+            )
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing main failed:\n{result.stderr[-2000:]}")
+        total, per_package = parse_importtime(result.stderr)
+        totals.append(total)
+        for package, milliseconds in per_package.items():
+            packages[package].append(milliseconds)
+
+    print(f"import main: {statistics.median(totals):.0f} ms (median of {runs}, python -X importtime)")
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, times in ranked[:top]:
+        print(f"  {package:<32} {statistics.median(times):>8.1f} ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def health_ok(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", "/health")
+        return conn.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def measure_health(runs, timeout=120):
+    times = []
+    for _ in range(runs):
+        port = free_port()
+        with tempfile.TemporaryDirectory(prefix="startup-") as directory:
+            start = time.perf_counter()
+            server = subprocess.Popen(
+                [sys.executable, "-c", SERVE_MAIN.format(port=port)],
+                cwd=directory, env=server_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            try:
+                while not health_ok(port):
+                    if server.poll() is not None:
+                        raise RuntimeError(f"The server exited:\n{server.stderr.read().decode()[-2000:]}")
+                    if time.perf_counter() - start > timeout:
+                        raise RuntimeError(f"No /health response within {timeout}s")
+                    time.sleep(0.01)
+                times.append(time.perf_counter() - start)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    median = statistics.median(times) * 1000
+    print(f"time to first /health: {median:.0f} ms (median of {runs}, min {min(times) * 1000:.0f} ms)")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="packages listed by import time")
+    parser.add_argument("--max-health-ms", type=float, help="fail when the median time to /health is above this")
+    args = parser.parse_args()
+
+    measure_imports(args.runs, args.top)
+    median = measure_health(args.runs)
+    if args.max_health_ms is not None and median > args.max_health_ms:
+        print(f"FAIL: time to first /health {median:.0f} ms is above --max-health-ms {args.max_health_ms:.0f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Benchmark write contention between the app, checkpoint and orchestration databases.
+
+Runs parallel chats and bulk indexing against the stores for --seconds, once with all
+stores in one file (the previous layout) and once with a file per store (the default):
+
+- chats: --chats conversations on one AsyncSqliteSaver connection, like the server,
+  each step writing a checkpoint with the growing message list and its writes, and each
+  turn recording usage in the app database;
+- bulk indexing: --indexers threads each running workflows the way the orchestrator
+  does (workflow and activity records) and updating the file status in the app database.
+
+Connections use no busy timeout and retry on "database is locked" after 1 ms, so every
+lock conflict is counted. Reports per store the writes, the retries, and the p50/p99
+write latency (retries included).
+
+Usage:
+    uv run python -m benchmarks.storage_contention [--seconds 10] [--chats 8] [--indexers 4]
+"""
+import os
+import argparse
+import asyncio
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import aiosqlite
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from py_orchestrate.db_manager import SQLiteDatabaseManager
+from py_orchestrate.models import ActivityExecution, WorkflowInstance, WorkflowStatus
+
+from lib.checkpoint_serde import CompressedSerializer
+from lib.database import DatabaseManager
+from lib.storage import CHECKPOINT_TABLES, ORCHESTRATION_TABLES, prepare_database
+
+ACTIVITIES = ["ocr_file_v1", "chunk_file_v1", "embed_chunks_v1", "store_embeddings_v1", "update_indexing_status_v1"]
+MESSAGE_TEXT = "The quarterly report shows revenue growth across all regions, driven by new contracts. " * 20
+
+
+class StoreStats:
+    """Write latencies and lock retries of one store."""
+
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency, retries):
+        with self.lock:
+            self.latencies.append(latency)
+            self.retries += retries
+
+
+class NoWaitDatabaseManager(DatabaseManager):
+    """App database manager whose connections fail at once on a lock."""
+
+    @contextmanager
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=0)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+class NoWaitOrchestrationStore(SQLiteDatabaseManager):
+    """Orchestration store whose connections fail at once on a lock."""
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+def is_locked(error):
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def timed_write(stats, write, *args):
+    retries = 0
+    start = time.perf_counter()
+    while True:
+        try:
+            write(*args)
+            break
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            retries += 1
+            time.sleep(0.001)
+    stats.record(time.perf_counter() - start, retries)
+
+
+async def timed_async_write(stats, conn, write):
+    retries = 0
+    start = time.perf_counter()
+    while True:
+        try:
+            result = await write()
+            break
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            # Drop the failed transaction, whose snapshot may be stale
+            await conn.rollback()
+            retries += 1
+            await asyncio.sleep(0.001)
+    stats.record(time.perf_counter() - start, retries)
+    return result
+
+
+async def chat(index, saver, conn, app_db, deadline, stats):
+    conversation = 0
+    while time.monotonic() < deadline:
+        thread_id = f"chat-{index}-{conversation}"
+        # In a thread like the server's sync routes, so the loop can finish checkpoint commits
+        await asyncio.to_thread(timed_write, stats["app"], app_db.create_conversation, thread_id, "benchmark-user")
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        messages = []
+        for turn in range(6):
+            for message in (HumanMessage(content=MESSAGE_TEXT[:200]), AIMessage(content=MESSAGE_TEXT)):
+                messages = messages + [message]
+                checkpoint = empty_checkpoint()
+                checkpoint["channel_values"] = {"messages": messages}
+
+                async def write():
+                    saved = await saver.aput(config, checkpoint, {"step": len(messages)}, {})
+                    await saver.aput_writes(saved, [("messages", [message])], "task")
+                    return saved
+
+                saved = await timed_async_write(stats["checkpoints"], conn, write)
+                config = saved
+                # Model latency between steps
+                await asyncio.sleep(0.005)
+            await asyncio.to_thread(timed_write, stats["app"], app_db.add_conversation_usage, thread_id, "benchmark-user", 1000, 200, 2, 1500)
+            if time.monotonic() >= deadline:
+                return
+        conversation += 1
+
+
+def index_files(index, orchestration, app_db, deadline, stats):
+    count = 0
+    while time.monotonic() < deadline:
+        file_id = f"file-{index}-{count}"
+        timed_write(stats["app"], app_db.create_file, file_id, "benchmark-user", f"{file_id}.pdf", f"{file_id}.pdf")
+        now = datetime.now()
+        workflow = WorkflowInstance(
+            id=str(uuid.uuid4()), name="index_file_v1", status=WorkflowStatus.PROCESSING, input_data={"file_id": file_id},
+            output_data=None, current_activity=None, error_message=None, created_at=now, updated_at=now
+        )
+        timed_write(stats["orchestration"], orchestration.save_workflow, workflow)
+        timed_write(stats["app"], app_db.update_file_status, file_id, "in_progress")
+        for activity in ACTIVITIES:
+            execution = ActivityExecution(
+                id=str(uuid.uuid4()), workflow_id=workflow.id, activity_name=activity, input_data={"file_id": file_id},
+                output_data=None, status="running", error_message=None, created_at=datetime.now(), completed_at=None
+            )
+            timed_write(stats["orchestration"], orchestration.save_activity_execution, execution)
+            # Activity work
+            time.sleep(0.002)
+            execution.status = "completed"
+            execution.output_data = {"result": MESSAGE_TEXT[:500]}
+            execution.completed_at = datetime.now()
+            timed_write(stats["orchestration"], orchestration.save_activity_execution, execution)
+            workflow.current_activity = activity
+            workflow.updated_at = datetime.now()
+            timed_write(stats["orchestration"], orchestration.save_workflow, workflow)
+        timed_write(stats["app"], app_db.update_file_status, file_id, "completed")
+        count += 1
+
+
+async def run_layout(label, paths, args):
+    app_path, checkpoint_path, orchestration_path = paths
+    prepare_database(checkpoint_path, CHECKPOINT_TABLES, incremental_vacuum=True, legacy_path=app_path)
+    prepare_database(orchestration_path, ORCHESTRATION_TABLES, legacy_path=app_path)
+    app_db = NoWaitDatabaseManager(app_path)
+    orchestration = NoWaitOrchestrationStore(orchestration_path)
+    stats = {"app": StoreStats(), "checkpoints": StoreStats(), "orchestration": StoreStats()}
+
+    async with aiosqlite.connect(checkpoint_path, timeout=0) as conn:
+        saver = AsyncSqliteSaver(conn, serde=CompressedSerializer())
+        await saver.setup()
+        deadline = time.monotonic() + args.seconds
+        indexers = [
+            threading.Thread(target=index_files, args=(index, orchestration, app_db, deadline, stats))
+            for index in range(args.indexers)
+        ]
+        for thread in indexers:
+            thread.start()
+        await asyncio.gather(*(chat(index, saver, conn, app_db, deadline, stats) for index in range(args.chats)))
+        for thread in indexers:
+            await asyncio.to_thread(thread.join)
+
+    print(f"\n{label}:")
+    for store, store_stats in stats.items():
+        latencies = sorted(store_stats.latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"  {store:<14} {len(latencies):>7} writes {store_stats.retries:>7} locked retries"
+            f"   p50 {statistics.median(latencies) * 1000:>7.2f} ms   p99 {p99 * 1000:>7.2f} ms"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--indexers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{args.chats} parallel chats and {args.indexers} indexing workers for {args.seconds:.0f}s per layout")
+    with tempfile.TemporaryDirectory(prefix="storage-contention-") as directory:
+        shared = os.path.join(directory, "shared.db")
+        await run_layout("One shared file (previous layout)", (shared, shared, shared), args)
+        await run_layout("A file per store", tuple(os.path.join(directory, name) for name in ("app.db", "checkpoints.db", "orchestration.db")), args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Benchmark text delta coalescing in the chat stream.
+
+Streams a canned response through `generate_stream` from a fake graph that
+yields one model chunk per token, and reports the frames, bytes, frames/sec and
+CPU time per response for each coalescing setting. The unthrottled run shows the
+CPU cost of framing a response; the paced run emits tokens at --tokens-per-second,
+like a fast model, which is where time-based coalescing applies.
+
+Usage:
+    uv run python -m benchmarks.stream_coalescing [--tokens 20000] [--paced-tokens 1000] [--tokens-per-second 1000]
+"""
+import os
+import argparse
+import asyncio
+import tempfile
+import time
+
+# generate_stream records usage in mock.db in the working directory; keep it out of the real one
+os.chdir(tempfile.mkdtemp(prefix="stream-coalescing-"))
+
+from langchain_core.messages import AIMessageChunk
+from utils.stream_protocol import generate_stream
+
+SETTINGS = [
+    ("off (one frame per chunk)", 0, 0),
+    ("64 chars", 0, 64),
+    ("256 chars", 0, 256),
+    ("10 ms", 10, 0),
+    ("25 ms or 256 chars", 25, 256),
+]
+
+
+class FakeStreamGraph:
+    """Stands in for the agent graph: streams prepared chunks, optionally paced."""
+
+    def __init__(self, chunks, tokens_per_second=None):
+        self.chunks = chunks
+        self.interval = 1 / tokens_per_second if tokens_per_second else None
+
+    async def astream(self, input, config=None, stream_mode=None):
+        started = time.monotonic()
+        for index, chunk in enumerate(self.chunks):
+            if self.interval:
+                delay = started + index * self.interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield chunk, {}
+
+
+def make_chunks(count):
+    words = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", "."]
+    return [AIMessageChunk(content=words[index % len(words)]) for index in range(count)]
+
+
+async def measure(label, graph, coalesce_ms, coalesce_chars):
+    frames = 0
+    size = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    async for frame in generate_stream(graph, [], "benchmark", "benchmark", coalesce_ms=coalesce_ms, coalesce_chars=coalesce_chars):
+        frames += 1
+        size += len(frame)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    print(f"{label:<28} {frames:>8} frames {size / 1024:>9.1f} KiB {frames / wall:>10.0f} frames/s {cpu * 1000:>9.1f} ms CPU")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--paced-tokens", type=int, default=1000)
+    parser.add_argument("--tokens-per-second", type=float, default=1000)
+    args = parser.parse_args()
+
+    graph = FakeStreamGraph(make_chunks(args.tokens))
+    await measure("warm-up", graph, 0, 0)
+    print(f"\nUnthrottled, {args.tokens} chunks per response:")
+    for label, coalesce_ms, coalesce_chars in SETTINGS:
+        await measure(label, graph, coalesce_ms, coalesce_chars)
+
+    graph = FakeStreamGraph(make_chunks(args.paced_tokens), args.tokens_per_second)
+    print(f"\nPaced at {args.tokens_per_second:.0f} chunks/s, {args.paced_tokens} chunks per response:")
+    for label, coalesce_ms, coalesce_chars in SETTINGS:
+        await measure(label, graph, coalesce_ms, coalesce_chars)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""Benchmark the per-chunk work of generate_stream on long responses.
+
+Streams a long response (100k text chunks plus a tool call with streamed
+arguments by default) from a fake graph, and compares `generate_stream` with
+the previous per-chunk bookkeeping, which appended every text chunk and
+argument chunk to strings that were never sent. Reports CPU time and the
+peak memory traced while streaming one response.
+
+Usage:
+    uv run python -m benchmarks.stream_state [--tokens 100000] [--args-chunks 10000] [--repeat 3]
+"""
+import os
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+# generate_stream records usage in mock.db in the working directory; keep it out of the real one
+os.chdir(tempfile.mkdtemp(prefix="stream-state-"))
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from utils.stream_protocol import generate_stream
+
+
+class FakeStreamGraph:
+    """Stands in for the agent graph: streams prepared chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def astream(self, input, config=None, stream_mode=None):
+        for chunk in self.chunks:
+            yield chunk, {}
+
+
+def make_chunks(tokens, args_chunks):
+    chunks = [AIMessageChunk(content="", tool_call_chunks=[{"name": "python", "args": "", "id": "call_1", "index": 0}])]
+    chunks += [
+        AIMessageChunk(content="", tool_call_chunks=[{"name": None, "args": f"x{index} = {index}\\n", "id": None, "index": 0}])
+        for index in range(args_chunks)
+    ]
+    chunks.append(ToolMessage(content="ok", tool_call_id="call_1"))
+    words = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", "."]
+    chunks += [AIMessageChunk(content=words[index % len(words)]) for index in range(tokens)]
+    return chunks
+
+
+async def previous_generate_stream(graph, input_message, conversation_id, userid):
+    """The per-chunk bookkeeping generate_stream did before (text and args accumulated into strings)."""
+    message_id = str(uuid.uuid4())
+    yield f"f:{json.dumps({'messageId': message_id})}\n"
+    tool_calls = {}
+    tool_calls_by_idx = {}
+    accumulated_text = ""
+    token_count = 0
+    async for msg, metadata in graph.astream({"messages": input_message}, stream_mode="messages"):
+        if isinstance(msg, ToolMessage):
+            yield f"a:{json.dumps({'toolCallId': msg.tool_call_id, 'result': msg.content})}\n"
+        elif isinstance(msg, AIMessageChunk) or isinstance(msg, AIMessage):
+            if msg.content:
+                content = str(msg.content)
+                yield f"0:{json.dumps(content)}\n"
+                accumulated_text += content
+                token_count += len(content.split())
+            if hasattr(msg, 'tool_calls') and msg.tool_calls:
+                for tool_call in msg.tool_calls:
+                    tool_call_id = tool_call.get('id', str(uuid.uuid4()))
+                    tool_name = tool_call.get('name', '')
+                    if tool_name == "":
+                        continue
+                    tool_calls_by_idx[len(tool_calls_by_idx)] = tool_call_id
+                    tool_calls[tool_call_id] = {"name": tool_name, "args": ""}
+                    yield f"b:{json.dumps({'toolCallId': tool_call_id, 'toolName': tool_name})}\n"
+            if hasattr(msg, 'tool_call_chunks') and msg.tool_call_chunks:
+                for chunk in msg.tool_call_chunks:
+                    args_chunk = chunk.get("args", "")
+                    tool_call_id = tool_calls_by_idx.get(chunk.get("index", 0), -1)
+                    if tool_call_id != -1 and args_chunk:
+                        tool_calls[tool_call_id]["args"] += args_chunk
+                        yield f"c:{json.dumps({'toolCallId': tool_call_id, 'argsTextDelta': args_chunk})}\n"
+    yield f"d:{json.dumps({'finishReason': 'stop', 'usage': {'promptTokens': token_count, 'completionTokens': token_count}})}\n"
+
+
+async def consume(stream):
+    frames = 0
+    async for _ in stream:
+        frames += 1
+    return frames
+
+
+async def measure(label, stream_factory, repeat):
+    cpu_times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        frames = await consume(stream_factory())
+        cpu_times.append(time.process_time() - start)
+
+    tracemalloc.start()
+    await consume(stream_factory())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<26} {frames:>8} frames {min(cpu_times) * 1000:>9.1f} ms CPU   peak {peak / 1024:>9.1f} KiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=100000)
+    parser.add_argument("--args-chunks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    graph = FakeStreamGraph(make_chunks(args.tokens, args.args_chunks))
+    print(f"One response of {args.tokens} text chunks and {args.args_chunks} tool argument chunks (best of {args.repeat}):")
+    await measure("previous bookkeeping", lambda: previous_generate_stream(graph, [], "benchmark", "benchmark"), args.repeat)
+    await measure("generate_stream", lambda: generate_stream(graph, [], "benchmark", "benchmark"), args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""Process-wide registry of Azure service clients.
+
+Each client is built lazily on first use and then shared by every activity and
+route in the process, so they reuse one HTTP connection pool per service instead
+of opening new sessions (and TLS handshakes) on every call. A client is rebuilt
+when the environment variables it was built from change. The SDKs are imported by
+the builders, so importing this module does not import them.
+"""
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobServiceClient
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from openai import AzureOpenAI
+
+# Load environment variables
+load_dotenv()
+
+
+def _build_blob_service() -> "BlobServiceClient":
+    from azure.storage.blob import BlobServiceClient
+
+    return BlobServiceClient.from_connection_string(
+        os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    )
+
+
+def _build_doc_intelligence() -> "DocumentIntelligenceClient":
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+
+    return DocumentIntelligenceClient(
+        endpoint=os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"),
+        credential=AzureKeyCredential(os.getenv("AZURE_DOCUMENT_INTELLIGENCE_API_KEY"))
+    )
+
+
+def _build_openai_client() -> "AzureOpenAI":
+    from openai import AzureOpenAI
+
+    return AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION")
+    )
+
+
+def _build_search_client() -> "SearchClient":
+    from azure.search.documents import SearchClient
+    from azure.core.credentials import AzureKeyCredential
+
+    return SearchClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
+    )
+
+
+def _build_search_index_client() -> "SearchIndexClient":
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.core.credentials import AzureKeyCredential
+
+    return SearchIndexClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
+    )
+
+
+# Client name -> (factory, environment variables the client is built from)
+_CLIENT_SPECS: Dict[str, Tuple[Callable[[], Any], Tuple[str, ...]]] = {
+    "blob_service": (_build_blob_service, ("AZURE_STORAGE_CONNECTION_STRING",)),
+    "doc_intelligence": (_build_doc_intelligence, ("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT", "AZURE_DOCUMENT_INTELLIGENCE_API_KEY")),
+    "openai_client": (_build_openai_client, ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_VERSION")),
+    "search_client": (_build_search_client, ("AZURE_SEARCH_ENDPOINT", "AZURE_SEARCH_INDEX_NAME", "AZURE_SEARCH_API_KEY")),
+    "search_index_client": (_build_search_index_client, ("AZURE_SEARCH_ENDPOINT", "AZURE_SEARCH_API_KEY")),
+}
+
+
+class AzureClientRegistry:
+    """Lazily constructed, shared Azure service clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Client name -> (config the client was built from, client)
+        self._clients: Dict[str, Tuple[Tuple[Any, ...], Any]] = {}
+        # Client name -> client used instead of building one, whatever the configuration
+        self._overrides: Dict[str, Any] = {}
+
+    def get(self, name: str) -> Any:
+        """Get a client by name, building it on first use or after its configuration changed."""
+        override = self._overrides.get(name)
+        if override is not None:
+            return override
+
+        factory, env_vars = _CLIENT_SPECS[name]
+        config = tuple(os.getenv(var) for var in env_vars)
+
+        entry = self._clients.get(name)
+        if entry is not None and entry[0] == config:
+            return entry[1]
+
+        with self._lock:
+            entry = self._clients.get(name)
+            if entry is None or entry[0] != config:
+                # A client built from stale config is dropped rather than closed,
+                # since other threads may still be using it.
+                entry = (config, factory())
+                self._clients[name] = entry
+            return entry[1]
+
+    def override(self, name: str, client: Any) -> None:
+        """Use `client` as the client `name` until reset(), e.g. a local stand-in for offline benchmarks."""
+        if name not in _CLIENT_SPECS:
+            raise KeyError(f"Unknown Azure client: {name}")
+        with self._lock:
+            self._overrides[name] = client
+
+    def reset(self) -> None:
+        """Close and forget all clients and overrides; clients are rebuilt on next use."""
+        with self._lock:
+            clients = [client for _, client in self._clients.values()] + list(self._overrides.values())
+            self._clients.clear()
+            self._overrides.clear()
+
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    @property
+    def blob_service(self) -> "BlobServiceClient":
+        return self.get("blob_service")
+
+    @property
+    def doc_intelligence(self) -> "DocumentIntelligenceClient":
+        return self.get("doc_intelligence")
+
+    @property
+    def openai_client(self) -> "AzureOpenAI":
+        return self.get("openai_client")
+
+    @property
+    def search_client(self) -> "SearchClient":
+        return self.get("search_client")
+
+    @property
+    def search_index_client(self) -> "SearchIndexClient":
+        return self.get("search_index_client")
+
+
+# Global Azure client registry instance
+azure_clients = AzureClientRegistry()
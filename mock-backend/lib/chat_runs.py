@@ -0,0 +1,260 @@
+"""Chat runs executed in the background, decoupled from the HTTP responses streaming them.
+
+A run's stream-protocol frames are numbered from 0 and kept in a bounded ring buffer,
+so a client that lost its connection can resume with GET /runs/{run_id}/stream?from=<seq>
+instead of asking again. A run nobody follows anymore is stopped after
+RUN_DETACHED_TIMEOUT_SECONDS, and a finished run is kept RUN_RETENTION_SECONDS for late
+reconnects.
+
+Runs are tracked per process: with several server workers, stop and resume requests only
+reach runs of the worker that receives them. Which run is in progress for a conversation
+is also recorded in the app database, so no two workers run the same conversation.
+"""
+import os
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+from dotenv import load_dotenv
+
+from lib.database import db_manager
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per run for resuming streams
+RUN_BUFFER_FRAMES = int(os.getenv("RUN_BUFFER_FRAMES", "4096"))
+
+# How long a finished run can still be resumed
+RUN_RETENTION_SECONDS = float(os.getenv("RUN_RETENTION_SECONDS", "300"))
+
+# How long a run continues without any client following it before it is stopped
+RUN_DETACHED_TIMEOUT_SECONDS = float(os.getenv("RUN_DETACHED_TIMEOUT_SECONDS", "30"))
+
+# How often a stream checks whether its client is still connected
+STREAM_DISCONNECT_POLL_SECONDS = float(os.getenv("STREAM_DISCONNECT_POLL_SECONDS", "1"))
+
+
+class RunInProgress(Exception):
+    """A run is already in progress for the conversation, in this worker or another."""
+
+    def __init__(self, run_id: str):
+        super().__init__(f"Run {run_id} is in progress")
+        self.run_id = run_id
+
+
+class ChatRun:
+    """A background chat run and the ring buffer of the frames it produced."""
+
+    __slots__ = (
+        "run_id", "conversation_id", "userid", "frames", "first_seq", "done", "finished_at",
+        "subscribers", "task", "_waiter", "_on_detached", "_detached_timer"
+    )
+
+    def __init__(self, conversation_id: str, userid: str, on_detached: Callable[[], None], buffer_frames: int = RUN_BUFFER_FRAMES):
+        self.run_id = str(uuid.uuid4())
+        self.conversation_id = conversation_id
+        self.userid = userid
+        self.frames: Deque[str] = deque(maxlen=buffer_frames)
+        # Sequence number of frames[0]
+        self.first_seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Resolved on the next change, created only while a subscriber waits
+        self._waiter: Optional[asyncio.Future] = None
+        self._on_detached = on_detached
+        self._detached_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def next_seq(self) -> int:
+        """Sequence number the next frame will get."""
+        return self.first_seq + len(self.frames)
+
+    def _notify(self) -> None:
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    def append(self, frame: str) -> None:
+        if len(self.frames) == self.frames.maxlen:
+            self.first_seq += 1
+        self.frames.append(frame)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        if self._detached_timer is not None:
+            self._detached_timer.cancel()
+            self._detached_timer = None
+        self._notify()
+
+    async def _changed(self, timeout: float) -> None:
+        if self._waiter is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            # Shielded: a subscriber timing out must not cancel the future the others wait on
+            await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def follow(self, from_seq: int = 0, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+        """Yield the frames from sequence number from_seq on, then new frames until the run ends.
+
+        Ends early when the client is gone or falls more than the buffer size behind.
+
+        Args:
+            from_seq: Sequence number of the first frame to send
+            is_disconnected: Tells whether the client is gone, e.g. Request.is_disconnected
+        """
+        seq = from_seq
+        self.subscribers += 1
+        if self._detached_timer is not None:
+            self._detached_timer.cancel()
+            self._detached_timer = None
+        try:
+            while True:
+                while seq < self.next_seq:
+                    if seq < self.first_seq:
+                        logger.warning(f"Client of run {self.run_id} fell behind the buffered frames; ending its stream")
+                        return
+                    yield self.frames[seq - self.first_seq]
+                    seq += 1
+                if self.done:
+                    return
+                await self._changed(STREAM_DISCONNECT_POLL_SECONDS)
+                if seq == self.next_seq and not self.done and is_disconnected is not None and await is_disconnected():
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                logger.info(f"No client follows run {self.run_id}; stopping it in {RUN_DETACHED_TIMEOUT_SECONDS}s unless one resumes")
+                self._detached_timer = asyncio.get_running_loop().call_later(RUN_DETACHED_TIMEOUT_SECONDS, self._on_detached)
+
+
+class ChatRunRegistry:
+    """Background chat runs by run ID, and the tasks driving the agent graph by conversation ID."""
+
+    def __init__(self):
+        self._runs: Dict[str, ChatRun] = {}
+        self._active_runs: Dict[str, ChatRun] = {}
+        self._graph_tasks: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def start(self, conversation_id: str, userid: str, frames: AsyncIterator[str]) -> ChatRun:
+        """Run a frame stream in the background, buffering its frames.
+
+        Must be called from the event loop.
+
+        Args:
+            conversation_id: Conversation the run answers in
+            userid: User the run belongs to; only they can follow it
+            frames: Stream-protocol frames of the run, e.g. from generate_stream
+
+        Returns:
+            ChatRun: The started run
+
+        Raises:
+            RunInProgress: A run of the conversation is in progress, in this worker or another
+        """
+        run = ChatRun(conversation_id, userid, on_detached=lambda: self._stop_detached(run))
+        # No await in between, so no other run of this worker can start before the claim
+        active_run = self.active_run(conversation_id)
+        if active_run is not None:
+            raise RunInProgress(active_run.run_id)
+        other_run_id = db_manager.claim_active_run(conversation_id, run.run_id)
+        if other_run_id is not None:
+            raise RunInProgress(other_run_id)
+
+        with self._lock:
+            self._purge_finished()
+            self._runs[run.run_id] = run
+            self._active_runs[conversation_id] = run
+        run.task = asyncio.create_task(self._pump(run, frames))
+        return run
+
+    async def _pump(self, run: ChatRun, frames: AsyncIterator[str]) -> None:
+        try:
+            async for frame in frames:
+                run.append(frame)
+        except Exception as e:
+            logger.error(f"Run {run.run_id} failed: {str(e)}")
+        finally:
+            run.finish()
+            with self._lock:
+                if self._active_runs.get(run.conversation_id) is run:
+                    del self._active_runs[run.conversation_id]
+            try:
+                db_manager.release_active_run(run.conversation_id, run.run_id)
+            except Exception as e:
+                # A marker left behind is taken over once this process is gone
+                logger.warning(f"Failed to release run {run.run_id} of conversation {run.conversation_id}: {str(e)}")
+
+    def _stop_detached(self, run: ChatRun) -> None:
+        if run.subscribers == 0 and not run.done:
+            logger.info(f"Stopping run {run.run_id}, which no client followed for {RUN_DETACHED_TIMEOUT_SECONDS}s")
+            self.stop(run.conversation_id)
+
+    def _purge_finished(self) -> None:
+        now = time.monotonic()
+        expired = [run_id for run_id, run in self._runs.items() if run.done and now - run.finished_at > RUN_RETENTION_SECONDS]
+        for run_id in expired:
+            del self._runs[run_id]
+
+    def get(self, run_id: str) -> Optional[ChatRun]:
+        """Get a run that is in progress or can still be resumed."""
+        with self._lock:
+            self._purge_finished()
+            return self._runs.get(run_id)
+
+    def active_run(self, conversation_id: str) -> Optional[ChatRun]:
+        """Get the run of a conversation that is in progress, if any."""
+        with self._lock:
+            return self._active_runs.get(conversation_id)
+
+    def register(self, conversation_id: str, task: asyncio.Task) -> None:
+        """Track the task driving the graph for a conversation until it is done."""
+        with self._lock:
+            self._graph_tasks[conversation_id] = task
+        task.add_done_callback(lambda done: self._unregister(conversation_id, done))
+
+    def _unregister(self, conversation_id: str, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._graph_tasks.get(conversation_id) is task:
+                del self._graph_tasks[conversation_id]
+
+    def is_running(self, conversation_id: str) -> bool:
+        """Whether a run of the conversation is in progress."""
+        with self._lock:
+            task = self._graph_tasks.get(conversation_id)
+        return task is not None and not task.done()
+
+    async def wait(self, conversation_id: str) -> None:
+        """Wait until the task driving the graph for a conversation, if any, is done."""
+        with self._lock:
+            task = self._graph_tasks.get(conversation_id)
+        if task is not None:
+            await asyncio.wait({task})
+
+    def stop(self, conversation_id: str) -> bool:
+        """Cancel the run of a conversation; returns False if none is in progress."""
+        with self._lock:
+            task = self._graph_tasks.get(conversation_id)
+        if task is None or task.done():
+            return False
+        # Safe from sync endpoints too, which run in a worker thread
+        task.get_loop().call_soon_threadsafe(task.cancel)
+        logger.info(f"Stopping the run of conversation {conversation_id}")
+        return True
+
+
+# Global chat run registry
+chat_runs = ChatRunRegistry()
@@ -0,0 +1,380 @@
+"""Retention, cleanup, compaction and size metrics for the LangGraph checkpoint tables.
+
+AsyncSqliteSaver writes a full checkpoint (all state channels) per super-step and never
+deletes any. Only the latest checkpoint of a thread is needed to continue a conversation,
+so older ones are pruned: each thread keeps its CHECKPOINT_KEEP_LATEST latest checkpoints,
+and threads idle for CHECKPOINT_IDLE_SECONDS keep only their latest. The history returned
+by get_state_history is limited accordingly. The checkpoints of deleted conversations are
+deleted after the conversation, and the compaction sweeps those of threads without a
+conversation (e.g. deleted before this cleanup existed, or while the server stopped).
+
+Deletes run in small batches, each in its own short transaction, so chat runs writing
+checkpoints meanwhile only wait for one batch. Freed pages are returned to the file system
+with incremental VACUUM, which requires auto_vacuum=INCREMENTAL; existing databases are
+converted once with `python -m lib.checkpoint_maintenance --enable-incremental-vacuum`.
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass
+from langgraph.checkpoint.base.id import UUID
+from dotenv import load_dotenv
+
+from lib.database import db_manager
+from lib.storage import CHECKPOINT_DB_PATH
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints kept per thread
+CHECKPOINT_KEEP_LATEST = int(os.getenv("CHECKPOINT_KEEP_LATEST", "20"))
+
+# Threads without a new checkpoint for this long keep only their latest one
+CHECKPOINT_IDLE_SECONDS = float(os.getenv("CHECKPOINT_IDLE_SECONDS", str(7 * 24 * 3600)))
+
+# How often the background compaction runs (0 = never)
+CHECKPOINT_COMPACTION_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL_SECONDS", "3600"))
+
+# Checkpoints deleted per transaction
+CHECKPOINT_DELETE_BATCH_SIZE = int(os.getenv("CHECKPOINT_DELETE_BATCH_SIZE", "200"))
+
+# Pages freed per incremental VACUUM step
+CHECKPOINT_VACUUM_PAGES = int(os.getenv("CHECKPOINT_VACUUM_PAGES", "1000"))
+
+# Offset of the UUID (v1/v6) timestamp epoch, 1582-10-15, from the Unix epoch, in 100 ns
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+@dataclass
+class ThreadStorage:
+    """Checkpoint storage used by a thread (conversation)."""
+    thread_id: str
+    checkpoints: int
+    writes: int
+    bytes: int  # checkpoint, metadata and write blobs
+    last_checkpoint_at: Optional[float] = None  # epoch timestamp
+
+
+@dataclass
+class CompactionStats:
+    """Outcome of one compaction."""
+    orphaned_threads_deleted: int
+    threads_pruned: int
+    checkpoints_deleted: int
+    writes_deleted: int
+    pages_freed: int
+    duration_ms: int
+
+
+def checkpoint_time(checkpoint_id: str) -> Optional[float]:
+    """Creation time (epoch seconds) encoded in a LangGraph checkpoint ID (a UUID v6)."""
+    try:
+        return (UUID(checkpoint_id).time - UUID_EPOCH_OFFSET) / 1e7
+    except ValueError:
+        return None
+
+
+class CheckpointMaintenance:
+    """Prunes and compacts the checkpoint tables of a SQLite database."""
+
+    def __init__(
+        self,
+        db_path: str = CHECKPOINT_DB_PATH,
+        keep_latest: int = CHECKPOINT_KEEP_LATEST,
+        idle_seconds: float = CHECKPOINT_IDLE_SECONDS,
+        batch_size: int = CHECKPOINT_DELETE_BATCH_SIZE,
+        vacuum_pages: int = CHECKPOINT_VACUUM_PAGES
+    ):
+        self.db_path = db_path
+        self.keep_latest = max(1, keep_latest)
+        self.idle_seconds = idle_seconds
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._warned_auto_vacuum = False
+
+    @contextmanager
+    def get_connection(self):
+        """Get database connection with context manager."""
+        # Wait for chat runs holding the write lock rather than failing
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _has_checkpoint_tables(self, conn: sqlite3.Connection) -> bool:
+        cursor = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('checkpoints', 'writes')")
+        return cursor.fetchone()[0] == 2
+
+    def _expired_checkpoints(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str, keep: int) -> List[str]:
+        cursor = conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, keep)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _delete_checkpoints(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str, checkpoint_ids: List[str]) -> Tuple[int, int]:
+        checkpoints_deleted = 0
+        writes_deleted = 0
+        for start in range(0, len(checkpoint_ids), self.batch_size):
+            keys = [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in checkpoint_ids[start:start + self.batch_size]]
+            # One short transaction per batch
+            with conn:
+                writes_deleted += conn.executemany(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", keys
+                ).rowcount
+                checkpoints_deleted += conn.executemany(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", keys
+                ).rowcount
+        return checkpoints_deleted, writes_deleted
+
+    def _delete_thread(self, conn: sqlite3.Connection, thread_id: str) -> Tuple[int, int]:
+        counts = []
+        for table in ("writes", "checkpoints"):
+            deleted = 0
+            while True:
+                # One short transaction per batch
+                with conn:
+                    rowcount = conn.execute(
+                        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE thread_id = ? LIMIT ?)",
+                        (thread_id, self.batch_size)
+                    ).rowcount
+                deleted += rowcount
+                if rowcount < self.batch_size:
+                    break
+            counts.append(deleted)
+        return counts[1], counts[0]
+
+    def delete_thread(self, thread_id: str) -> Tuple[int, int]:
+        """Delete all checkpoints and writes of a thread, e.g. of a deleted conversation.
+
+        Args:
+            thread_id: Thread (conversation) ID
+
+        Returns:
+            Tuple[int, int]: Checkpoints deleted, writes deleted
+        """
+        with self.get_connection() as conn:
+            if not self._has_checkpoint_tables(conn):
+                return 0, 0
+            checkpoints_deleted, writes_deleted = self._delete_thread(conn, thread_id)
+        logger.info(f"Deleted {checkpoints_deleted} checkpoints and {writes_deleted} writes of thread {thread_id}")
+        return checkpoints_deleted, writes_deleted
+
+    def sweep_orphaned_threads(self) -> Tuple[int, int, int]:
+        """Delete the checkpoints and writes of threads whose conversation no longer exists.
+
+        Returns:
+            Tuple[int, int, int]: Threads deleted, checkpoints deleted, writes deleted
+        """
+        with self.get_connection() as conn:
+            if not self._has_checkpoint_tables(conn):
+                return 0, 0, 0
+            thread_ids = [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints UNION SELECT DISTINCT thread_id FROM writes").fetchall()]
+            existing = db_manager.get_existing_conversation_ids(thread_ids)
+            orphans = [thread_id for thread_id in thread_ids if thread_id not in existing]
+            checkpoints_deleted = writes_deleted = 0
+            for thread_id in orphans:
+                if self._stop.is_set():
+                    break
+                deleted = self._delete_thread(conn, thread_id)
+                checkpoints_deleted += deleted[0]
+                writes_deleted += deleted[1]
+        return len(orphans), checkpoints_deleted, writes_deleted
+
+    def prune(self, now: Optional[float] = None) -> Tuple[int, int, int]:
+        """Delete the checkpoints (and their writes) beyond the retention of each thread.
+
+        Args:
+            now: Current epoch time, to decide which threads are idle
+
+        Returns:
+            Tuple[int, int, int]: Threads pruned, checkpoints deleted, writes deleted
+        """
+        now = time.time() if now is None else now
+        threads_pruned = checkpoints_deleted = writes_deleted = 0
+        with self.get_connection() as conn:
+            if not self._has_checkpoint_tables(conn):
+                return 0, 0, 0
+            namespaces = conn.execute(
+                "SELECT thread_id, checkpoint_ns, COUNT(*), MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > 1"
+            ).fetchall()
+            for thread_id, checkpoint_ns, count, latest_id in namespaces:
+                latest_at = checkpoint_time(latest_id)
+                idle = latest_at is not None and now - latest_at > self.idle_seconds
+                keep = 1 if idle else self.keep_latest
+                if count <= keep:
+                    continue
+                expired = self._expired_checkpoints(conn, thread_id, checkpoint_ns, keep)
+                deleted = self._delete_checkpoints(conn, thread_id, checkpoint_ns, expired)
+                threads_pruned += 1
+                checkpoints_deleted += deleted[0]
+                writes_deleted += deleted[1]
+        return threads_pruned, checkpoints_deleted, writes_deleted
+
+    def incremental_vacuum(self) -> int:
+        """Return free pages to the file system, a few at a time.
+
+        Returns:
+            int: Pages freed (0 unless the database uses auto_vacuum=INCREMENTAL)
+        """
+        with self.get_connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                if not self._warned_auto_vacuum:
+                    logger.warning(
+                        f"{self.db_path} does not use incremental auto-vacuum, so pruned checkpoints only free pages for reuse; "
+                        "run `python -m lib.checkpoint_maintenance --enable-incremental-vacuum` once to enable it"
+                    )
+                    self._warned_auto_vacuum = True
+                return 0
+            free_before = free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # One short write transaction per step
+            while free_pages > 0 and not self._stop.is_set():
+                conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+                free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages < free_before:
+                # Copy the vacuumed pages into the database file, which shrinks it; never waits for readers or writers
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            return free_before - free_pages
+
+    def enable_incremental_vacuum(self) -> None:
+        """Switch the database to auto_vacuum=INCREMENTAL, rewriting it once with a full VACUUM.
+
+        The VACUUM locks the database until done; run it while the server is stopped.
+        """
+        with self.get_connection() as conn:
+            conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+            conn.execute("VACUUM")
+
+    def compact(self) -> CompactionStats:
+        """Delete the checkpoints of orphaned threads and beyond retention, then free the pages they used."""
+        started = time.monotonic()
+        orphaned_threads_deleted, orphaned_checkpoints, orphaned_writes = self.sweep_orphaned_threads()
+        threads_pruned, checkpoints_deleted, writes_deleted = self.prune()
+        checkpoints_deleted += orphaned_checkpoints
+        writes_deleted += orphaned_writes
+        pages_freed = self.incremental_vacuum()
+        stats = CompactionStats(
+            orphaned_threads_deleted=orphaned_threads_deleted,
+            threads_pruned=threads_pruned,
+            checkpoints_deleted=checkpoints_deleted,
+            writes_deleted=writes_deleted,
+            pages_freed=pages_freed,
+            duration_ms=int((time.monotonic() - started) * 1000)
+        )
+        logger.info(
+            f"Checkpoint compaction: deleted {stats.orphaned_threads_deleted} orphaned threads, pruned {stats.threads_pruned} threads, deleted {stats.checkpoints_deleted} checkpoints "
+            f"and {stats.writes_deleted} writes, freed {stats.pages_freed} pages in {stats.duration_ms} ms"
+        )
+        return stats
+
+    def get_thread_storage(self, thread_id: Optional[str] = None, limit: Optional[int] = None) -> List[ThreadStorage]:
+        """Get the checkpoint storage of one thread, or of all threads by size, largest first.
+
+        Args:
+            thread_id: Only this thread
+            limit: At most this many threads
+
+        Returns:
+            List[ThreadStorage]: Storage per thread
+        """
+        with self.get_connection() as conn:
+            if not self._has_checkpoint_tables(conn):
+                return []
+            where = "WHERE thread_id = ?" if thread_id is not None else ""
+            params: List[Any] = [thread_id] if thread_id is not None else []
+            query = f"""
+                SELECT thread_id, SUM(checkpoints), SUM(writes), SUM(bytes), MAX(latest_id) FROM (
+                    SELECT thread_id, COUNT(*) AS checkpoints, 0 AS writes,
+                           SUM(LENGTH(checkpoint) + LENGTH(metadata)) AS bytes, MAX(checkpoint_id) AS latest_id
+                    FROM checkpoints {where} GROUP BY thread_id
+                    UNION ALL
+                    SELECT thread_id, 0, COUNT(*), SUM(LENGTH(value)), NULL
+                    FROM writes {where} GROUP BY thread_id
+                )
+                GROUP BY thread_id
+                ORDER BY SUM(bytes) DESC
+            """
+            if limit is not None:
+                query += " LIMIT ?"
+                params = params + params + [limit]
+            else:
+                params = params + params
+            rows = conn.execute(query, params).fetchall()
+        return [
+            ThreadStorage(
+                thread_id=row[0],
+                checkpoints=row[1],
+                writes=row[2],
+                bytes=row[3] or 0,
+                last_checkpoint_at=checkpoint_time(row[4]) if row[4] else None
+            )
+            for row in rows
+        ]
+
+    def get_database_size(self) -> Dict[str, int]:
+        """Get the size of the database file, its write-ahead log, and its free pages."""
+        with self.get_connection() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        wal_path = f"{self.db_path}-wal"
+        return {
+            "file_bytes": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+            "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            "page_size": page_size,
+            "page_count": page_count,
+            "free_pages": freelist_count,
+            "incremental_vacuum": auto_vacuum == AUTO_VACUUM_INCREMENTAL
+        }
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Checkpoint compaction failed: {str(e)}")
+
+    def start(self, interval: float = CHECKPOINT_COMPACTION_INTERVAL_SECONDS) -> None:
+        """Run the compaction every `interval` seconds in a background thread."""
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="checkpoint-compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background compaction."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Global checkpoint maintenance, for the checkpointer database of agent/graph.py
+checkpoint_maintenance = CheckpointMaintenance()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Prune and compact the checkpoint database.")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="convert the database to incremental auto-vacuum (full VACUUM; stop the server first)")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        checkpoint_maintenance.enable_incremental_vacuum()
+    checkpoint_maintenance.compact()
+    print(checkpoint_maintenance.get_database_size())
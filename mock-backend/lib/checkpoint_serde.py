@@ -0,0 +1,162 @@
+"""Compressed serializer for LangGraph checkpoints.
+
+Checkpoints hold the full message list of a conversation, including long search tool
+outputs, so they compress well. CompressedSerializer wraps the checkpointer's serializer
+and compresses serialized values of CHECKPOINT_COMPRESSION_MIN_BYTES or more, with zstd
+when the zstandard package is installed (it comes with langsmith) and zlib otherwise.
+Both use a preset dictionary of the field names and module paths every checkpoint
+repeats, which matters most for the many small values (single messages, writes).
+
+Compressed values are tagged "<type>+<codec>" like LangGraph's EncryptedSerializer, so
+rows written before compression, or with another codec, are still read. The dictionary is
+part of the codec name: never change _DICTIONARY_V1, add a new version instead.
+
+CHECKPOINT_COMPRESSION forces a codec: "auto" (default), "zstd", "zlib" or "none".
+"""
+import os
+import zlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Smaller values are stored as they are
+CHECKPOINT_COMPRESSION_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESSION_MIN_BYTES", "512"))
+
+# Strings repeated in serialized checkpoints and messages; the most frequent last, as
+# matches closer to the end of a preset dictionary are cheaper to encode
+_DICTIONARY_V1 = b"".join([
+    b"[Showing results; tokens elided to stay within the -token budget (results omitted, truncated)",
+    b"results with duplicate content skipped; tokens of overlap between neighbouring chunks shown once.",
+    b"# .pdf .docx - chunk_id/id: ",
+    b"search_documents azure_search_documents azure_search_semantic azure_search_filter azure_search_vector hybrid_search web_search get_current_time python",
+    b"model_validate_json langchain_core.messages.system SystemMessage langchain_core.messages.human HumanMessage human",
+    b"versions_seen pending_sends updated_channels channel_versions branch:to:agent branch:to:tools branch:to:context __start__ summarized_through summary",
+    b"finish_reason stop tool_calls model_name system_fingerprint logprobs token_usage prompt_tokens completion_tokens",
+    b" input_token_details output_token_details cache_read reasoning audio",
+    b"langchain_core.messages.tool ToolMessage tool_call_id artifact status success tool_call",
+    b"langchain_core.messages.ai AIMessage ai additional_kwargs response_metadata invalid_tool_calls",
+    b" usage_metadata input_tokens output_tokens total_tokens tool_calls args query type name id content messages channel_values",
+])
+
+Codec = Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]
+
+
+def _zstd_codec(dictionary: bytes) -> Codec:
+    import zstandard
+
+    compression_dict = zstandard.ZstdCompressionDict(dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    compression_dict.precompute_compress(level=3)
+    # Compression contexts must not be used by several threads at once
+    contexts = threading.local()
+
+    def compress(data: bytes) -> bytes:
+        compressor = getattr(contexts, "compressor", None)
+        if compressor is None:
+            compressor = contexts.compressor = zstandard.ZstdCompressor(level=3, dict_data=compression_dict)
+        return compressor.compress(data)
+
+    def decompress(data: bytes) -> bytes:
+        decompressor = getattr(contexts, "decompressor", None)
+        if decompressor is None:
+            decompressor = contexts.decompressor = zstandard.ZstdDecompressor(dict_data=compression_dict)
+        return decompressor.decompress(data)
+
+    return compress, decompress
+
+
+def _zlib_codec(dictionary: bytes) -> Codec:
+    def compress(data: bytes) -> bytes:
+        compressor = zlib.compressobj(level=6, zdict=dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(data: bytes) -> bytes:
+        decompressor = zlib.decompressobj(zdict=dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    return compress, decompress
+
+
+# Codec name (as stored in the type tag) -> factory; the names include the dictionary version
+CODEC_FACTORIES: Dict[str, Callable[[], Codec]] = {
+    "zstd-d1": lambda: _zstd_codec(_DICTIONARY_V1),
+    "zlib-d1": lambda: _zlib_codec(_DICTIONARY_V1),
+}
+
+# CHECKPOINT_COMPRESSION value -> codec name written
+CODEC_NAMES = {"zstd": "zstd-d1", "zlib": "zlib-d1"}
+
+
+class CompressedSerializer(SerializerProtocol):
+    """Serializer that compresses the values of another serializer above a size threshold."""
+
+    def __init__(
+        self,
+        serde: Optional[SerializerProtocol] = None,
+        compression: str = "auto",
+        min_bytes: int = CHECKPOINT_COMPRESSION_MIN_BYTES
+    ):
+        """
+        Args:
+            serde: Serializer whose values are compressed (default: JsonPlusSerializer)
+            compression: "auto" (zstd if installed, else zlib), "zstd", "zlib" or "none"
+            min_bytes: Values smaller than this are stored uncompressed
+        """
+        self.serde = serde or JsonPlusSerializer()
+        self.min_bytes = min_bytes
+        self._codecs: Dict[str, Codec] = {}
+        self.codec_name = self._select_codec(compression)
+
+    def _codec(self, name: str) -> Codec:
+        codec = self._codecs.get(name)
+        if codec is None:
+            codec = self._codecs[name] = CODEC_FACTORIES[name]()
+        return codec
+
+    def _select_codec(self, compression: str) -> Optional[str]:
+        if compression == "none":
+            return None
+        for choice in (["zstd", "zlib"] if compression == "auto" else [compression]):
+            if choice not in CODEC_NAMES:
+                raise ValueError(f"Unknown CHECKPOINT_COMPRESSION: {compression}")
+            try:
+                self._codec(CODEC_NAMES[choice])
+                return CODEC_NAMES[choice]
+            except ImportError:
+                continue
+        logger.warning(f"Checkpoint compression '{compression}' is not installed; using zlib")
+        return CODEC_NAMES["zlib"]
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        typ, data = self.serde.dumps_typed(obj)
+        if self.codec_name is None or len(data) < self.min_bytes:
+            return typ, data
+        compress, _ = self._codec(self.codec_name)
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            return typ, data
+        return f"{typ}+{self.codec_name}", compressed
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        typ, payload = data
+        if "+" in typ:
+            inner_typ, codec_name = typ.rsplit("+", 1)
+            if codec_name in CODEC_FACTORIES:
+                _, decompress = self._codec(codec_name)
+                return self.serde.loads_typed((inner_typ, decompress(payload)))
+        # Written uncompressed, e.g. before compression was enabled
+        return self.serde.loads_typed(data)
+
+
+def get_checkpoint_serializer() -> SerializerProtocol:
+    """Get the checkpoint serializer configured by CHECKPOINT_COMPRESSION."""
+    serializer = CompressedSerializer(compression=os.getenv("CHECKPOINT_COMPRESSION", "auto"))
+    logger.info(f"Checkpoint compression: {serializer.codec_name or 'none'}")
+    return serializer
@@ -1,10 +1,20 @@
 """Database models and operations for conversation metadata."""
+import os
+import json
 import sqlite3
 import time
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Set
 from contextlib import contextmanager
 from dataclasses import dataclass
 
+from lib.storage import APP_DB_PATH
+from lib.metrics import timed, sqlite_query_duration_seconds
+from lib.tracing import traced
+
+# A re-indexing job created or restarted, whose driver workflow is not started yet, counts
+# as running for this long; the worker starting it may have died before it could
+REINDEX_START_TIMEOUT_SECONDS = 60
+
 
 @dataclass
 class ConversationMetadata:
@@ -15,6 +25,20 @@ class ConversationMetadata:
     created_at: int  # epoch timestamp
 
 
+@dataclass
+class ConversationUsage:
+    """Token usage and latency totals of a conversation."""
+    conversation_id: str
+    userid: str
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    llm_calls: int  # model invocations, including tool-loop steps and summaries
+    runs: int  # chat requests answered
+    duration_ms: int  # total streaming time of all runs
+    updated_at: int  # epoch timestamp
+
+
 @dataclass
 class FileMetadata:
     """File metadata model."""
@@ -29,10 +53,57 @@ class FileMetadata:
     workflow_id: Optional[str] = None  # orchestration workflow ID
 
 
+@dataclass
+class ReindexJob:
+    """Bulk re-indexing job model."""
+    job_id: str
+    status: str  # "pending", "in_progress", "completed", "failed"
+    filters: Dict[str, Any]
+    max_concurrency: int
+    created_at: int  # epoch timestamp
+    updated_at: int  # epoch timestamp
+    workflow_id: Optional[str] = None  # orchestration workflow ID of the driver
+    progress: Optional[Dict[str, int]] = None  # item counts per status
+
+
+@dataclass
+class ReindexJobItem:
+    """A single file within a bulk re-indexing job."""
+    job_id: str
+    file_id: str
+    status: str  # "pending", "in_progress", "completed", "failed"
+    workflow_id: Optional[str] = None  # index_file_v1 workflow ID
+    error_message: Optional[str] = None
+
+
+def _process_exists(pid: int) -> bool:
+    """Whether a process with this ID runs on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, under another user
+        return True
+    return True
+
+
+def instrument_queries(cls):
+    """Observe the duration of every call of the public methods of a database manager in
+    sqlite_query_duration_seconds, and trace the calls made within a traced request.
+    """
+    for name, member in list(vars(cls).items()):
+        if callable(member) and not name.startswith("_") and name not in ("get_connection", "init_db"):
+            member = traced(f"db.{name}", child_only=True)(member)
+            setattr(cls, name, timed(sqlite_query_duration_seconds, method=name)(member))
+    return cls
+
+
+@instrument_queries
 class DatabaseManager:
     """Database manager for conversation metadata."""
     
-    def __init__(self, db_path: str = "mock.db"):
+    def __init__(self, db_path: str = APP_DB_PATH):
         self.db_path = db_path
         self.init_db()
     
@@ -49,6 +120,9 @@ class DatabaseManager:
     def init_db(self):
         """Initialize the database with the required schema."""
         with self.get_connection() as conn:
+            # Readers never wait for writers; persistent for the file
+            conn.execute("PRAGMA journal_mode=WAL")
+
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS conversations (
                     id TEXT PRIMARY KEY,
@@ -58,6 +132,21 @@ class DatabaseManager:
                 )
             """)
             
+            # Create table for token usage totals per conversation
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_usage (
+                    conversation_id TEXT PRIMARY KEY,
+                    userid TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    total_tokens INTEGER NOT NULL DEFAULT 0,
+                    llm_calls INTEGER NOT NULL DEFAULT 0,
+                    runs INTEGER NOT NULL DEFAULT 0,
+                    duration_ms INTEGER NOT NULL DEFAULT 0,
+                    updated_at INTEGER NOT NULL
+                )
+            """)
+            
             # Create files table
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS files (
@@ -92,6 +181,12 @@ class DatabaseManager:
                 ON conversations(userid, created_at DESC)
             """)
             
+            # Create index for usage totals by userid
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversation_usage_userid 
+                ON conversation_usage(userid)
+            """)
+            
             # Create index for files by userid
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_files_userid 
@@ -104,6 +199,46 @@ class DatabaseManager:
                 ON files(status)
             """)
             
+            # Create tables for bulk re-indexing jobs
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reindex_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    filters TEXT NOT NULL,
+                    max_concurrency INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    workflow_id TEXT
+                )
+            """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reindex_job_items (
+                    job_id TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    workflow_id TEXT,
+                    error_message TEXT,
+                    PRIMARY KEY (job_id, file_id)
+                )
+            """)
+            
+            # Create index for picking job items by status
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_reindex_job_items_job_status 
+                ON reindex_job_items(job_id, status)
+            """)
+            
+            # Create table for the chat run in progress per conversation, shared by the worker processes
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS active_runs (
+                    conversation_id TEXT PRIMARY KEY,
+                    run_id TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    started_at INTEGER NOT NULL
+                )
+            """)
+            
             conn.commit()
     
     def create_conversation(self, conversation_id: str, userid: str) -> ConversationMetadata:
@@ -208,6 +343,75 @@ class DatabaseManager:
             
             return row is not None
 
+    def get_existing_conversation_ids(self, conversation_ids: List[str]) -> Set[str]:
+        """Get which of the given conversation IDs exist, for any user."""
+        existing = set()
+        with self.get_connection() as conn:
+            # Stay below SQLite's limit on query parameters
+            for start in range(0, len(conversation_ids), 500):
+                batch = conversation_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(f"SELECT id FROM conversations WHERE id IN ({placeholders})", batch).fetchall()
+                existing.update(row["id"] for row in rows)
+        return existing
+
+    def add_conversation_usage(
+        self,
+        conversation_id: str,
+        userid: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        llm_calls: int,
+        duration_ms: int
+    ) -> None:
+        """Add the usage of one chat run to the totals of its conversation."""
+        with self.get_connection() as conn:
+            conn.execute("""
+                INSERT INTO conversation_usage 
+                    (conversation_id, userid, prompt_tokens, completion_tokens, total_tokens, llm_calls, runs, duration_ms, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT(conversation_id) DO UPDATE SET
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    llm_calls = llm_calls + excluded.llm_calls,
+                    runs = runs + 1,
+                    duration_ms = duration_ms + excluded.duration_ms,
+                    updated_at = excluded.updated_at
+            """, (
+                conversation_id, userid, prompt_tokens, completion_tokens, prompt_tokens + completion_tokens,
+                llm_calls, duration_ms, int(time.time())
+            ))
+            conn.commit()
+    
+    def get_conversation_usage(self, conversation_id: str, userid: str) -> Optional[ConversationUsage]:
+        """Get the usage totals of a conversation, or None if it has no recorded runs."""
+        with self.get_connection() as conn:
+            row = conn.execute("""
+                SELECT * FROM conversation_usage 
+                WHERE conversation_id = ? AND userid = ?
+            """, (conversation_id, userid)).fetchone()
+            
+            return ConversationUsage(**dict(row)) if row else None
+    
+    def get_user_usage(self, userid: str) -> Dict[str, int]:
+        """Get the usage totals over all conversations of a user."""
+        with self.get_connection() as conn:
+            row = conn.execute("""
+                SELECT 
+                    COUNT(*) AS conversations,
+                    COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                    COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+                    COALESCE(SUM(total_tokens), 0) AS total_tokens,
+                    COALESCE(SUM(llm_calls), 0) AS llm_calls,
+                    COALESCE(SUM(runs), 0) AS runs,
+                    COALESCE(SUM(duration_ms), 0) AS duration_ms
+                FROM conversation_usage 
+                WHERE userid = ?
+            """, (userid,)).fetchone()
+            
+            return dict(row)
+
     def create_file(self, file_id: str, userid: str, filename: str, blob_name: str, workflow_id: Optional[str] = None) -> FileMetadata:
         """Create a new file metadata entry."""
         uploaded_at = int(time.time())
@@ -325,5 +529,263 @@ class DatabaseManager:
             return row is not None
 
 
+    def find_files(
+        self,
+        userid: Optional[str] = None,
+        status: Optional[str] = None,
+        uploaded_after: Optional[int] = None,
+        uploaded_before: Optional[int] = None,
+    ) -> List[str]:
+        """Get IDs of all files matching the given filters, oldest first."""
+        clauses = []
+        params: List[Any] = []
+        if userid is not None:
+            clauses.append("userid = ?")
+            params.append(userid)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if uploaded_after is not None:
+            clauses.append("uploaded_at >= ?")
+            params.append(uploaded_after)
+        if uploaded_before is not None:
+            clauses.append("uploaded_at < ?")
+            params.append(uploaded_before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        
+        with self.get_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT file_id 
+                FROM files 
+                {where}
+                ORDER BY uploaded_at ASC
+            """, params).fetchall()
+            
+            return [row['file_id'] for row in rows]
+
+    def claim_active_run(self, conversation_id: str, run_id: str) -> Optional[str]:
+        """
+        Mark a run as the one in progress for a conversation, unless a run of another
+        live worker process already is.
+        
+        A marker left by a process that is gone (it crashed, or was restarted) is taken
+        over; the workers share the SQLite files, so they run on the same host and can
+        check each other's process IDs.
+        
+        Returns:
+            None if the run was marked, else the ID of the run in progress
+        """
+        pid = os.getpid()
+        with self.get_connection() as conn:
+            # Take the write lock before reading, so two workers cannot both claim
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("""
+                SELECT run_id, pid FROM active_runs WHERE conversation_id = ?
+            """, (conversation_id,)).fetchone()
+            if row and row['pid'] != pid and _process_exists(row['pid']):
+                conn.rollback()
+                return row['run_id']
+            conn.execute("""
+                INSERT OR REPLACE INTO active_runs (conversation_id, run_id, pid, started_at)
+                VALUES (?, ?, ?, ?)
+            """, (conversation_id, run_id, pid, int(time.time())))
+            conn.commit()
+        return None
+    
+    def release_active_run(self, conversation_id: str, run_id: str) -> bool:
+        """Remove the in-progress marker of a run that is done."""
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                DELETE FROM active_runs WHERE conversation_id = ? AND run_id = ?
+            """, (conversation_id, run_id))
+            conn.commit()
+            return cursor.rowcount > 0
+    
+    def _running_reindex_job(self, conn: sqlite3.Connection, workflow_running: Callable[[str], bool]) -> Optional[str]:
+        """
+        Get the ID of the re-indexing job that is running, or about to: its driver
+        workflow is running, or it was created or restarted less than
+        REINDEX_START_TIMEOUT_SECONDS ago and its driver has yet to be started.
+        """
+        now = int(time.time())
+        rows = conn.execute("""
+            SELECT job_id, workflow_id, updated_at FROM reindex_jobs
+            WHERE status IN ('pending', 'in_progress')
+        """).fetchall()
+        for row in rows:
+            if row['workflow_id'] is None:
+                if now - row['updated_at'] < REINDEX_START_TIMEOUT_SECONDS:
+                    return row['job_id']
+            elif workflow_running(row['workflow_id']):
+                return row['job_id']
+        return None
+
+    def create_reindex_job(self, job_id: str, filters: Dict[str, Any], max_concurrency: int, file_ids: List[str], workflow_running: Callable[[str], bool]) -> Optional[str]:
+        """
+        Create a bulk re-indexing job with one pending item per file, unless another
+        job is running; the caller then starts its driver workflow.
+        
+        Args:
+            job_id: ID of the new job
+            filters: Filters the files were selected with
+            max_concurrency: Files re-indexed at a time
+            file_ids: Files to re-index
+            workflow_running: Whether the driver workflow with this ID is running
+            
+        Returns:
+            None if the job was created, else the ID of the job running
+        """
+        now = int(time.time())
+        
+        with self.get_connection() as conn:
+            # Take the write lock before checking, so two workers cannot both create a job
+            conn.execute("BEGIN IMMEDIATE")
+            running_job_id = self._running_reindex_job(conn, workflow_running)
+            if running_job_id:
+                conn.rollback()
+                return running_job_id
+            conn.execute("""
+                INSERT INTO reindex_jobs (job_id, status, filters, max_concurrency, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (job_id, "pending", json.dumps(filters), max_concurrency, now, now))
+            conn.executemany("""
+                INSERT INTO reindex_job_items (job_id, file_id, status)
+                VALUES (?, ?, ?)
+            """, [(job_id, file_id, "pending") for file_id in file_ids])
+            conn.commit()
+        return None
+
+    def restart_reindex_job(self, job_id: str, workflow_running: Callable[[str], bool]) -> Optional[str]:
+        """
+        Mark an interrupted re-indexing job pending again, unless a job (this one or
+        another) is running; the caller then starts a new driver workflow for it.
+        
+        Returns:
+            None if the job was marked, else the ID of the job running
+        """
+        with self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            running_job_id = self._running_reindex_job(conn, workflow_running)
+            if running_job_id:
+                conn.rollback()
+                return running_job_id
+            conn.execute("""
+                UPDATE reindex_jobs
+                SET status = 'pending', workflow_id = NULL, updated_at = ?
+                WHERE job_id = ?
+            """, (int(time.time()), job_id))
+            conn.commit()
+        return None
+
+    def _get_reindex_job_progress(self, conn: sqlite3.Connection, job_id: str) -> Dict[str, int]:
+        """Count the items of a re-indexing job per status."""
+        progress = {"total": 0, "pending": 0, "in_progress": 0, "completed": 0, "failed": 0}
+        rows = conn.execute("""
+            SELECT status, COUNT(*) AS count 
+            FROM reindex_job_items 
+            WHERE job_id = ? 
+            GROUP BY status
+        """, (job_id,)).fetchall()
+        for row in rows:
+            progress[row['status']] = row['count']
+            progress["total"] += row['count']
+        return progress
+
+    def _row_to_reindex_job(self, conn: sqlite3.Connection, row: sqlite3.Row) -> ReindexJob:
+        return ReindexJob(
+            job_id=row['job_id'],
+            status=row['status'],
+            filters=json.loads(row['filters']),
+            max_concurrency=row['max_concurrency'],
+            created_at=row['created_at'],
+            updated_at=row['updated_at'],
+            workflow_id=row['workflow_id'],
+            progress=self._get_reindex_job_progress(conn, row['job_id'])
+        )
+
+    def get_reindex_job(self, job_id: str) -> Optional[ReindexJob]:
+        """Get a bulk re-indexing job with its progress."""
+        with self.get_connection() as conn:
+            row = conn.execute("""
+                SELECT job_id, status, filters, max_concurrency, created_at, updated_at, workflow_id
+                FROM reindex_jobs 
+                WHERE job_id = ?
+            """, (job_id,)).fetchone()
+            
+            if row:
+                return self._row_to_reindex_job(conn, row)
+        return None
+
+    def list_reindex_jobs(self) -> List[ReindexJob]:
+        """Get all bulk re-indexing jobs, ordered by created_at descending."""
+        with self.get_connection() as conn:
+            rows = conn.execute("""
+                SELECT job_id, status, filters, max_concurrency, created_at, updated_at, workflow_id
+                FROM reindex_jobs 
+                ORDER BY created_at DESC
+            """).fetchall()
+            
+            return [self._row_to_reindex_job(conn, row) for row in rows]
+
+    def update_reindex_job(self, job_id: str, status: Optional[str] = None, workflow_id: Optional[str] = None) -> bool:
+        """Update the status and/or the driver workflow ID of a re-indexing job."""
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE reindex_jobs 
+                SET status = COALESCE(?, status), workflow_id = COALESCE(?, workflow_id), updated_at = ?
+                WHERE job_id = ?
+            """, (status, workflow_id, int(time.time()), job_id))
+            conn.commit()
+            
+            return cursor.rowcount > 0
+
+    def get_reindex_job_items(self, job_id: str, status: Optional[str] = None, limit: Optional[int] = None) -> List[ReindexJobItem]:
+        """Get the items of a re-indexing job, optionally filtered by status."""
+        query = """
+            SELECT job_id, file_id, status, workflow_id, error_message
+            FROM reindex_job_items 
+            WHERE job_id = ?
+        """
+        params: List[Any] = [job_id]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY rowid ASC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        with self.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            
+            return [
+                ReindexJobItem(
+                    job_id=row['job_id'],
+                    file_id=row['file_id'],
+                    status=row['status'],
+                    workflow_id=row['workflow_id'],
+                    error_message=row['error_message']
+                )
+                for row in rows
+            ]
+
+    def update_reindex_job_item(self, job_id: str, file_id: str, status: str, workflow_id: Optional[str] = None, error_message: Optional[str] = None) -> bool:
+        """Update the status of a single item of a re-indexing job."""
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE reindex_job_items 
+                SET status = ?, workflow_id = COALESCE(?, workflow_id), error_message = ?
+                WHERE job_id = ? AND file_id = ?
+            """, (status, workflow_id, error_message, job_id, file_id))
+            conn.execute("""
+                UPDATE reindex_jobs 
+                SET updated_at = ?
+                WHERE job_id = ?
+            """, (int(time.time()), job_id))
+            conn.commit()
+            
+            return cursor.rowcount > 0
+
+
 # Global database manager instance
 db_manager = DatabaseManager()
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""Election of the one worker process that runs the background jobs.
+
+With several uvicorn/gunicorn workers, every worker would start its own orchestrator
+(and checkpoint compaction) on the same databases, and the orchestrators' recovery loops
+would resume, and so run twice, the workflows the other workers are executing. With
+WORKER_LEADER_ELECTION=true, the workers instead compete for an exclusive lock on
+WORKER_LEADER_LOCK_PATH and only the holder runs them. The others keep trying every
+WORKER_LEADER_RETRY_SECONDS, so when the leader exits (or crashes: the operating system
+releases its lock) another worker takes over.
+
+The lock is a file lock, so all workers must run on the same host, as they must anyway
+to share the SQLite databases.
+"""
+import os
+import threading
+import logging
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+
+from lib.storage import ORCHESTRATION_DB_PATH
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKER_LEADER_ELECTION = os.getenv("WORKER_LEADER_ELECTION", "false").lower() in ("1", "true", "yes")
+WORKER_LEADER_LOCK_PATH = os.getenv("WORKER_LEADER_LOCK_PATH", f"{ORCHESTRATION_DB_PATH}.leader.lock")
+WORKER_LEADER_RETRY_SECONDS = float(os.getenv("WORKER_LEADER_RETRY_SECONDS", "5"))
+
+
+class WorkerLeader:
+    """Holds, or keeps trying to take, the leader lock shared by the worker processes."""
+
+    def __init__(
+        self,
+        enabled: bool = WORKER_LEADER_ELECTION,
+        lock_path: str = WORKER_LEADER_LOCK_PATH,
+        retry_seconds: float = WORKER_LEADER_RETRY_SECONDS
+    ):
+        """
+        Args:
+            enabled: Elect a leader; when False, this process is always the leader
+            lock_path: File locked by the leader
+            retry_seconds: How often a follower tries to take the lock
+        """
+        self.enabled = enabled
+        self.lock_path = lock_path
+        self.retry_seconds = retry_seconds
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock_file = None
+        self._is_leader = not enabled
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def on_elected(self, callback: Callable[[], None]) -> None:
+        """Call `callback` once this process is the leader (at once if it already is)."""
+        self._callbacks.append(callback)
+        if self._is_leader:
+            callback()
+
+    def _try_acquire(self) -> bool:
+        import fcntl
+
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # Kept open for the life of the process: closing the file releases the lock
+        self._lock_file = lock_file
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        return True
+
+    def _elect(self) -> None:
+        while True:
+            try:
+                if self._try_acquire():
+                    break
+            except Exception as e:
+                logger.error(f"Failed to take the worker leader lock {self.lock_path}: {str(e)}")
+            if self._stop.wait(self.retry_seconds):
+                return
+
+        self._is_leader = True
+        logger.info(f"Worker {os.getpid()} is the leader and runs the background jobs")
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Failed to start a background job on election: {str(e)}")
+
+    def start(self) -> None:
+        """Start competing for the leader lock in a background thread."""
+        if self._is_leader or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._elect, name="worker-leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop competing for the lock; a held lock is released when the process exits."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Global worker leader, deciding which worker runs the orchestrator and the checkpoint compaction
+worker_leader = WorkerLeader()
@@ -0,0 +1,299 @@
+"""In-process metrics exposed in the Prometheus text format at GET /metrics.
+
+The collectors are small and thread-safe, so recording stays cheap on the hot paths
+(a lock and a few additions per observation). Counts of events come from the _count
+of the histograms, so there are no separate counters:
+
+- Gauge: value set, incremented or decremented, or read from a function at scrape time;
+- Histogram: counts of observations per bucket, with their sum and count.
+
+Each collector may have labels; the children of the label values used are created on
+first use and kept, so label values must come from a small set (tool names, activity
+names, ...), never from user input.
+
+Metrics are per process: with several workers, each scrape answers for the one worker
+that served it.
+"""
+import time
+import bisect
+import functools
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from fast SQLite queries to long agent runs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Collector:
+    """A metric with its children per label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any, **kwargs: Any) -> Any:
+        """Get the child of the given label values, creating it on first use."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} has labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _unlabeled(self) -> Any:
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels()")
+        return self._children[()]
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(name suffix, labels, value) of every sample of the metric."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from `function` at every scrape."""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Gauge(_Collector):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._unlabeled().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._unlabeled().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._unlabeled().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._unlabeled().set_function(function)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        for key, child in list(self._children.items()):
+            try:
+                samples.append(("", _format_labels(self.labelnames, key), child.get()))
+            except Exception as e:
+                # A failing gauge function must not break the whole scrape
+                logger.warning(f"Failed to read gauge {self.name}: {str(e)}")
+        return samples
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # Observations per bucket (not cumulative); the last one is +Inf
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Collector):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._unlabeled().observe(value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        for key, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for upper_bound, count in zip(self.upper_bounds + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", _format_labels(self.labelnames, key, f'le="{_format_value(upper_bound)}"'), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """The collectors of the process, rendered together for GET /metrics."""
+
+    def __init__(self):
+        self._collectors: Dict[str, _Collector] = {}
+        self._lock = threading.Lock()
+
+    def register(self, collector: _Collector) -> Any:
+        with self._lock:
+            if collector.name in self._collectors:
+                raise ValueError(f"Metric {collector.name} is already registered")
+            self._collectors[collector.name] = collector
+        return collector
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            collectors = list(self._collectors.values())
+        return "\n".join(collector.render() for collector in collectors) + "\n"
+
+
+def timed(histogram: Histogram, is_error: Optional[Callable[[Any], bool]] = None, **labels: str) -> Callable:
+    """Decorator observing the duration of every call of a function in `histogram`.
+
+    If the histogram has a `status` label, calls are labelled "ok", or "error" when they
+    raise or when `is_error(result)` is true.
+
+    Args:
+        histogram: Histogram of the call durations in seconds
+        is_error: Tells whether a returned result is a failure
+        labels: Values of the other labels of the histogram
+    """
+    with_status = "status" in histogram.labelnames
+
+    def decorator(func: Callable) -> Callable:
+        if with_status:
+            ok, error = histogram.labels(**labels, status="ok"), histogram.labels(**labels, status="error")
+        else:
+            ok = error = histogram.labels(**labels)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            child = error
+            try:
+                result = func(*args, **kwargs)
+                if is_error is None or not is_error(result):
+                    child = ok
+                return result
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+# Global registry, rendered by GET /metrics
+metrics = MetricsRegistry()
+
+# Chat streams (utils/stream_protocol.py)
+chat_streams_active = metrics.gauge("chat_streams_active", "Chat response streams in progress")
+chat_stream_first_token_seconds = metrics.histogram(
+    "chat_stream_first_token_seconds", "Time from the start of a chat stream to the first text from the model"
+)
+chat_stream_duration_seconds = metrics.histogram(
+    "chat_stream_duration_seconds", "Duration of chat response streams, by how they ended", ["outcome"]
+)
+
+# Agent tools (agent/tools.py)
+tool_call_duration_seconds = metrics.histogram(
+    "agent_tool_call_duration_seconds", "Duration of agent tool calls, by tool and status", ["tool", "status"]
+)
+
+# File indexing (orchestration/file_indexing.py)
+indexing_activity_duration_seconds = metrics.histogram(
+    "indexing_activity_duration_seconds", "Duration of the activities of the index_file_v1 workflow, by activity and status", ["activity", "status"]
+)
+
+# App database (lib/database.py)
+sqlite_query_duration_seconds = metrics.histogram(
+    "sqlite_query_duration_seconds", "Duration of the app database operations of DatabaseManager, by method", ["method"]
+)
+
+# Orchestrator (orchestration/__init__.py)
+orchestrator_queue_depth = metrics.gauge(
+    "orchestrator_queue_depth", "Workflows submitted to this worker's orchestrator and waiting for a free thread"
+)
+orchestrator_workflows_running = metrics.gauge(
+    "orchestrator_workflows_running", "Workflows submitted to this worker's orchestrator and not finished"
+)
+orchestrator_workflows_processing = metrics.gauge(
+    "orchestrator_workflows_processing", "Workflows in processing state in the orchestration database, of all workers"
+)
@@ -0,0 +1,62 @@
+"""Pluggable search backends for indexed file chunks.
+
+SEARCH_BACKEND selects the implementation:
+- "azure" (default): Azure AI Search, configured with AZURE_SEARCH_* variables
+- "local": an offline index on disk (see local_search.py), configured with
+  LOCAL_SEARCH_DIR (default ./local_search), LOCAL_SEARCH_INDEX
+  ("auto", "brute" or "ivf"; default "auto") and LOCAL_SEARCH_IVF_NPROBE
+"""
+import os
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+
+from .base import DOCUMENT_FIELDS, SearchBackend, SearchDeleteError
+from .filters import quote_literal, scope_filter_to_user
+
+# Load environment variables
+load_dotenv()
+
+_search_backend: Optional[SearchBackend] = None
+_search_backend_lock = threading.Lock()
+
+
+def is_search_configured() -> bool:
+    """Whether the selected search backend has the configuration it needs."""
+    if os.getenv("SEARCH_BACKEND", "azure") == "local":
+        return True
+    return bool(
+        os.getenv("AZURE_SEARCH_ENDPOINT") and
+        os.getenv("AZURE_SEARCH_API_KEY") and
+        os.getenv("AZURE_SEARCH_INDEX_NAME")
+    )
+
+
+def get_search_backend() -> SearchBackend:
+    """Get the process-wide search backend selected by SEARCH_BACKEND."""
+    global _search_backend
+    if _search_backend is None:
+        with _search_backend_lock:
+            if _search_backend is None:
+                backend_name = os.getenv("SEARCH_BACKEND", "azure")
+                if backend_name == "local":
+                    from .local_search import LocalSearchBackend
+                    nprobe = os.getenv("LOCAL_SEARCH_IVF_NPROBE")
+                    _search_backend = LocalSearchBackend(
+                        path=os.getenv("LOCAL_SEARCH_DIR", "./local_search"),
+                        index_type=os.getenv("LOCAL_SEARCH_INDEX", "auto"),
+                        nprobe=int(nprobe) if nprobe else None,
+                    )
+                elif backend_name == "azure":
+                    from .azure_search import AzureSearchBackend
+                    _search_backend = AzureSearchBackend()
+                else:
+                    raise ValueError(f"Unknown SEARCH_BACKEND: {backend_name}")
+    return _search_backend
+
+
+def set_search_backend(backend: Optional[SearchBackend]) -> None:
+    """Replace the process-wide search backend (None re-reads SEARCH_BACKEND on next use)."""
+    global _search_backend
+    with _search_backend_lock:
+        _search_backend = backend
@@ -0,0 +1,317 @@
+"""Azure AI Search backend."""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents.models import VectorizedQuery
+from azure.search.documents.indexes.models import (
+    SearchIndex,
+    SearchField,
+    SearchFieldDataType,
+    VectorSearch,
+    HnswAlgorithmConfiguration,
+    VectorSearchProfile,
+    SemanticConfiguration,
+    SemanticSearch,
+    SemanticPrioritizedFields,
+    SemanticField,
+    SearchableField,
+    SimpleField,
+    AzureOpenAIVectorizer,
+    AzureOpenAIVectorizerParameters,
+)
+from lib.azure_clients import azure_clients
+from .base import DOCUMENT_FIELDS, SearchBackend, SearchDeleteError
+
+logger = logging.getLogger(__name__)
+
+# Search results leave out the embedding, which is large and never shown
+RESULT_FIELDS = [field for field in DOCUMENT_FIELDS if field != "content_vector"]
+
+# Azure AI Search returns at most 1000 documents per page, and skips at most 100,000
+SEARCH_PAGE_SIZE = 1000
+SEARCH_MAX_SKIP = 100000
+
+# Deletions reach search results after a short delay; how long to wait for them, and how often
+DELETE_REFRESH_SECONDS = 1.0
+DELETE_REFRESH_ATTEMPTS = 10
+
+# Azure AI Search accepts at most 1000 actions per batch; delete_matching splits each page
+# of matches into smaller batches and sends them concurrently
+SEARCH_DELETE_BATCH_SIZE = 250
+SEARCH_DELETE_CONCURRENCY = 4
+
+# Documents whose delete failed (e.g. throttled with 503) are retried, waiting 1, 2, 4 s
+DELETE_RETRY_ATTEMPTS = 3
+DELETE_RETRY_SECONDS = 1.0
+
+_delete_executor = ThreadPoolExecutor(max_workers=SEARCH_DELETE_CONCURRENCY, thread_name_prefix="search-delete")
+
+# (endpoint, index name) pairs known to exist, so each process checks an index only once
+_known_search_indexes: Set[Tuple[str, str]] = set()
+_known_search_indexes_lock = threading.Lock()
+
+def invalidate_search_index_cache(endpoint: Optional[str] = None, index_name: Optional[str] = None) -> None:
+    """Forget that a search index exists, so the next ensure_index checks it again.
+
+    Call without arguments to forget all indexes, e.g. after deleting or recreating them.
+    """
+    with _known_search_indexes_lock:
+        if endpoint is None and index_name is None:
+            _known_search_indexes.clear()
+            return
+        for key in list(_known_search_indexes):
+            if (endpoint is None or key[0] == endpoint) and (index_name is None or key[1] == index_name):
+                _known_search_indexes.discard(key)
+
+
+class AzureSearchBackend(SearchBackend):
+    """Search backend backed by the Azure AI Search index AZURE_SEARCH_INDEX_NAME."""
+
+    name = "azure"
+
+    def ensure_index(self) -> bool:
+        endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
+        index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")
+        cache_key = (endpoint, index_name)
+
+        with _known_search_indexes_lock:
+            if cache_key in _known_search_indexes:
+                return True
+
+        try:
+            search_index_client = azure_clients.search_index_client
+
+            # Check if index exists
+            try:
+                search_index_client.get_index(index_name)
+                logger.info(f"Search index '{index_name}' already exists")
+                with _known_search_indexes_lock:
+                    _known_search_indexes.add(cache_key)
+                return True
+            except Exception:
+                logger.info(f"Creating search index '{index_name}'")
+
+            # Define the search index schema
+            fields = [
+                SimpleField(name="id", type=SearchFieldDataType.String, key=True, filterable=True),
+                SearchableField(name="content", type=SearchFieldDataType.String),
+                SearchableField(name="file_id", type=SearchFieldDataType.String, filterable=True),
+                SearchableField(name="filename", type=SearchFieldDataType.String, filterable=True),
+                SimpleField(name="userid", type=SearchFieldDataType.String, filterable=True),
+                SimpleField(name="chunk_index", type=SearchFieldDataType.Int32, filterable=True),
+                SearchField(
+                    name="content_vector",
+                    type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                    searchable=True,
+                    vector_search_dimensions=1536,  # Ada-002 embedding dimension
+                    vector_search_profile_name="my-vector-config"
+                )
+            ]
+
+            # Configure vector search
+            vector_search = VectorSearch(
+                algorithms=[
+                    HnswAlgorithmConfiguration(name="my-hnsw")
+                ],
+                vectorizers=[
+                    AzureOpenAIVectorizer(
+                        vectorizer_name="openai-vectorizer",
+                        kind="azureOpenAI",
+                        parameters=AzureOpenAIVectorizerParameters(
+                            resource_url=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                            deployment_name=os.getenv("AZURE_OPENAI_API_KEY"),
+                            model_name="text-embedding-3-small"
+                        ),
+                    ),
+                ], #
+                profiles=[
+                    VectorSearchProfile(
+                        name="my-vector-config",
+                        algorithm_configuration_name="my-hnsw",
+                        vectorizer_name="openai-vectorizer",
+                    )
+                ],
+
+            )
+
+            # Configure semantic search
+            semantic_config = SemanticConfiguration(
+                name="my-semantic-config",
+                prioritized_fields=SemanticPrioritizedFields(
+                    content_fields=[SemanticField(field_name="content")]
+                )
+            )
+
+            semantic_search = SemanticSearch(configurations=[semantic_config])
+
+            # Create the search index
+            index = SearchIndex(
+                name=index_name,
+                fields=fields,
+                vector_search=vector_search,
+                semantic_search=semantic_search
+            )
+
+            search_index_client.create_index(index)
+            logger.info(f"Successfully created search index '{index_name}'")
+            with _known_search_indexes_lock:
+                _known_search_indexes.add(cache_key)
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to ensure search index: {str(e)}")
+            return False
+
+    def upload_documents(self, documents: List[Dict[str, Any]]) -> int:
+        try:
+            result = azure_clients.search_client.upload_documents(documents=documents)
+        except Exception:
+            # The index may have been deleted behind our back; check it again next time
+            invalidate_search_index_cache(os.getenv("AZURE_SEARCH_ENDPOINT"), os.getenv("AZURE_SEARCH_INDEX_NAME"))
+            raise
+        return sum(1 for r in result if r.succeeded)
+
+    def delete_documents(self, ids: List[str]) -> int:
+        return len(self._delete_batch(ids))
+
+    def _delete_batch(self, ids: List[str]) -> List[str]:
+        """Delete documents by id, retrying the ones that fail; returns the ids deleted."""
+        deleted_ids: List[str] = []
+        pending = ids
+        for attempt in range(DELETE_RETRY_ATTEMPTS + 1):
+            if attempt:
+                time.sleep(DELETE_RETRY_SECONDS * 2 ** (attempt - 1))
+            results = azure_clients.search_client.delete_documents([{"id": doc_id} for doc_id in pending])
+            deleted_ids.extend(r.key for r in results if r.succeeded)
+            pending = [r.key for r in results if not r.succeeded]
+            if not pending:
+                break
+        return deleted_ids
+
+    def get_document(self, key: str, selected_fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return dict(azure_clients.search_client.get_document(key=key, selected_fields=selected_fields))
+        except ResourceNotFoundError:
+            return None
+
+    def find_ids(self, filter: str) -> List[str]:
+        # Pages by skip: the "id" key is not sortable, so large result sets may not come
+        # back complete (see delete_matching, which does not page)
+        search_client = azure_clients.search_client
+        ids = []
+        skip = 0
+        while True:
+            if skip > SEARCH_MAX_SKIP:
+                logger.warning(f"More than {SEARCH_MAX_SKIP} documents match {filter}; returning the first {len(ids)}")
+                return ids
+            page = [
+                doc["id"]
+                for doc in search_client.search(
+                    search_text="*",
+                    filter=filter,
+                    select=["id"],
+                    top=SEARCH_PAGE_SIZE,
+                    skip=skip
+                )
+            ]
+            ids.extend(page)
+            if len(page) < SEARCH_PAGE_SIZE:
+                return ids
+            skip += SEARCH_PAGE_SIZE
+
+    def delete_matching(self, filter: str) -> List[str]:
+        # Searches for the first page of matches and deletes it, in concurrent batches,
+        # until none are left, as paging with skip is neither stable nor possible past
+        # SEARCH_MAX_SKIP. Stops with SearchDeleteError once a delete fails after its retries.
+        search_client = azure_clients.search_client
+        deleted_ids: List[str] = []
+        deleted: Set[str] = set()
+        stale_attempts = 0
+        while True:
+            page = [
+                doc["id"]
+                for doc in search_client.search(search_text="*", filter=filter, select=["id"], top=SEARCH_PAGE_SIZE)
+            ]
+            if not page:
+                return deleted_ids
+            new_ids = [doc_id for doc_id in page if doc_id not in deleted]
+            if not new_ids:
+                # Only documents deleted already, which the index still returns for a moment
+                stale_attempts += 1
+                if stale_attempts > DELETE_REFRESH_ATTEMPTS:
+                    logger.warning(f"Deleted documents still match {filter} after {DELETE_REFRESH_ATTEMPTS} attempts; stopping")
+                    return deleted_ids
+                time.sleep(DELETE_REFRESH_SECONDS)
+                continue
+            stale_attempts = 0
+            batches = [new_ids[i:i + SEARCH_DELETE_BATCH_SIZE] for i in range(0, len(new_ids), SEARCH_DELETE_BATCH_SIZE)]
+            futures = [_delete_executor.submit(self._delete_batch, batch) for batch in batches]
+            failed_ids: List[str] = []
+            error: Optional[Exception] = None
+            for batch, future in zip(batches, futures):
+                try:
+                    batch_deleted = future.result()
+                except Exception as e:
+                    batch_deleted, error = [], e
+                deleted.update(batch_deleted)
+                deleted_ids.extend(batch_deleted)
+                failed_ids.extend(doc_id for doc_id in batch if doc_id not in deleted)
+            if failed_ids:
+                raise SearchDeleteError(filter, deleted_ids, failed_ids) from error
+
+    def text_search(self, query: str, top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        results = azure_clients.search_client.search(
+            search_text=query,
+            filter=filter,
+            select=RESULT_FIELDS,
+            top=top
+        )
+        return [dict(result) for result in results]
+
+    def semantic_search(self, query: str, top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        results = azure_clients.search_client.search(
+            search_text=query,
+            filter=filter,
+            select=RESULT_FIELDS,
+            top=top,
+            query_type="semantic",
+            semantic_configuration_name="my-semantic-config",
+            query_caption="extractive",
+            query_answer="extractive"
+        )
+        return [dict(result) for result in results]
+
+    def vector_search(self, vector: List[float], top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        vector_query = VectorizedQuery(
+            vector=vector,
+            k_nearest_neighbors=top,
+            fields="content_vector"
+        )
+        results = azure_clients.search_client.search(
+            search_text=None,
+            vector_queries=[vector_query],
+            filter=filter,
+            select=RESULT_FIELDS,
+            top=top
+        )
+        return [dict(result) for result in results]
+
+    def hybrid_search(self, query: str, embed: Callable[[str], List[float]], top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Azure AI Search fuses text and vector results with RRF server-side, in a single round trip
+        vector_query = VectorizedQuery(
+            vector=embed(query),
+            k_nearest_neighbors=top * 2,
+            fields="content_vector"
+        )
+        results = azure_clients.search_client.search(
+            search_text=query,
+            vector_queries=[vector_query],
+            filter=filter,
+            select=RESULT_FIELDS,
+            top=top
+        )
+        return [dict(result) for result in results]
@@ -0,0 +1,114 @@
+"""Interface shared by all search backends."""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# Fields of a chunk document in the search index (see ensure_index)
+DOCUMENT_FIELDS = ["id", "content", "file_id", "filename", "userid", "chunk_index", "content_vector"]
+
+# Rank constant for reciprocal rank fusion (the value used by Azure AI Search and the original RRF paper)
+RRF_K = 60
+
+# Runs the text half of hybrid searches while the caller embeds the query and runs the vector half
+_hybrid_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], top: int, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Fuse ranked result lists by summing 1 / (k + rank) per document id.
+
+    Documents found by several lists appear once, with the fused score under "@search.score".
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            doc_id = result["id"]
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(doc_id, result)
+
+    fused = sorted(scores, key=scores.get, reverse=True)[:top]
+    return [{**documents[doc_id], "@search.score": scores[doc_id]} for doc_id in fused]
+
+
+class SearchDeleteError(Exception):
+    """Some documents matching a filter could not be deleted.
+
+    Carries the ids that were deleted (`deleted_ids`) and those still in the index
+    (`failed_ids`), so callers can account for the part that succeeded.
+    """
+
+    def __init__(self, filter: str, deleted_ids: List[str], failed_ids: List[str]):
+        super().__init__(f"Failed to delete {len(failed_ids)} of the documents matching {filter}")
+        self.deleted_ids = deleted_ids
+        self.failed_ids = failed_ids
+
+
+class SearchBackend(ABC):
+    """A document store with text, semantic and vector search over indexed file chunks.
+
+    Documents are dicts with the fields in DOCUMENT_FIELDS, keyed by `id`. Search
+    results are documents too, with their relevance score under "@search.score"
+    (mirroring Azure AI Search results). Filters are OData expressions such as
+    "userid eq 'alice' and file_id eq '123'".
+    """
+
+    name: str
+
+    @abstractmethod
+    def ensure_index(self) -> bool:
+        """Make sure the index exists with the chunk schema; returns False on failure."""
+
+    @abstractmethod
+    def upload_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """Insert or replace documents by id; returns how many were stored."""
+
+    @abstractmethod
+    def delete_documents(self, ids: List[str]) -> int:
+        """Delete documents by id; returns how many were deleted."""
+
+    @abstractmethod
+    def get_document(self, key: str, selected_fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get a document by id, or None if it doesn't exist."""
+
+    @abstractmethod
+    def find_ids(self, filter: str) -> List[str]:
+        """Get the ids of all documents matching a filter."""
+
+    def delete_matching(self, filter: str) -> List[str]:
+        """Delete all documents matching a filter; returns the ids deleted.
+
+        Raises SearchDeleteError if some of them are still in the index afterwards.
+        """
+        ids = self.find_ids(filter)
+        if not ids or self.delete_documents(ids) == len(ids):
+            return ids
+        # Fewer deleted than found: a concurrent delete, or failures; the index tells which
+        remaining = set(self.find_ids(filter))
+        deleted_ids = [doc_id for doc_id in ids if doc_id not in remaining]
+        failed_ids = [doc_id for doc_id in ids if doc_id in remaining]
+        if failed_ids:
+            raise SearchDeleteError(filter, deleted_ids, failed_ids)
+        return deleted_ids
+
+    @abstractmethod
+    def text_search(self, query: str, top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Full-text search; a query of "*" matches every document."""
+
+    def semantic_search(self, query: str, top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Semantic (re-ranked) search; backends without a semantic ranker fall back to text search."""
+        return self.text_search(query, top=top, filter=filter)
+
+    @abstractmethod
+    def vector_search(self, vector: List[float], top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Nearest-neighbour search over content_vector by cosine similarity."""
+
+    def hybrid_search(self, query: str, embed: Callable[[str], List[float]], top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Text and vector search fused with reciprocal rank fusion.
+
+        The text search runs concurrently with embedding the query (via `embed`) and
+        the vector search. Each side fetches twice `top` candidates before fusion.
+        """
+        candidates = top * 2
+        text_future = _hybrid_executor.submit(self.text_search, query, candidates, filter)
+        vector_results = self.vector_search(embed(query), top=candidates, filter=filter)
+        return reciprocal_rank_fusion([text_future.result(), vector_results], top=top)
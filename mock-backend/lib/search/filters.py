@@ -0,0 +1,163 @@
+"""Parser for the subset of OData filter syntax used with the search index.
+
+Supports comparisons (`eq`, `ne`, `gt`, `ge`, `lt`, `le`) between a field and a
+string, number, boolean or null literal, `search.in(field, 'a,b')`, `and`, `or`,
+`not` and parentheses, e.g. "userid eq 'alice' and (file_id eq '1' or chunk_index lt 3)".
+
+Expressions are parsed into nested tuples:
+    ("cmp", op, field, value) | ("in", field, values) | ("and", left, right)
+    | ("or", left, right) | ("not", operand)
+"""
+import re
+from typing import Any, List, Optional, Tuple
+
+FilterNode = Tuple[Any, ...]
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][\w.]*)
+    )""", re.VERBOSE)
+
+_COMPARISON_OPS = {"eq", "ne", "gt", "ge", "lt", "le"}
+
+
+def _tokenize(expression: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match:
+            raise ValueError(f"Invalid filter expression near: {expression[pos:]!r}")
+        pos = match.end()
+        if match.group("string") is not None:
+            tokens.append(("literal", match.group("string")[1:-1].replace("''", "'")))
+        elif match.group("number") is not None:
+            text = match.group("number")
+            tokens.append(("literal", float(text) if "." in text else int(text)))
+        elif match.group("punct") is not None:
+            tokens.append((match.group("punct"), match.group("punct")))
+        else:
+            word = match.group("word")
+            lowered = word.lower()
+            if lowered in ("true", "false"):
+                tokens.append(("literal", lowered == "true"))
+            elif lowered == "null":
+                tokens.append(("literal", None))
+            elif lowered in _COMPARISON_OPS or lowered in ("and", "or", "not"):
+                tokens.append((lowered, lowered))
+            else:
+                tokens.append(("name", word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self) -> str:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else "end"
+
+    def take(self, kind: str) -> Any:
+        if self.peek() != kind:
+            raise ValueError(f"Invalid filter expression: expected {kind}, got {self.peek()}")
+        value = self.tokens[self.pos][1]
+        self.pos += 1
+        return value
+
+    def parse(self) -> FilterNode:
+        node = self.parse_or()
+        if self.peek() != "end":
+            raise ValueError(f"Invalid filter expression: unexpected {self.peek()}")
+        return node
+
+    def parse_or(self) -> FilterNode:
+        node = self.parse_and()
+        while self.peek() == "or":
+            self.take("or")
+            node = ("or", node, self.parse_and())
+        return node
+
+    def parse_and(self) -> FilterNode:
+        node = self.parse_not()
+        while self.peek() == "and":
+            self.take("and")
+            node = ("and", node, self.parse_not())
+        return node
+
+    def parse_not(self) -> FilterNode:
+        if self.peek() == "not":
+            self.take("not")
+            return ("not", self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self) -> FilterNode:
+        if self.peek() == "(":
+            self.take("(")
+            node = self.parse_or()
+            self.take(")")
+            return node
+
+        name = self.take("name")
+        if name.lower() == "search.in":
+            self.take("(")
+            field = self.take("name")
+            self.take(",")
+            values = self.take("literal")
+            delimiters = " ,"
+            if self.peek() == ",":
+                self.take(",")
+                delimiters = self.take("literal")
+            self.take(")")
+            pattern = "[" + re.escape(delimiters) + "]+"
+            return ("in", field, [value for value in re.split(pattern, str(values)) if value])
+
+        op = self.peek()
+        if op not in _COMPARISON_OPS:
+            raise ValueError(f"Invalid filter expression: expected comparison after {name}")
+        self.take(op)
+        return ("cmp", op, name, self.take("literal"))
+
+
+def parse_filter(expression: str) -> FilterNode:
+    """Parse an OData filter expression, raising ValueError if it is unsupported."""
+    return _Parser(expression).parse()
+
+
+def quote_literal(value: str) -> str:
+    """Quote a string as an OData literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _is_self_contained(expression: str) -> bool:
+    """Whether every parenthesis outside string literals is closed within the expression."""
+    depth = 0
+    in_string = False
+    for char in expression:
+        if char == "'":
+            # A doubled quote inside a literal toggles twice, which leaves the state unchanged
+            in_string = not in_string
+        elif not in_string and char == "(":
+            depth += 1
+        elif not in_string and char == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0 and not in_string
+
+
+def scope_filter_to_user(userid: str, filter: Optional[str] = None) -> str:
+    """Restrict a filter expression (if any) to the documents of one user.
+
+    Raises ValueError for expressions that could escape the parentheses they are wrapped in.
+    """
+    user_filter = f"userid eq {quote_literal(userid)}"
+    if not filter:
+        return user_filter
+    if not _is_self_contained(filter):
+        raise ValueError(f"Invalid filter expression: unbalanced parentheses or quotes in {filter!r}")
+    return f"{user_filter} and ({filter})"
@@ -0,0 +1,553 @@
+"""Local, offline search backend.
+
+Documents live in a SQLite file and their embeddings in a float32 matrix that is
+memory-mapped from disk (one row per document, L2-normalised so a dot product is
+the cosine similarity). On top of that the backend keeps, in memory:
+
+- a BM25 inverted index over `content` and `filename` for text search,
+- value -> rows indexes on the filterable fields, so `userid eq '...'` and
+  `file_id eq '...'` filters become cheap boolean masks,
+- an optional IVF (inverted file) index for approximate vector search: vectors
+  are clustered with spherical k-means and a query only scores the vectors in
+  the `nprobe` clusters nearest to it.
+
+Vector search is exact (brute force) while the collection is small or a filter
+leaves only a few candidates, and uses IVF otherwise (see LOCAL_SEARCH_INDEX).
+Searches share a read lock, so the text and vector halves of a hybrid search run
+at the same time; uploads and deletes wait for them and run alone.
+The backend is meant for a single process; run one uvicorn worker with it.
+"""
+import os
+import re
+import math
+import json
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .base import DOCUMENT_FIELDS, SearchBackend
+from .filters import FilterNode, parse_filter
+
+logger = logging.getLogger(__name__)
+
+# Fields with value -> rows indexes for fast equality filters
+FILTERABLE_FIELDS = ["id", "file_id", "filename", "userid", "chunk_index"]
+# Fields covered by full-text search
+SEARCHABLE_FIELDS = ["content", "filename"]
+# Fields stored in SQLite (the vector is stored in the matrix file)
+STORED_FIELDS = [field for field in DOCUMENT_FIELDS if field != "content_vector"]
+
+# BM25 parameters (the Azure AI Search defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Use the IVF index in "auto" mode once there are this many vectors
+IVF_MIN_VECTORS = 4096
+# Retrain the IVF clusters once the collection has grown this much since training
+IVF_RETRAIN_GROWTH = 2.0
+IVF_KMEANS_ITERATIONS = 10
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+class _ReadWriteLock:
+    """Lock held by any number of readers or by one writer; waiting writers go before new readers.
+
+    Not reentrant: a thread holding it must not acquire it again.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class LocalSearchBackend(SearchBackend):
+    """Search backend storing everything under a local directory."""
+
+    name = "local"
+
+    def __init__(self, path: str = "./local_search", index_type: str = "auto", nprobe: Optional[int] = None):
+        """
+        Args:
+            path: Directory holding documents.db and vectors.f32
+            index_type: "brute" (always exact), "ivf" (always approximate once trained)
+                or "auto" (IVF once there are IVF_MIN_VECTORS vectors)
+            nprobe: Number of IVF clusters scanned per query (default: ~10% of clusters)
+        """
+        if index_type not in ("auto", "brute", "ivf"):
+            raise ValueError(f"Unknown local search index type: {index_type}")
+
+        self.path = path
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self._lock = _ReadWriteLock()
+
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "documents.db"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._vectors_path = os.path.join(path, "vectors.f32")
+
+        # Per-row state; a row keeps its number for the lifetime of the index
+        self._row_ids: List[str] = []
+        self._row_docs: List[Optional[Dict[str, Any]]] = []  # None once deleted
+        self._id_to_row: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._has_vector = np.zeros(0, dtype=bool)
+
+        # Filter indexes: field -> value -> rows
+        self._field_index: Dict[str, Dict[Any, set]] = {field: {} for field in FILTERABLE_FIELDS}
+
+        # BM25 index: term -> {row: term frequency}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_lengths = np.zeros(0, dtype=np.float32)
+        self._total_length = 0
+
+        # Vector matrix
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+
+        # IVF index
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_count = 0
+
+        self._init_db()
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Storage
+
+    def _init_db(self):
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                document TEXT,
+                has_vector INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _load(self):
+        """Rebuild the in-memory indexes from disk."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row:
+            self._dim = int(row['value'])
+            self._open_vectors()
+
+        rows = self._conn.execute("SELECT row, id, document, has_vector FROM documents ORDER BY row").fetchall()
+        self._grow_rows(len(rows))
+        for r in rows:
+            self._row_ids.append(r['id'])
+            self._id_to_row[r['id']] = r['row']
+            doc = json.loads(r['document']) if r['document'] is not None else None
+            self._row_docs.append(doc)
+            if doc is not None:
+                self._index_document(r['row'], doc)
+                self._alive[r['row']] = True
+                self._has_vector[r['row']] = bool(r['has_vector'])
+
+        logger.info(f"Loaded local search index from {self.path}: {int(self._alive.sum())} documents")
+
+    def _open_vectors(self):
+        """Map the vector file, sized to the current capacity."""
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        self._capacity = max(self._capacity, size // (4 * self._dim))
+        if self._capacity == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self._dim))
+
+    def _ensure_vector_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, 1024)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * 4)
+        self._capacity = new_capacity
+        self._open_vectors()
+
+    def _grow_rows(self, rows: int):
+        if rows <= len(self._alive):
+            return
+        new_size = max(rows, len(self._alive) * 2, 1024)
+        for name, dtype in (("_alive", bool), ("_has_vector", bool), ("_doc_lengths", np.float32)):
+            old = getattr(self, name)
+            grown = np.zeros(new_size, dtype=dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+        assignments = np.full(new_size, -1, dtype=np.int32)
+        assignments[:len(self._assignments)] = self._assignments
+        self._assignments = assignments
+
+    # ------------------------------------------------------------------
+    # In-memory indexes
+
+    def _index_document(self, row: int, doc: Dict[str, Any]):
+        for field in FILTERABLE_FIELDS:
+            self._field_index[field].setdefault(doc.get(field), set()).add(row)
+
+        tokens = [token for field in SEARCHABLE_FIELDS for token in tokenize(str(doc.get(field) or ""))]
+        for term, count in Counter(tokens).items():
+            self._postings.setdefault(term, {})[row] = count
+        self._doc_lengths[row] = len(tokens)
+        self._total_length += len(tokens)
+
+    def _unindex_document(self, row: int, doc: Dict[str, Any]):
+        for field in FILTERABLE_FIELDS:
+            rows = self._field_index[field].get(doc.get(field))
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._field_index[field][doc.get(field)]
+
+        for field in SEARCHABLE_FIELDS:
+            for term in set(tokenize(str(doc.get(field) or ""))):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(row, None)
+                    if not postings:
+                        del self._postings[term]
+        self._total_length -= int(self._doc_lengths[row])
+        self._doc_lengths[row] = 0
+
+    # ------------------------------------------------------------------
+    # Filters
+
+    def _filter_mask(self, filter: Optional[str]) -> np.ndarray:
+        """Boolean mask of live rows matching a filter."""
+        n = len(self._row_ids)
+        alive = self._alive[:n]
+        if not filter:
+            return alive.copy()
+        return self._evaluate(parse_filter(filter), n) & alive
+
+    def _rows_mask(self, rows, n: int) -> np.ndarray:
+        mask = np.zeros(n, dtype=bool)
+        if rows:
+            mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+        return mask
+
+    def _evaluate(self, node: FilterNode, n: int) -> np.ndarray:
+        kind = node[0]
+        if kind == "and":
+            return self._evaluate(node[1], n) & self._evaluate(node[2], n)
+        if kind == "or":
+            return self._evaluate(node[1], n) | self._evaluate(node[2], n)
+        if kind == "not":
+            return ~self._evaluate(node[1], n)
+        if kind == "in":
+            _, field, values = node
+            return self._evaluate_comparison("eq", field, values, n)
+        _, op, field, value = node
+        return self._evaluate_comparison(op, field, [value], n)
+
+    def _evaluate_comparison(self, op: str, field: str, values: List[Any], n: int) -> np.ndarray:
+        if field not in STORED_FIELDS:
+            raise ValueError(f"Field '{field}' is not filterable")
+
+        if op in ("eq", "ne") and field in FILTERABLE_FIELDS:
+            index = self._field_index[field]
+            rows = set()
+            for value in values:
+                rows |= index.get(value, set())
+            mask = self._rows_mask(rows, n)
+            return ~mask if op == "ne" else mask
+
+        compare = {
+            "eq": lambda a, b: a == b,
+            "ne": lambda a, b: a != b,
+            "gt": lambda a, b: a is not None and a > b,
+            "ge": lambda a, b: a is not None and a >= b,
+            "lt": lambda a, b: a is not None and a < b,
+            "le": lambda a, b: a is not None and a <= b,
+        }[op]
+        value = values[0]
+        return np.fromiter(
+            (doc is not None and compare(doc.get(field), value) for doc in self._row_docs),
+            dtype=bool,
+            count=n
+        )
+
+    # ------------------------------------------------------------------
+    # Results
+
+    def _result(self, row: int, score: float, selected_fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        doc = self._row_docs[row]
+        fields = selected_fields or STORED_FIELDS
+        result = {field: doc.get(field) for field in fields if field in STORED_FIELDS}
+        if selected_fields and "content_vector" in selected_fields and self._has_vector[row]:
+            result["content_vector"] = self._vectors[row].tolist()
+        result["@search.score"] = float(score)
+        return result
+
+    @staticmethod
+    def _top_rows(rows: np.ndarray, scores: np.ndarray, top: int) -> List[int]:
+        """Indices into rows/scores of the `top` highest scores, best first."""
+        if len(rows) > top:
+            candidates = np.argpartition(-scores, top - 1)[:top]
+        else:
+            candidates = np.arange(len(rows))
+        return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+    # ------------------------------------------------------------------
+    # SearchBackend
+
+    def ensure_index(self) -> bool:
+        return True
+
+    def upload_documents(self, documents: List[Dict[str, Any]]) -> int:
+        stored = 0
+        with self._lock.write():
+            for document in documents:
+                doc_id = document.get("id")
+                if not doc_id:
+                    logger.error("Skipping document without id")
+                    continue
+
+                vector = document.get("content_vector")
+                if vector is not None:
+                    vector = np.asarray(vector, dtype=np.float32)
+                    if self._dim is None:
+                        self._dim = len(vector)
+                        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(self._dim),))
+                    if len(vector) != self._dim:
+                        logger.error(f"Skipping document {doc_id}: vector has {len(vector)} dimensions, index has {self._dim}")
+                        continue
+
+                row = self._id_to_row.get(doc_id)
+                if row is None:
+                    row = len(self._row_ids)
+                    self._grow_rows(row + 1)
+                    self._row_ids.append(doc_id)
+                    self._row_docs.append(None)
+                    self._id_to_row[doc_id] = row
+                elif self._row_docs[row] is not None:
+                    self._unindex_document(row, self._row_docs[row])
+
+                doc = {field: document.get(field) for field in STORED_FIELDS}
+                self._row_docs[row] = doc
+                self._index_document(row, doc)
+                self._alive[row] = True
+                self._has_vector[row] = vector is not None
+                self._assignments[row] = -1
+
+                if vector is not None:
+                    norm = np.linalg.norm(vector)
+                    self._ensure_vector_capacity(row + 1)
+                    self._vectors[row] = vector / norm if norm > 0 else vector
+                    if self._centroids is not None:
+                        self._assignments[row] = int(np.argmax(self._centroids @ self._vectors[row]))
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (row, id, document, has_vector) VALUES (?, ?, ?, ?)",
+                    (row, doc_id, json.dumps(doc), int(vector is not None))
+                )
+                stored += 1
+
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.commit()
+        return stored
+
+    def delete_documents(self, ids: List[str]) -> int:
+        deleted = 0
+        with self._lock.write():
+            for doc_id in ids:
+                row = self._id_to_row.get(doc_id)
+                if row is None or self._row_docs[row] is None:
+                    continue
+                self._unindex_document(row, self._row_docs[row])
+                self._row_docs[row] = None
+                self._alive[row] = False
+                self._has_vector[row] = False
+                self._assignments[row] = -1
+                self._conn.execute("UPDATE documents SET document = NULL, has_vector = 0 WHERE row = ?", (row,))
+                deleted += 1
+            self._conn.commit()
+        return deleted
+
+    def get_document(self, key: str, selected_fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        with self._lock.read():
+            row = self._id_to_row.get(key)
+            if row is None or self._row_docs[row] is None:
+                return None
+            result = self._result(row, 0.0, selected_fields or DOCUMENT_FIELDS)
+            del result["@search.score"]
+            return result
+
+    def find_ids(self, filter: str) -> List[str]:
+        with self._lock.read():
+            return [self._row_ids[row] for row in np.flatnonzero(self._filter_mask(filter))]
+
+    def text_search(self, query: str, top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock.read():
+            mask = self._filter_mask(filter)
+            n = len(mask)
+
+            terms = tokenize(query or "")
+            if not terms or query.strip() == "*":
+                rows = np.flatnonzero(mask)[:top]
+                return [self._result(row, 1.0) for row in rows]
+
+            live_count = int(self._alive[:n].sum())
+            avg_length = self._total_length / live_count if live_count else 0.0
+            scores = np.zeros(n, dtype=np.float32)
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                rows = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                tf = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+                idf = math.log(1 + (live_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                length_norm = 1 - BM25_B + BM25_B * self._doc_lengths[rows] / (avg_length or 1.0)
+                scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+
+            rows = np.flatnonzero(mask & (scores > 0))
+            row_scores = scores[rows]
+            return [self._result(int(rows[i]), row_scores[i]) for i in self._top_rows(rows, row_scores, top)]
+
+    def vector_search(self, vector: List[float], top: int = 5, filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Training changes the index, so it runs alone, before the search
+        with self._lock.read():
+            training_due = self._ivf_training_due()
+        if training_due:
+            with self._lock.write():
+                if self._ivf_training_due():
+                    self._train_ivf()
+
+        with self._lock.read():
+            if self._vectors is None:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            if len(query) != self._dim:
+                raise ValueError(f"Query vector has {len(query)} dimensions, index has {self._dim}")
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+
+            mask = self._filter_mask(filter) & self._has_vector[:len(self._row_ids)]
+            candidate_count = int(mask.sum())
+            if candidate_count == 0:
+                return []
+
+            rows = None
+            if self._use_ivf(candidate_count):
+                rows = self._ivf_candidates(query, mask)
+                if len(rows) < top:
+                    rows = None  # Too few candidates in the probed clusters; fall back to exact search
+            if rows is None:
+                rows = np.flatnonzero(mask)
+
+            row_scores = self._vectors[rows] @ query
+            return [self._result(int(rows[i]), row_scores[i]) for i in self._top_rows(rows, row_scores, top)]
+
+    # ------------------------------------------------------------------
+    # IVF index
+
+    def _ivf_training_due(self) -> bool:
+        """Whether the IVF clusters are missing or stale while the IVF index is in use."""
+        if self.index_type == "brute" or self._vectors is None:
+            return False
+        vector_count = int(self._has_vector[:len(self._row_ids)].sum())
+        if vector_count < 2 or (vector_count < IVF_MIN_VECTORS and self.index_type == "auto"):
+            return False
+        return self._centroids is None or vector_count > self._trained_count * IVF_RETRAIN_GROWTH
+
+    def _use_ivf(self, candidate_count: int) -> bool:
+        if self.index_type == "brute" or self._centroids is None:
+            return False
+        return candidate_count >= IVF_MIN_VECTORS or self.index_type == "ivf"
+
+    def _train_ivf(self):
+        """Cluster the vectors with spherical k-means and assign every vector to its nearest centroid."""
+        rows = np.flatnonzero(self._has_vector[:len(self._row_ids)])
+        nlist = int(min(max(16, math.sqrt(len(rows))), 4096, len(rows)))
+
+        rng = np.random.default_rng(0)
+        sample = rows if len(rows) <= nlist * 64 else rng.choice(rows, nlist * 64, replace=False)
+        sample_vectors = np.asarray(self._vectors[np.sort(sample)])
+        centroids = sample_vectors[rng.choice(len(sample_vectors), nlist, replace=False)].copy()
+
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            labels = np.argmax(sample_vectors @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample_vectors[labels == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        # Assign in batches to bound memory use
+        for start in range(0, len(rows), 8192):
+            batch = rows[start:start + 8192]
+            self._assignments[batch] = np.argmax(self._vectors[batch] @ centroids.T, axis=1)
+
+        self._centroids = centroids
+        self._trained_count = len(rows)
+        logger.info(f"Trained local IVF index with {nlist} clusters over {len(rows)} vectors")
+
+    def _ivf_candidates(self, query: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        nlist = len(self._centroids)
+        nprobe = min(self.nprobe or max(1, nlist // 10), nlist)
+        probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        in_probes = np.isin(self._assignments[:len(mask)], probes)
+        return np.flatnonzero(mask & in_probes)
+
+    def close(self):
+        with self._lock.write():
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.close()
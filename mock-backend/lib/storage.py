@@ -0,0 +1,83 @@
+"""Locations and setup of the SQLite databases.
+
+App metadata (conversations, files, usage), LangGraph checkpoints and orchestration
+workflows are written by unrelated code paths at unrelated rates. In one file they all
+queue on its single write lock, so each store has its own file (APP_DB_PATH,
+CHECKPOINT_DB_PATH, ORCHESTRATION_DB_PATH), in WAL mode so reads never wait for writes.
+
+Until this split everything lived in mock.db. On first start, a store whose file is new
+takes its tables over from the app database, so existing conversations and workflows are
+kept. Pointing a store at the app database path keeps it in that file.
+"""
+import os
+import sqlite3
+import logging
+from typing import Iterable
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+APP_DB_PATH = os.getenv("APP_DB_PATH", "mock.db")
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "checkpoints.db")
+ORCHESTRATION_DB_PATH = os.getenv("ORCHESTRATION_DB_PATH", "orchestration.db")
+
+# Tables of each store, as created by LangGraph's AsyncSqliteSaver and py_orchestrate
+CHECKPOINT_TABLES = ("checkpoints", "writes")
+ORCHESTRATION_TABLES = ("workflows", "activity_executions")
+
+
+def _table_names(conn: sqlite3.Connection, schema: str = "main") -> set:
+    return {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+
+
+def _move_tables(conn: sqlite3.Connection, legacy_path: str, tables: Iterable[str]) -> None:
+    """Move tables (with their indexes) from the legacy database into the one of conn."""
+    conn.execute("ATTACH DATABASE ? AS legacy", (legacy_path,))
+    try:
+        with conn:
+            # Locked before looking, so worker processes starting together move the tables once
+            conn.execute("BEGIN IMMEDIATE")
+            present = _table_names(conn)
+            movable = [table for table in tables if table in _table_names(conn, "legacy") and table not in present]
+            for table in movable:
+                schema = conn.execute(
+                    "SELECT sql FROM legacy.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type = 'index'", (table,)
+                ).fetchall()
+                for (sql,) in schema:
+                    conn.execute(sql)
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM legacy.{table}")
+        if not movable:
+            return
+        # Copied and committed; only then drop the originals
+        with conn:
+            for table in movable:
+                conn.execute(f"DROP TABLE legacy.{table}")
+        logger.info(f"Moved tables {', '.join(movable)} from {legacy_path} to their own database")
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+
+
+def prepare_database(path: str, tables: Iterable[str] = (), incremental_vacuum: bool = False, legacy_path: str = APP_DB_PATH) -> None:
+    """Create a store's database file in WAL mode, taking its tables over from the legacy shared file.
+
+    Args:
+        path: Database file of the store
+        tables: Tables of the store that may still be in the legacy file
+        incremental_vacuum: Create new files with auto_vacuum=INCREMENTAL, so deleted rows can be returned to the file system
+        legacy_path: File that held all stores before they were split
+    """
+    is_new = not os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        if is_new and incremental_vacuum:
+            # Only takes effect before the first table is created
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL mode is persistent: every later connection to the file uses it
+        conn.execute("PRAGMA journal_mode=WAL")
+        if os.path.abspath(path) != os.path.abspath(legacy_path) and os.path.exists(legacy_path):
+            _move_tables(conn, legacy_path, tables)
+    finally:
+        conn.close()
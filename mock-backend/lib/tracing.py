@@ -0,0 +1,276 @@
+"""Request-scoped tracing with OpenTelemetry spans.
+
+Spans cover each HTTP request (TracingMiddleware), each LangGraph node, model call and
+tool call of a chat run (TracingCallbackHandler), each checkpointer read and write
+(agent/graph.py) and each DatabaseManager method (lib/database.py). Every span carries
+the `userid` of its request, and the `conversation_id` once known: chat runs bind it
+for all their spans, other requests set it on their request span from the route. A
+slow chat thus shows where its time went. An incoming W3C `traceparent` header is continued.
+
+TRACING_EXPORTER selects where the spans go:
+- "none" (default): tracing is off and costs nothing;
+- "console": printed to stdout as JSON;
+- "file": appended to TRACING_FILE (default traces.jsonl) as JSON lines, one span per line.
+
+Tracing needs the OpenTelemetry API and SDK (the `tracing` extra: `uv sync --extra
+tracing`), which are only imported when it is on; without them, tracing stays off.
+The spans follow the OpenTelemetry data model (trace and span IDs, parent span,
+attributes, status).
+"""
+import os
+import sys
+import functools
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+from uuid import UUID
+from dotenv import load_dotenv
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+
+# conversation_id and userid of the request or chat run the current code works for
+_trace_attributes: ContextVar[Dict[str, str]] = ContextVar("trace_attributes", default={})
+
+
+def _create_tracer(exporter_name: str) -> Optional[Any]:
+    if exporter_name == "none":
+        return None
+    if exporter_name not in ("console", "file"):
+        raise ValueError(f"Unknown TRACING_EXPORTER: {exporter_name}")
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        logger.error(f"TRACING_EXPORTER={exporter_name} needs the OpenTelemetry SDK (opentelemetry-sdk); tracing is off")
+        return None
+
+    if exporter_name == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    else:
+        exporter = ConsoleSpanExporter(out=sys.stdout)
+
+    # A provider of our own rather than the global one, which other libraries may set up;
+    # spans are exported from a background thread, and flushed at exit
+    provider = TracerProvider(resource=Resource.create({"service.name": "mock-backend"}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    logger.info(f"Tracing to {TRACING_FILE if exporter_name == 'file' else 'the console'}")
+    return provider.get_tracer(__name__)
+
+
+tracer = _create_tracer(TRACING_EXPORTER)
+TRACING_ENABLED = tracer is not None
+# Imported only when tracing is on: opentelemetry is an optional dependency
+if TRACING_ENABLED:
+    from opentelemetry import context as otel_context, propagate, trace
+
+
+def bind_attributes(**attributes: Optional[str]) -> None:
+    """Set conversation_id/userid on the current span and on the spans started after it in this context."""
+    attributes = {key: value for key, value in attributes.items() if value}
+    if not TRACING_ENABLED or not attributes:
+        return
+    _trace_attributes.set({**_trace_attributes.get(), **attributes})
+    trace.get_current_span().set_attributes(attributes)
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, child_only: bool = False, current: bool = True) -> Iterator[Optional[Any]]:
+    """Run a block in a span.
+
+    Args:
+        name: Span name
+        attributes: Span attributes, besides the conversation_id/userid of the context
+        child_only: Only record the span inside a trace, e.g. for database queries that
+            background jobs run too
+        current: Make it the current span, the parent of the spans started in the block;
+            not possible in generators resumed from different contexts
+    """
+    if not TRACING_ENABLED or (child_only and not trace.get_current_span().is_recording()):
+        yield None
+        return
+    attributes = {**_trace_attributes.get(), **(attributes or {})}
+    if current:
+        with tracer.start_as_current_span(name, attributes=attributes) as current_span:
+            yield current_span
+        return
+
+    block_span = tracer.start_span(name, attributes=attributes)
+    try:
+        yield block_span
+    except BaseException as e:
+        block_span.record_exception(e)
+        block_span.set_status(trace.StatusCode.ERROR, str(e))
+        raise
+    finally:
+        block_span.end()
+
+
+def traced(name: str, child_only: bool = False) -> Callable:
+    """Decorator running every call of a function in a span; returns the function itself when tracing is off."""
+    def decorator(func: Callable) -> Callable:
+        if not TRACING_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, child_only=child_only):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracingMiddleware:
+    """ASGI middleware running each HTTP request in a server span named after its route."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        attributes = {"userid": headers["userid"]} if headers.get("userid") else {}
+        token = _trace_attributes.set(attributes)
+        try:
+            with tracer.start_as_current_span(
+                f"{scope['method']} {scope['path']}",
+                context=propagate.extract(headers),
+                kind=trace.SpanKind.SERVER,
+                attributes={**attributes, "http.request.method": scope["method"], "url.path": scope["path"]}
+            ) as request_span:
+                async def send_with_status(message: Dict[str, Any]) -> None:
+                    if message["type"] == "http.response.start":
+                        request_span.set_attribute("http.response.status_code", message["status"])
+                        if message["status"] >= 500:
+                            request_span.set_status(trace.StatusCode.ERROR)
+                    await send(message)
+
+                try:
+                    await self.app(scope, receive, send_with_status)
+                finally:
+                    # The router sets the matched route and its path parameters in the scope
+                    route = getattr(scope.get("route"), "path", None)
+                    if route is not None:
+                        request_span.update_name(f"{scope['method']} {route}")
+                        request_span.set_attribute("http.route", route)
+                    conversation_id = scope.get("path_params", {}).get("conversation_id")
+                    if conversation_id:
+                        request_span.set_attribute("conversation_id", conversation_id)
+        finally:
+            _trace_attributes.reset(token)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Callback handler recording a span for each LangGraph node, model call and tool call of a run.
+
+    Spans are parented through the run IDs of the callbacks, under the span that was
+    current when the handler was created.
+    """
+
+    # Only starts and ends spans, so it runs in the calling thread rather than in an executor
+    run_inline = True
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._root = otel_context.get_current()
+        self._attributes = dict(_trace_attributes.get())
+        # Run ID -> context for the children of the run, and the span of the run if it has one
+        self._contexts: Dict[UUID, Any] = {}
+        self._spans: Dict[UUID, Any] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: Optional[str], attributes: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            parent = self._contexts.get(parent_run_id, self._root) if parent_run_id else self._root
+            if name is None:
+                self._contexts[run_id] = parent
+                return
+            run_span = tracer.start_span(name, context=parent, attributes={**self._attributes, **(attributes or {})})
+            self._spans[run_id] = run_span
+            self._contexts[run_id] = trace.set_span_in_context(run_span, parent)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, attributes: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            self._contexts.pop(run_id, None)
+            run_span = self._spans.pop(run_id, None)
+        if run_span is None:
+            return
+        if attributes:
+            run_span.set_attributes(attributes)
+        if error is not None:
+            run_span.record_exception(error)
+            run_span.set_status(trace.StatusCode.ERROR, str(error))
+        run_span.end()
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        name = kwargs.get("name")
+        node = (metadata or {}).get("langgraph_node")
+        if parent_run_id is None:
+            self._start(run_id, parent_run_id, f"graph {name}")
+        elif node is not None and name == node:
+            # The node itself rather than the runnables it calls
+            self._start(run_id, parent_run_id, f"node {node}", {"langgraph.node": node, "langgraph.step": metadata.get("langgraph_step", -1)})
+        else:
+            self._start(run_id, parent_run_id, None)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("name") or "model"
+        self._start(run_id, parent_run_id, f"chat {model}", {"gen_ai.operation.name": "chat", "gen_ai.request.model": model})
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        attributes = {}
+        for generations in response.generations:
+            for generation in generations:
+                if isinstance(generation, ChatGeneration) and isinstance(generation.message, AIMessage) and generation.message.usage_metadata:
+                    usage = generation.message.usage_metadata
+                    attributes = {"gen_ai.usage.input_tokens": usage.get("input_tokens", 0), "gen_ai.usage.output_tokens": usage.get("output_tokens", 0)}
+        self._end(run_id, attributes=attributes)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized: Optional[Dict[str, Any]], input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        tool_name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._start(run_id, parent_run_id, f"tool {tool_name}", {"gen_ai.tool.name": tool_name})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        content = output.content if isinstance(output, ToolMessage) else output
+        # The search tools return their errors to the model as results starting with "Error"
+        if isinstance(content, str) and content.startswith("Error"):
+            self._end(run_id, RuntimeError(content[:200]))
+        else:
+            self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+def run_callbacks() -> list:
+    """Callback handlers to add to a graph run: the tracing handler when tracing is on."""
+    return [TracingCallbackHandler()] if TRACING_ENABLED else []
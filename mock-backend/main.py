@@ -6,20 +6,51 @@ sys.dont_write_bytecode = True
 from dotenv import load_dotenv
 load_dotenv()
 
+import threading
 from typing import Annotated
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 
 # Utils and modules
 from lib.auth import get_authenticated_user
-
-# Run orchestration
+from lib.leader import worker_leader
+from lib.checkpoint_maintenance import checkpoint_maintenance
+from lib.metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from lib.tracing import TRACING_ENABLED, TracingMiddleware
+from utils.json_encoding import FastJSONResponse
+from agent.graph import init_graph, close_graph
+from agent.model import get_model
 from orchestration import get_orchestrator
-orchestrator = get_orchestrator()
-orchestrator.start()
+
+
+def start_background_subsystems() -> None:
+    """Load the subsystems the first requests would otherwise wait for, and start the background jobs.
+
+    Runs in a thread after startup: the orchestration workflows and the model client import
+    the Azure and OpenAI SDKs, which takes seconds, and the server answers meanwhile.
+    """
+    # Orchestration and checkpoint retention and compaction, in the leader worker only
+    orchestrator = get_orchestrator()
+    worker_leader.on_elected(orchestrator.start)
+    worker_leader.on_elected(checkpoint_maintenance.start)
+    worker_leader.start()
+
+    # So the first chat does not wait for it
+    get_model()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The checkpointer needs the server's event loop
+    init_graph()
+    threading.Thread(target=start_background_subsystems, name="subsystem-startup", daemon=True).start()
+    yield
+    await close_graph()
+
 
 # Initialize FastAPI app
-app = FastAPI(title="LangGraph Azure Inference API", version="1.0.0")
+app = FastAPI(title="LangGraph Azure Inference API", version="1.0.0", default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Add CORS middleware to allow all origins
 app.add_middleware(
@@ -28,8 +59,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["x-run-id"],  # Browsers read it to resume a chat stream (GET /runs/{run_id}/stream)
 )
 
+# A span per request (see lib/tracing.py); outermost, so it covers the other middleware
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
 @app.get("/")
 async def root(username: Annotated[str, Depends(get_authenticated_user)]):
     """Root endpoint."""
@@ -42,6 +78,12 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+def get_metrics(_: Annotated[str, Depends(get_authenticated_user)]):
+    """Metrics of this worker process in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 # Add external routers
 from routes.chat_conversation import chat_conversation_route
 from routes.file_indexing import file_indexing_route
@@ -1,31 +1,98 @@
 # Run orchestrator
 
-from .file_indexing import (
-    index_file_v1,
-    embed_chunks_v1,
-    chunk_file_v1,
-    ensure_search_index_v1,
-    ocr_file_v1,
-    store_embeddings_v1,
-    update_indexing_status_v1,
-)
-
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
 from py_orchestrate import Orchestrator
+from py_orchestrate.models import WorkflowInstance, WorkflowStatus
+from lib.storage import ORCHESTRATION_DB_PATH, ORCHESTRATION_TABLES, prepare_database
+from lib.metrics import orchestrator_queue_depth, orchestrator_workflows_running, orchestrator_workflows_processing
+
+
+class LeaderOrchestrator(Orchestrator):
+    """Orchestrator of a worker that may not be the leader (see lib/leader.py).
+
+    It is started only in the leader. Until then, invoked workflows are only saved as
+    processing, and the leader's recovery loop runs them within 5 seconds, exactly once.
+    """
+
+    def invoke_workflow(self, name: str, **kwargs) -> str:
+        if self._running:
+            return super().invoke_workflow(name, **kwargs)
+
+        if name not in self.registry.workflows:
+            raise ValueError(f"Workflow '{name}' not found")
+
+        now = datetime.now()
+        workflow_id = str(uuid.uuid4())
+        self.db.save_workflow(WorkflowInstance(
+            id=workflow_id,
+            name=name,
+            status=WorkflowStatus.PROCESSING,
+            input_data=kwargs,
+            output_data=None,
+            current_activity=None,
+            error_message=None,
+            created_at=now,
+            updated_at=now,
+        ))
+        return workflow_id
+
+    def queue_depth(self) -> int:
+        """Workflows submitted to this orchestrator that wait for a free executor thread."""
+        # ThreadPoolExecutor keeps the submitted work items in this queue until a thread takes them
+        return self.executor._work_queue.qsize()
+
+    def count_processing_workflows(self) -> int:
+        """Workflows in processing state in the database: queued, running, or waiting to be resumed, by any worker."""
+        conn = sqlite3.connect(self.db.db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM workflows WHERE status = ?", (WorkflowStatus.PROCESSING.value,)).fetchone()[0]
+        finally:
+            conn.close()
+
 
 global orchestrator
 orchestrator = None
+_orchestrator_lock = threading.Lock()
 def get_orchestrator():
     global orchestrator
-    if orchestrator is None:
-        orchestrator = Orchestrator(db_path="mock.db")
+    if orchestrator is not None:
+        return orchestrator
+    with _orchestrator_lock:
+        if orchestrator is not None:
+            return orchestrator
+        # The workflows import the Azure SDKs, so they are loaded with the orchestrator rather than with the routes
+        from .file_indexing import (
+            index_file_v1,
+            embed_chunks_v1,
+            chunk_file_v1,
+            ensure_search_index_v1,
+            ocr_file_v1,
+            store_embeddings_v1,
+            update_indexing_status_v1,
+        )
+        from .reindex import reindex_files_v1
+
+        prepare_database(ORCHESTRATION_DB_PATH, ORCHESTRATION_TABLES)
+        instance = LeaderOrchestrator(db_path=ORCHESTRATION_DB_PATH)
 
         # Register workflows
-        orchestrator.registry.register_workflow("index_file_v1", index_file_v1)
-        orchestrator.registry.register_activity("chunk_file_v1", chunk_file_v1)
-        orchestrator.registry.register_activity("embed_chunks_v1", embed_chunks_v1)
-        orchestrator.registry.register_activity("ensure_search_index_v1", ensure_search_index_v1)
-        orchestrator.registry.register_activity("ocr_file_v1", ocr_file_v1)
-        orchestrator.registry.register_activity("store_embeddings_v1", store_embeddings_v1)
-        orchestrator.registry.register_activity("update_indexing_status_v1", update_indexing_status_v1)
-
-    return orchestrator
+        instance.registry.register_workflow("index_file_v1", index_file_v1)
+        instance.registry.register_workflow("reindex_files_v1", reindex_files_v1)
+        instance.registry.register_activity("chunk_file_v1", chunk_file_v1)
+        instance.registry.register_activity("embed_chunks_v1", embed_chunks_v1)
+        instance.registry.register_activity("ensure_search_index_v1", ensure_search_index_v1)
+        instance.registry.register_activity("ocr_file_v1", ocr_file_v1)
+        instance.registry.register_activity("store_embeddings_v1", store_embeddings_v1)
+        instance.registry.register_activity("update_indexing_status_v1", update_indexing_status_v1)
+
+        # Read at every GET /metrics
+        orchestrator_queue_depth.set_function(instance.queue_depth)
+        orchestrator_workflows_running.set_function(lambda: len(instance.running_workflows))
+        orchestrator_workflows_processing.set_function(instance.count_processing_workflows)
+
+        # Published once complete, as other threads read it without the lock
+        orchestrator = instance
+        return orchestrator
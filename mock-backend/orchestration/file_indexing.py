@@ -1,160 +1,50 @@
 """
 A workflow to index and chunk a file using Azure services.
+The chunks are stored in the search backend selected by SEARCH_BACKEND (see lib/search).
 """
 
 import os
 import logging
 from typing import List, Dict, Any, Optional
 from py_orchestrate import activity, workflow
-from azure.storage.blob import BlobServiceClient
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.models import VectorizedQuery
-from azure.search.documents.indexes.models import (
-    SearchIndex,
-    SearchField,
-    SearchFieldDataType,
-    VectorSearch,
-    HnswAlgorithmConfiguration,
-    VectorSearchProfile,
-    SemanticConfiguration,
-    SemanticSearch,
-    SemanticPrioritizedFields,
-    SemanticField,
-    SearchableField,
-    SimpleField,
-    AzureOpenAIVectorizer,
-    AzureOpenAIVectorizerParameters,
-)
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, AnalyzeResult
-from openai import AzureOpenAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from lib.database import db_manager
+from lib.azure_clients import azure_clients
+from lib.search import get_search_backend
+from lib.metrics import timed, indexing_activity_duration_seconds
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def measured(func):
+    """Observe the duration of every run of an activity in indexing_activity_duration_seconds.
+
+    Activities returning False failed without raising, so they count as errors.
+    """
+    return timed(indexing_activity_duration_seconds, is_error=lambda result: result is False, activity=func.__name__)(func)
+
 # Azure clients initialization
 def get_azure_clients():
-    """Initialize Azure service clients."""
-    # Blob Storage
-    blob_service = BlobServiceClient.from_connection_string(
-        os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-    )
-    
-    # Document Intelligence
-    doc_intelligence = DocumentIntelligenceClient(
-        endpoint=os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"),
-        credential=AzureKeyCredential(os.getenv("AZURE_DOCUMENT_INTELLIGENCE_API_KEY"))
-    )
-    
-    # Azure OpenAI
-    openai_client = AzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION")
-    )
+    """Get the shared Azure service clients.
     
-    # Azure AI Search
-    search_client = SearchClient(
-        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
-        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
+    Prefer the individual `azure_clients` properties in activities, which only build
+    the clients that are actually used.
+    """
+    return (
+        azure_clients.blob_service,
+        azure_clients.doc_intelligence,
+        azure_clients.openai_client,
+        azure_clients.search_client,
+        azure_clients.search_index_client,
     )
-    
-    search_index_client = SearchIndexClient(
-        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
-    )
-    
-    return blob_service, doc_intelligence, openai_client, search_client, search_index_client
 
 @activity("ensure_search_index_v1")
+@measured
 def ensure_search_index_v1() -> bool:
-    """Ensure the Azure AI Search index exists with proper schema."""
-    try:
-        _, _, _, _, search_index_client = get_azure_clients()
-        index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")
-        
-        # Check if index exists
-        try:
-            search_index_client.get_index(index_name)
-            logger.info(f"Search index '{index_name}' already exists")
-            return True
-        except Exception:
-            logger.info(f"Creating search index '{index_name}'")
-        
-        # Define the search index schema
-        fields = [
-            SimpleField(name="id", type=SearchFieldDataType.String, key=True, filterable=True),
-            SearchableField(name="content", type=SearchFieldDataType.String),
-            SearchableField(name="file_id", type=SearchFieldDataType.String, filterable=True),
-            SearchableField(name="filename", type=SearchFieldDataType.String, filterable=True),
-            SimpleField(name="userid", type=SearchFieldDataType.String, filterable=True),
-            SimpleField(name="chunk_index", type=SearchFieldDataType.Int32, filterable=True),
-            SearchField(
-                name="content_vector",
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                searchable=True,
-                vector_search_dimensions=1536,  # Ada-002 embedding dimension
-                vector_search_profile_name="my-vector-config"
-            )
-        ]
-        
-        # Configure vector search
-        vector_search = VectorSearch(
-            algorithms=[
-                HnswAlgorithmConfiguration(name="my-hnsw")
-            ],
-            vectorizers=[  
-                AzureOpenAIVectorizer(  
-                    vectorizer_name="openai-vectorizer",  
-                    kind="azureOpenAI",  
-                    parameters=AzureOpenAIVectorizerParameters(  
-                        resource_url=os.getenv("AZURE_OPENAI_ENDPOINT"),  
-                        deployment_name=os.getenv("AZURE_OPENAI_API_KEY"),
-                        model_name="text-embedding-3-small"
-                    ),
-                ),  
-            ], #
-            profiles=[
-                VectorSearchProfile(
-                    name="my-vector-config",
-                    algorithm_configuration_name="my-hnsw",
-                    vectorizer_name="openai-vectorizer",
-                )
-            ],
-            
-        )
-        
-        # Configure semantic search
-        semantic_config = SemanticConfiguration(
-            name="my-semantic-config",
-            prioritized_fields=SemanticPrioritizedFields(
-                content_fields=[SemanticField(field_name="content")]
-            )
-        )
-        
-        semantic_search = SemanticSearch(configurations=[semantic_config])
-        
-        # Create the search index
-        index = SearchIndex(
-            name=index_name,
-            fields=fields,
-            vector_search=vector_search,
-            semantic_search=semantic_search
-        )
-        
-        search_index_client.create_index(index)
-        logger.info(f"Successfully created search index '{index_name}'")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to ensure search index: {str(e)}")
-        return False
+    """Ensure the search index exists with proper schema."""
+    return get_search_backend().ensure_index()
 
 def extract_markdown_from_result(result: AnalyzeResult) -> str:
     """Extract markdown from Document Intelligence result using prebuilt-layout."""
@@ -183,10 +73,12 @@ def extract_markdown_from_result(result: AnalyzeResult) -> str:
 
 
 @activity("ocr_file_v1")
+@measured
 def ocr_file_v1(file_id: str) -> str:
     """Extract content from file using Azure Document Intelligence."""
     try:
-        blob_service, doc_intelligence, _, _, _ = get_azure_clients()
+        blob_service = azure_clients.blob_service
+        doc_intelligence = azure_clients.doc_intelligence
         
         # Get file metadata
         file_metadata = db_manager.get_file(file_id)
@@ -224,6 +116,7 @@ def ocr_file_v1(file_id: str) -> str:
         raise
 
 @activity("chunk_file_v1")
+@measured
 def chunk_file_v1(content: str) -> List[str]:
     """Chunk the file content into smaller pieces for embedding using LangChain RecursiveCharacterTextSplitter."""
     try:
@@ -241,10 +134,11 @@ def chunk_file_v1(content: str) -> List[str]:
         raise
 
 @activity("embed_chunks_v1")
+@measured
 def embed_chunks_v1(chunks: List[str], file_id: str) -> List[Dict[str, Any]]:
     """Generate embeddings for chunks using Azure OpenAI."""
     try:
-        _, _, openai_client, _, _ = get_azure_clients()
+        openai_client = azure_clients.openai_client
         
         # Get file metadata for additional context
         file_metadata = db_manager.get_file(file_id)
@@ -284,16 +178,14 @@ def embed_chunks_v1(chunks: List[str], file_id: str) -> List[Dict[str, Any]]:
         raise
 
 @activity("store_embeddings_v1")
+@measured
 def store_embeddings_v1(embeddings: List[Dict[str, Any]]) -> bool:
-    """Store embeddings in Azure AI Search."""
+    """Store embeddings in the search index."""
     try:
-        _, _, _, search_client, _ = get_azure_clients()
-        
         # Upload documents to search index
-        result = search_client.upload_documents(documents=embeddings)
+        success_count = get_search_backend().upload_documents(embeddings)
         
         # Check if all documents were successfully uploaded
-        success_count = sum(1 for r in result if r.succeeded)
         total_count = len(embeddings)
         
         if success_count == total_count:
@@ -308,6 +200,7 @@ def store_embeddings_v1(embeddings: List[Dict[str, Any]]) -> bool:
         return False
 
 @activity("update_indexing_status_v1")
+@measured
 def update_indexing_status_v1(file_id: str, status: str, error_message: Optional[str] = None) -> bool:
     """Update the indexing status of the file in the database."""
     try:
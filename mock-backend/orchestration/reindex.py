@@ -0,0 +1,102 @@
+"""
+A workflow to re-index many files with throttled fan-out.
+
+The job state (which files are pending, in progress, completed or failed) lives
+in the database rather than in the workflow's memory, so when the orchestrator
+resumes an interrupted `reindex_files_v1` run after a restart it simply picks up
+the remaining items instead of starting over.
+"""
+
+import time
+import logging
+from typing import Dict
+from py_orchestrate import workflow
+from lib.database import db_manager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often the driver checks on the per-file workflows it started
+REINDEX_POLL_INTERVAL_SECONDS = 2
+
+
+def _start_item(job_id: str, file_id: str) -> None:
+    """Start the index_file_v1 workflow for one item of a re-indexing job."""
+    from orchestration import get_orchestrator
+
+    if not db_manager.file_exists(file_id):
+        # The file was deleted after the job was created
+        db_manager.update_reindex_job_item(job_id, file_id, "failed", error_message="File not found")
+        return
+
+    db_manager.update_file_status(file_id, "pending")
+    workflow_id = get_orchestrator().invoke_workflow(
+        name="index_file_v1",
+        file_id=file_id
+    )
+    db_manager.update_file_workflow_id(file_id, workflow_id)
+    db_manager.update_reindex_job_item(job_id, file_id, "in_progress", workflow_id=workflow_id)
+
+
+def _check_item(job_id: str, file_id: str, workflow_id: str) -> None:
+    """Record the outcome of a finished index_file_v1 workflow, if it has finished."""
+    from orchestration import get_orchestrator
+
+    workflow_status = get_orchestrator().get_workflow_status(workflow_id=workflow_id)
+    if workflow_status is None:
+        # The workflow record is gone, so try this file again
+        db_manager.update_reindex_job_item(job_id, file_id, "pending")
+        return
+
+    if workflow_status.get('status') == 'done':
+        if workflow_status.get('output'):
+            db_manager.update_reindex_job_item(job_id, file_id, "completed")
+        else:
+            file_metadata = db_manager.get_file(file_id)
+            error_message = file_metadata.error_message if file_metadata else "Indexing failed"
+            db_manager.update_reindex_job_item(job_id, file_id, "failed", error_message=error_message)
+    elif workflow_status.get('status') == 'failed':
+        db_manager.update_reindex_job_item(
+            job_id, file_id, "failed",
+            error_message=workflow_status.get('error_message') or "Workflow failed"
+        )
+
+
+@workflow("reindex_files_v1")
+def reindex_files_v1(job_id: str) -> Dict[str, int]:
+    """Re-index every file of a job, keeping at most `max_concurrency` files in flight."""
+    job = db_manager.get_reindex_job(job_id)
+    if not job:
+        raise ValueError(f"Re-indexing job {job_id} not found in database")
+
+    db_manager.update_reindex_job(job_id, "in_progress")
+    logger.info(f"Running re-indexing job {job_id}: {job.progress}")
+
+    try:
+        while True:
+            in_progress = db_manager.get_reindex_job_items(job_id, status="in_progress")
+            for item in in_progress:
+                _check_item(job_id, item.file_id, item.workflow_id)
+
+            in_flight = len(db_manager.get_reindex_job_items(job_id, status="in_progress"))
+            free_slots = job.max_concurrency - in_flight
+            pending = db_manager.get_reindex_job_items(job_id, status="pending", limit=max(free_slots, 0))
+
+            if in_flight == 0 and not pending:
+                break
+
+            for item in pending:
+                _start_item(job_id, item.file_id)
+
+            time.sleep(REINDEX_POLL_INTERVAL_SECONDS)
+
+    except Exception as e:
+        logger.error(f"Re-indexing job {job_id} failed: {str(e)}")
+        db_manager.update_reindex_job(job_id, "failed")
+        raise
+
+    progress = db_manager.get_reindex_job(job_id).progress
+    db_manager.update_reindex_job(job_id, "completed")
+    logger.info(f"Finished re-indexing job {job_id}: {progress}")
+    return progress
@@ -1,4 +1,5 @@
 import json
+import asyncio
 
 from utils.uuid import generate_uuid
 from langchain_core.load import dumps
@@ -8,9 +9,11 @@ from utils.stream_protocol import generate_stream
 from typing import Annotated
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
-from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request
 
-from agent.graph import graph
+from agent.graph import get_graph, close_stopped_run
+from lib.chat_runs import ChatRun, RunInProgress, chat_runs
+from lib.checkpoint_maintenance import checkpoint_maintenance
 from lib.database import db_manager
 
 class ChatRequest(BaseModel):
@@ -18,8 +21,35 @@ class ChatRequest(BaseModel):
 
 chat_conversation_route = APIRouter()
 
+
+def stream_run(run: ChatRun, http_request: Request, from_seq: int = 0) -> StreamingResponse:
+    """Stream the frames of a background run from sequence number from_seq on.
+
+    The run ID is sent in the x-run-id header, to resume the stream with
+    GET /runs/{run_id}/stream?from=<number of frames received> after a lost connection.
+    """
+    return StreamingResponse(
+        run.follow(from_seq, http_request.is_disconnected),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Connection": "keep-alive",
+            "x-vercel-ai-data-stream": "v1",
+            "x-vercel-ai-ui-message-stream": "v1",
+            "x-run-id": run.run_id
+        }
+    )
+
+
+async def delete_checkpoints_after_run(conversation_id: str) -> None:
+    """Delete the checkpoints of a deleted conversation once its run, if any, is done."""
+    await chat_runs.wait(conversation_id)
+    await asyncio.to_thread(checkpoint_maintenance.delete_thread, conversation_id)
+
+
 @chat_conversation_route.post("/chat")
-async def chat_completions(request: ChatRequest, _: Annotated[str, Depends(get_authenticated_user)], userid:  Annotated[str | None, Header()] = None):
+async def chat_completions(request: ChatRequest, http_request: Request, _: Annotated[str, Depends(get_authenticated_user)], userid:  Annotated[str | None, Header()] = None):
     """Chat completions endpoint."""
 
     if not userid:
@@ -31,17 +61,10 @@ async def chat_completions(request: ChatRequest, _: Annotated[str, Depends(get_a
     # Add user and the conversation id to the database
     db_manager.create_conversation(conversation_id, userid)
 
-    return StreamingResponse(
-        generate_stream(graph, input_message, conversation_id),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Content-Type": "text/plain; charset=utf-8",
-            "Connection": "keep-alive",
-            "x-vercel-ai-data-stream": "v1",
-            "x-vercel-ai-ui-message-stream": "v1"
-        }
-    )
+    # Run in the background, so the answer survives a lost connection
+    run = chat_runs.start(conversation_id, userid, generate_stream(get_graph(), input_message, conversation_id, userid, on_stopped=close_stopped_run))
+
+    return stream_run(run, http_request)
 
 
 @chat_conversation_route.get("/last-conversation-id")
@@ -73,7 +96,7 @@ def get_conversations(_: Annotated[str, Depends(get_authenticated_user)], userid
         # Get the first message from the conversation to use as title
         # For now, we'll use a default title since we don't store message content in metadata
         # In a real implementation, you might want to fetch the first message from LangGraph state
-        conv_graph_val = graph.get_state(config={"configurable": {"thread_id": conv.id}}).values
+        conv_graph_val = get_graph().get_state(config={"configurable": {"thread_id": conv.id}}).values
         conv_graph_messages = conv_graph_val.get("messages", []) if conv_graph_val else []
         title = f"Conversations {conv.id[:8]}..."
 
@@ -108,7 +131,7 @@ def get_chat_history(_: Annotated[str, Depends(get_authenticated_user)], userid:
     # Fetch chat history for the conversation from LangGraph state
     try:
         # Get the conversation state from the checkpointer
-        states_generator = graph.get_state_history(config={"configurable": {"thread_id": conversation_id}})
+        states_generator = get_graph().get_state_history(config={"configurable": {"thread_id": conversation_id}})
         states = list(states_generator)
 
         json_dumps = dumps(states)
@@ -119,7 +142,7 @@ def get_chat_history(_: Annotated[str, Depends(get_authenticated_user)], userid:
         raise HTTPException(status_code=500, detail=f"Failed to fetch chat history: {str(e)}")
 
 @chat_conversation_route.post("/conversations/{conversation_id}/chat")
-def chat_conversation(_: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = "", request: ChatRequest = None):
+async def chat_conversation(http_request: Request, _: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = "", request: ChatRequest = None):
     """Chat in a specific conversation."""
 
     if not userid:
@@ -134,19 +157,51 @@ def chat_conversation(_: Annotated[str, Depends(get_authenticated_user)], userid
     if not db_manager.conversation_exists(conversation_id, userid):
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    return StreamingResponse(
-        generate_stream(graph, input_message, conversation_id),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Content-Type": "text/plain; charset=utf-8",
-            "Connection": "keep-alive",
-            "x-vercel-ai-data-stream": "v1",
-            "x-vercel-ai-ui-message-stream": "v1"
-        }
-    )
+    # Run in the background, so the answer survives a lost connection; one run at a time
+    # per conversation, and the client resumes the one in progress instead
+    try:
+        run = chat_runs.start(conversation_id, userid, generate_stream(get_graph(), input_message, conversation_id, userid, on_stopped=close_stopped_run))
+    except RunInProgress as e:
+        raise HTTPException(status_code=409, detail="A response is already in progress for this conversation", headers={"x-run-id": e.run_id})
+
+    return stream_run(run, http_request)
+
+@chat_conversation_route.get("/runs/{run_id}/stream")
+async def resume_run_stream(http_request: Request, _: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, run_id: str = "", from_seq: Annotated[int, Query(alias="from", ge=0)] = 0):
+    """Resume the stream of a run: replay its frames from sequence number `from` on, then follow it."""
+
+    if not userid:
+        return {"error": "Missing userid header"}
+
+    run = chat_runs.get(run_id)
+    if run is None or run.userid != userid:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    if from_seq < run.first_seq:
+        raise HTTPException(status_code=410, detail=f"Frames before {run.first_seq} are no longer buffered")
+
+    if from_seq > run.next_seq:
+        raise HTTPException(status_code=400, detail=f"The run has only sent {run.next_seq} frames so far")
+
+    return stream_run(run, http_request, from_seq)
+
+@chat_conversation_route.post("/conversations/{conversation_id}/stop")
+def stop_conversation(_: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = ""):
+    """Stop the response being generated in a conversation."""
+
+    if not userid:
+        return {"error": "Missing userid header"}
+
+    if not db_manager.conversation_exists(conversation_id, userid):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if not chat_runs.stop(conversation_id):
+        raise HTTPException(status_code=404, detail="No response in progress for this conversation")
+
+    return {"message": "Response stopped successfully"}
+
 @chat_conversation_route.delete("/conversations/{conversation_id}")
-def delete_conversation(_: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = ""):
+def delete_conversation(background_tasks: BackgroundTasks, _: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = ""):
     """Delete a conversation."""
 
     if not userid:
@@ -157,6 +212,11 @@ def delete_conversation(_: Annotated[str, Depends(get_authenticated_user)], user
     
     if not deleted:
         raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Its checkpoints are deleted after the response, in batches, once a run in progress
+    # has stopped writing them
+    chat_runs.stop(conversation_id)
+    background_tasks.add_task(delete_checkpoints_after_run, conversation_id)
     
     return {"message": "Conversation deleted successfully"}
 
@@ -179,3 +239,83 @@ def pin_conversation(_: Annotated[str, Depends(get_authenticated_user)], userid:
     
     action = "pinned" if updated else "unpinned"
     return {"message": f"Conversation {action} successfully"}
+
+@chat_conversation_route.get("/conversations/{conversation_id}/usage")
+def get_conversation_usage(_: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None, conversation_id: str = ""):
+    """Get the token usage and latency totals of a conversation."""
+
+    if not userid:
+        return {"error": "Missing userid header"}
+
+    if not db_manager.conversation_exists(conversation_id, userid):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    usage = db_manager.get_conversation_usage(conversation_id, userid)
+    if not usage:
+        return {"conversationId": conversation_id, "promptTokens": 0, "completionTokens": 0, "totalTokens": 0, "llmCalls": 0, "runs": 0, "durationMs": 0}
+
+    return {
+        "conversationId": conversation_id,
+        "promptTokens": usage.prompt_tokens,
+        "completionTokens": usage.completion_tokens,
+        "totalTokens": usage.total_tokens,
+        "llmCalls": usage.llm_calls,
+        "runs": usage.runs,
+        "durationMs": usage.duration_ms
+    }
+
+@chat_conversation_route.get("/usage")
+def get_user_usage(_: Annotated[str, Depends(get_authenticated_user)], userid: Annotated[str | None, Header()] = None):
+    """Get the token usage and latency totals over all conversations of the user."""
+
+    if not userid:
+        return {"error": "Missing userid header"}
+
+    usage = db_manager.get_user_usage(userid)
+    return {
+        "userId": userid,
+        "conversations": usage["conversations"],
+        "promptTokens": usage["prompt_tokens"],
+        "completionTokens": usage["completion_tokens"],
+        "totalTokens": usage["total_tokens"],
+        "llmCalls": usage["llm_calls"],
+        "runs": usage["runs"],
+        "durationMs": usage["duration_ms"]
+    }
+
+@chat_conversation_route.get("/admin/checkpoints")
+def get_checkpoint_storage(_: Annotated[str, Depends(get_authenticated_user)], limit: Annotated[int, Query(ge=1, le=1000)] = 20):
+    """Get the size of the checkpoint database and the threads using the most checkpoint storage."""
+
+    threads = checkpoint_maintenance.get_thread_storage(limit=limit)
+    return {
+        "database": checkpoint_maintenance.get_database_size(),
+        "threads": [
+            {
+                "threadId": thread.thread_id,
+                "checkpoints": thread.checkpoints,
+                "writes": thread.writes,
+                "bytes": thread.bytes,
+                "lastCheckpointAt": thread.last_checkpoint_at
+            }
+            for thread in threads
+        ]
+    }
+
+@chat_conversation_route.post("/admin/checkpoints/compact")
+def compact_checkpoints(_: Annotated[str, Depends(get_authenticated_user)]):
+    """Prune the checkpoints beyond retention and free their pages now, instead of waiting for the background compaction."""
+
+    try:
+        stats = checkpoint_maintenance.compact()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compact checkpoints: {str(e)}")
+
+    return {
+        "orphanedThreadsDeleted": stats.orphaned_threads_deleted,
+        "threadsPruned": stats.threads_pruned,
+        "checkpointsDeleted": stats.checkpoints_deleted,
+        "writesDeleted": stats.writes_deleted,
+        "pagesFreed": stats.pages_freed,
+        "durationMs": stats.duration_ms
+    }
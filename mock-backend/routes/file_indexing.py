@@ -1,16 +1,17 @@
 import os
 import uuid
+import asyncio
 import logging
-from typing import List, Optional, Annotated
+from typing import Iterable, List, Optional, Annotated
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Header
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from pydantic import BaseModel
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from lib.database import db_manager, FileMetadata
+from pydantic import BaseModel, Field
+from lib.azure_clients import azure_clients
+from lib.search import SearchDeleteError, get_search_backend
+from lib.database import db_manager, FileMetadata, ReindexJob
 from orchestration import get_orchestrator
 from lib.auth import verify_credentials
+from utils.ttl_cache import TTLCache
 from datetime import datetime, timedelta
 
 # Configure logging
@@ -20,6 +21,14 @@ logger = logging.getLogger(__name__)
 file_indexing_route = APIRouter()
 security = HTTPBasic()
 
+# Chunk lookups for citation previews are cached briefly, since the chat UI fetches the same chunks repeatedly
+CHUNK_DETAIL_FIELDS = ["id", "content", "file_id", "filename", "userid", "chunk_index"]
+chunk_cache = TTLCache(ttl=60, max_size=2048)
+
+# SAS URLs are valid for an hour and handed out for at most 50 minutes, so every URL returned stays valid for 10+ minutes
+SAS_URL_LIFETIME = timedelta(hours=1)
+sas_url_cache = TTLCache(ttl=50 * 60, max_size=2048)
+
 # Pydantic models for request/response
 class FileUploadResponse(BaseModel):
     file_id: str
@@ -34,26 +43,29 @@ class FileDeleteResponse(BaseModel):
     file_id: str
     message: str
     success: bool
+    deleted_chunks: int = 0
 
 class ChunkDetailResponse(BaseModel):
     content: str
     metadata: dict
     file_url: str
 
+class ReindexRequest(BaseModel):
+    userid: Optional[str] = None
+    status: Optional[str] = None
+    uploaded_after: Optional[int] = None  # epoch timestamp, inclusive
+    uploaded_before: Optional[int] = None  # epoch timestamp, exclusive
+    # The orchestrator runs 5 workflows at a time: the driver of the one running job takes one
+    # of them, and one is left for the files users upload meanwhile
+    max_concurrency: int = Field(default=3, ge=1, le=3)
+
+class ReindexJobListResponse(BaseModel):
+    jobs: List[ReindexJob]
+
 # Azure clients
 def get_blob_service_client():
-    """Get Azure Blob Service client."""
-    return BlobServiceClient.from_connection_string(
-        os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-    )
-
-def get_search_client():
-    """Get Azure AI Search client."""
-    return SearchClient(
-        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
-        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
-    )
+    """Get the shared Azure Blob Service client."""
+    return azure_clients.blob_service
 
 @file_indexing_route.post("/files", response_model=FileUploadResponse)
 async def upload_file(
@@ -236,6 +248,64 @@ def get_file_status(
         logger.error(f"Failed to get file status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get file status: {str(e)}")
 
+def _get_blob_sas_url(blob_name: str) -> str:
+    """Get a read-only SAS URL for a blob, reusing a cached one while it stays valid long enough."""
+    file_url = sas_url_cache.get(blob_name)
+    if file_url is not None:
+        return file_url
+    
+    blob_service = get_blob_service_client()
+    container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+    
+    # Generate SAS URL with read permission (the blob SDK is imported on first use)
+    from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+    sas_token = generate_blob_sas(
+        account_name=blob_service.account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=blob_service.credential.account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.utcnow() + SAS_URL_LIFETIME
+    )
+    
+    file_url = f"https://{blob_service.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+    sas_url_cache.set(blob_name, file_url)
+    return file_url
+
+async def _delete_file_chunks(file_id: str) -> int:
+    """Delete all chunks of a file from the search index, returning how many were removed."""
+    search_backend = get_search_backend()
+    try:
+        chunk_ids = await asyncio.to_thread(search_backend.delete_matching, f"file_id eq '{file_id}'")
+    except SearchDeleteError as e:
+        for chunk_id in e.deleted_ids:
+            chunk_cache.delete(chunk_id)
+        raise
+    for chunk_id in chunk_ids:
+        chunk_cache.delete(chunk_id)
+    
+    logger.info(f"Deleted {len(chunk_ids)} chunks from search index for file {file_id}")
+    return len(chunk_ids)
+
+def _uncache_file_chunks(file_ids: Iterable[str]) -> None:
+    """Drop the cached chunk details of files whose chunks are about to be replaced."""
+    file_ids = set(file_ids)
+    removed = chunk_cache.delete_where(lambda chunk_id, chunk: chunk.get("file_id") in file_ids)
+    if removed:
+        logger.info(f"Removed {removed} cached chunks of {len(file_ids)} files being re-indexed")
+
+def _delete_file_blob(blob_name: str) -> None:
+    """Delete a file from Azure Blob Storage."""
+    blob_service = get_blob_service_client()
+    container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+    blob_client = blob_service.get_blob_client(
+        container=container_name,
+        blob=blob_name
+    )
+    blob_client.delete_blob()
+    sas_url_cache.delete(blob_name)
+    logger.info(f"Deleted blob {blob_name}")
+
 @file_indexing_route.delete("/files/{file_id}", response_model=FileDeleteResponse)
 async def delete_file(
     file_id: str,
@@ -258,45 +328,34 @@ async def delete_file(
         if file_metadata.userid != user_id:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        # Delete from Azure AI Search (all chunks for this file)
-        try:
-            search_client = get_search_client()
-            
-            # Search for all documents with this file_id
-            results = search_client.search(
-                search_text="*",
-                filter=f"file_id eq '{file_id}'"
-            )
-            
-            # Delete all chunks
-            doc_ids = [doc["id"] for doc in results]
-            if doc_ids:
-                search_client.delete_documents([{"id": doc_id} for doc_id in doc_ids])
-                logger.info(f"Deleted {len(doc_ids)} chunks from search index for file {file_id}")
-        except Exception as e:
-            logger.warning(f"Failed to delete from search index: {str(e)}")
+        # Delete the search index chunks, the blob and the database entry concurrently
+        chunks_result, blob_result, db_result = await asyncio.gather(
+            _delete_file_chunks(file_id),
+            asyncio.to_thread(_delete_file_blob, file_metadata.blob_name),
+            asyncio.to_thread(db_manager.delete_file, file_id, user_id),
+            return_exceptions=True
+        )
         
-        # Delete from Azure Blob Storage
-        try:
-            blob_service = get_blob_service_client()
-            container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
-            blob_client = blob_service.get_blob_client(
-                container=container_name,
-                blob=file_metadata.blob_name
-            )
-            blob_client.delete_blob()
-            logger.info(f"Deleted blob {file_metadata.blob_name}")
-        except Exception as e:
-            logger.warning(f"Failed to delete blob: {str(e)}")
+        deleted_chunks = 0
+        if isinstance(chunks_result, Exception):
+            logger.warning(f"Failed to delete from search index: {str(chunks_result)}")
+            if isinstance(chunks_result, SearchDeleteError):
+                deleted_chunks = len(chunks_result.deleted_ids)
+        else:
+            deleted_chunks = chunks_result
+        
+        if isinstance(blob_result, Exception):
+            logger.warning(f"Failed to delete blob: {str(blob_result)}")
         
-        # Delete from database
-        success = db_manager.delete_file(file_id, user_id)
+        if isinstance(db_result, Exception):
+            raise db_result
         
-        if success:
+        if db_result:
             return FileDeleteResponse(
                 file_id=file_id,
                 message="File and all associated data deleted successfully",
-                success=True
+                success=True,
+                deleted_chunks=deleted_chunks
             )
         else:
             raise HTTPException(status_code=500, detail="Failed to delete file from database")
@@ -331,6 +390,7 @@ async def reindex_file(
         
         # Reset status to pending
         db_manager.update_file_status(file_id, "pending")
+        _uncache_file_chunks([file_id])
         
         # Start indexing workflow
         orchestrator = get_orchestrator()
@@ -419,9 +479,10 @@ def get_chunk_detail(
     userid: Annotated[str | None, Header()] = None,
 ):
     """
-    Use Azure AI Search to get the chunk detail by chunk_id.
+    Use the search index to get the chunk detail by chunk_id.
     and then return the chunk content and metadata.
     Also add a temporary Blob link using SAS Token to the original file if possible. Using the file_id field in the chunk metadata.
+    Chunks and SAS URLs are cached briefly, so repeated citation previews don't hit Azure.
     """
     try:
         # Verify authentication
@@ -429,20 +490,16 @@ def get_chunk_detail(
             raise HTTPException(status_code=400, detail="Missing userid header")
         user_id = userid
         
-        # Get chunk from Azure AI Search
-        search_client = get_search_client()
-        results = list(search_client.search(
-            search_text="*",
-            filter=f"id eq '{chunk_id}'",
-            top=1
-        ))
+        # Get chunk from the cache or look it up by key in the search index
+        chunk = chunk_cache.get(chunk_id)
+        if chunk is None:
+            chunk = get_search_backend().get_document(chunk_id, selected_fields=CHUNK_DETAIL_FIELDS)
+            if chunk is None:
+                raise HTTPException(status_code=404, detail="Chunk not found")
+            chunk_cache.set(chunk_id, chunk)
         
-        if not results:
-            raise HTTPException(status_code=404, detail="Chunk not found")
-        
-        chunk = results[0]
         content = chunk['content']
-        metadata = dict(chunk)  # Convert to dict for response
+        metadata = dict(chunk)  # Copy so the cached chunk is never modified
         
         # Extract file_id from metadata
         file_id = metadata.get('file_id')
@@ -458,25 +515,7 @@ def get_chunk_detail(
         if file_metadata.userid != user_id:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        # Generate SAS token for the blob
-        blob_service = get_blob_service_client()
-        container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
-        blob_client = blob_service.get_blob_client(
-            container=container_name,
-            blob=file_metadata.blob_name
-        )
-        
-        # Generate SAS URL with read permission, expires in 1 hour
-        sas_token = generate_blob_sas(
-            account_name=blob_service.account_name,
-            container_name=container_name,
-            blob_name=file_metadata.blob_name,
-            account_key=blob_service.credential.account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=1)
-        )
-        
-        file_url = f"https://{blob_service.account_name}.blob.core.windows.net/{container_name}/{file_metadata.blob_name}?{sas_token}"
+        file_url = _get_blob_sas_url(file_metadata.blob_name)
         
         return ChunkDetailResponse(
             content=content,
@@ -488,4 +527,109 @@ def get_chunk_detail(
         raise
     except Exception as e:
         logger.error(f"Failed to get chunk detail: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to get chunk detail: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to get chunk detail: {str(e)}")
+
+def _reindex_workflow_checker():
+    """
+    Get a function telling whether a re-indexing driver workflow is running, for the
+    database to check that no job runs before it creates or restarts one.
+    Only one job runs at a time: the driver holds one of the orchestrator's threads
+    while it polls, so a second job would take another thread from the index_file_v1
+    workflows it waits on; with enough drivers, no thread would be left to index files.
+    """
+    # Loaded before the database takes its write lock, as the first load imports the workflows
+    orchestrator = get_orchestrator()
+
+    def workflow_running(workflow_id: str) -> bool:
+        workflow_status = orchestrator.get_workflow_status(workflow_id=workflow_id)
+        return bool(workflow_status) and workflow_status.get('status') == 'processing'
+
+    return workflow_running
+
+def _start_reindex_job_workflow(job_id: str) -> str:
+    """Start (or restart) the driver workflow for a bulk re-indexing job."""
+    orchestrator = get_orchestrator()
+    try:
+        workflow_id = orchestrator.invoke_workflow(
+            name="reindex_files_v1",
+            job_id=job_id
+        )
+    except Exception:
+        # Not left pending, which would keep other jobs from starting for a while
+        db_manager.update_reindex_job(job_id, "failed")
+        raise
+    db_manager.update_reindex_job(job_id, workflow_id=workflow_id)
+    logger.info(f"Started re-indexing job {job_id}, workflow_id: {workflow_id}")
+    return workflow_id
+
+@file_indexing_route.post("/admin/reindex", response_model=ReindexJob)
+def reindex_files(
+    request: ReindexRequest,
+    _: Annotated[str, Depends(verify_credentials)],
+):
+    """
+    Re-index all files, or only those matching the given user/status/upload date filters.
+    The files are processed in the background with at most `max_concurrency` in flight;
+    poll `GET /admin/reindex/{job_id}` for progress. Only one job runs at a time.
+    """
+    try:
+        filters = request.model_dump(exclude={"max_concurrency"}, exclude_none=True)
+        file_ids = db_manager.find_files(**filters)
+        
+        job_id = str(uuid.uuid4())
+        running_job_id = db_manager.create_reindex_job(job_id, filters, request.max_concurrency, file_ids, _reindex_workflow_checker())
+        if running_job_id:
+            raise HTTPException(status_code=409, detail=f"Re-indexing job {running_job_id} is still running")
+        _uncache_file_chunks(file_ids)
+        _start_reindex_job_workflow(job_id)
+        
+        return db_manager.get_reindex_job(job_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to start re-indexing job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to start re-indexing job: {str(e)}")
+
+@file_indexing_route.get("/admin/reindex", response_model=ReindexJobListResponse)
+def list_reindex_jobs(_: Annotated[str, Depends(verify_credentials)]):
+    """List all bulk re-indexing jobs with their progress."""
+    return ReindexJobListResponse(jobs=db_manager.list_reindex_jobs())
+
+@file_indexing_route.get("/admin/reindex/{job_id}", response_model=ReindexJob)
+def get_reindex_job(job_id: str, _: Annotated[str, Depends(verify_credentials)]):
+    """Get the progress of a bulk re-indexing job."""
+    job = db_manager.get_reindex_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-indexing job not found")
+    return job
+
+@file_indexing_route.post("/admin/reindex/{job_id}/resume", response_model=ReindexJob)
+def resume_reindex_job(job_id: str, _: Annotated[str, Depends(verify_credentials)]):
+    """
+    Resume a bulk re-indexing job whose driver workflow failed.
+    Items that already completed are not re-indexed again.
+    """
+    try:
+        job = db_manager.get_reindex_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Re-indexing job not found")
+        
+        if job.status == "completed":
+            raise HTTPException(status_code=409, detail="Re-indexing job already completed")
+        
+        running_job_id = db_manager.restart_reindex_job(job_id, _reindex_workflow_checker())
+        if running_job_id == job_id:
+            raise HTTPException(status_code=409, detail="Re-indexing job is still running")
+        if running_job_id:
+            raise HTTPException(status_code=409, detail=f"Re-indexing job {running_job_id} is still running")
+        
+        _uncache_file_chunks(item.file_id for item in db_manager.get_reindex_job_items(job_id) if item.status != "completed")
+        _start_reindex_job_workflow(job_id)
+        return db_manager.get_reindex_job(job_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to resume re-indexing job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to resume re-indexing job: {str(e)}")
@@ -0,0 +1,34 @@
+"""Unit tests of the backend: `uv run python -m unittest discover -s tests -t .`
+
+The app database, checkpoints, orchestration store and local search index of the tests
+live in a temporary directory, and the Azure settings are placeholders, so the tests
+touch neither mock.db nor Azure. Set here, before any test imports the app modules,
+which read them at import.
+"""
+import os
+import atexit
+import shutil
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mock-backend-tests-")
+atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+
+os.environ.update({
+    "APP_DB_PATH": os.path.join(TEST_DIR, "app.db"),
+    "CHECKPOINT_DB_PATH": os.path.join(TEST_DIR, "checkpoints.db"),
+    "ORCHESTRATION_DB_PATH": os.path.join(TEST_DIR, "orchestration.db"),
+    "LOCAL_SEARCH_DIR": os.path.join(TEST_DIR, "search"),
+    "SEARCH_BACKEND": "local",
+    "TRACING_EXPORTER": "none",
+    "BACKEND_AUTH_USERNAME": "tests",
+    "BACKEND_AUTH_PASSWORD": "tests",
+})
+for key, value in {
+    "AZURE_OPENAI_ENDPOINT": "https://tests.openai.azure.com/",
+    "AZURE_OPENAI_API_KEY": "tests",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_DEPLOYMENT_NAME": "tests",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME": "tests",
+    "AZURE_STORAGE_CONTAINER_NAME": "tests",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,327 @@
+"""Tests for the background chat runs (lib/chat_runs.py) and their routes (routes/chat_conversation.py).
+
+The routes run the agent graph with the fake model of benchmarks/fakes.py, over the local
+search backend. The test client returns a response once it is complete, so requests that
+must overlap a run are sent from a thread.
+"""
+import asyncio
+import functools
+import tempfile
+import threading
+import unittest
+from contextlib import asynccontextmanager
+from unittest import mock
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import tests  # noqa: F401 - test settings, before the app modules
+from agent import model as agent_model
+from lib import chat_runs as chat_runs_module
+from lib.azure_clients import azure_clients
+from lib.chat_runs import ChatRun, ChatRunRegistry, chat_runs
+from lib.database import db_manager
+from lib.search import set_search_backend
+from lib.search.local_search import LocalSearchBackend
+from utils.uuid import generate_uuid
+
+AUTH = ("tests", "tests")
+USER = {"userid": "alice"}
+
+
+async def collect(frames):
+    return [frame async for frame in frames]
+
+
+class RegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(chat_runs_module, "RUN_DETACHED_TIMEOUT_SECONDS", 0.05),
+            mock.patch.object(chat_runs_module, "STREAM_DISCONNECT_POLL_SECONDS", 0.01),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.registry = ChatRunRegistry()
+
+    def start_run(self, conversation_id):
+        """Start a run that sends one frame, then waits for its graph task, which only a stop ends."""
+        registry = self.registry
+
+        async def frames():
+            graph_task = asyncio.create_task(asyncio.Event().wait())
+            registry.register(conversation_id, graph_task)
+            yield "f:start\n"
+            try:
+                await graph_task
+            except asyncio.CancelledError:
+                yield "d:stopped\n"
+
+        return registry.start(conversation_id, "alice", frames())
+
+
+class DetachedRunTest(RegistryTestCase):
+    def test_run_is_stopped_once_its_client_is_gone(self):
+        async def scenario():
+            run = self.start_run(generate_uuid())
+
+            async def disconnected():
+                return True
+
+            received = [frame async for frame in run.follow(0, disconnected)]
+            self.assertEqual(received, ["f:start\n"])
+            self.assertFalse(run.done)
+            # Stopped once RUN_DETACHED_TIMEOUT_SECONDS pass without a client
+            await asyncio.wait_for(run.task, 1)
+            return run
+
+        run = asyncio.run(scenario())
+        self.assertEqual(list(run.frames), ["f:start\n", "d:stopped\n"])
+        self.assertFalse(self.registry.is_running(run.conversation_id))
+        self.assertIsNone(self.registry.active_run(run.conversation_id))
+
+    def test_resuming_in_time_keeps_the_run_going(self):
+        async def scenario():
+            run = self.start_run(generate_uuid())
+
+            async def disconnected():
+                return True
+
+            async def connected():
+                return False
+
+            self.assertEqual([frame async for frame in run.follow(0, disconnected)], ["f:start\n"])
+            # A client resumes before the timeout, and follows until the run is stopped
+            follower = asyncio.create_task(collect(run.follow(1, connected)))
+            await asyncio.sleep(0.2)
+            self.assertFalse(run.done)
+            self.assertTrue(self.registry.stop(run.conversation_id))
+            return await asyncio.wait_for(follower, 1)
+
+        self.assertEqual(asyncio.run(scenario()), ["d:stopped\n"])
+
+    def test_stop_without_a_run(self):
+        self.assertFalse(self.registry.stop(generate_uuid()))
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_follow_from_an_offset(self):
+        async def scenario():
+            run = ChatRun(generate_uuid(), "alice", on_detached=lambda: None)
+            for index in range(3):
+                run.append(f"{index}\n")
+            follower = asyncio.create_task(collect(run.follow(1)))
+            await asyncio.sleep(0)
+            # Frames sent while the client follows reach it too
+            run.append("3\n")
+            run.finish()
+            return await asyncio.wait_for(follower, 1)
+
+        self.assertEqual(asyncio.run(scenario()), ["1\n", "2\n", "3\n"])
+
+    def test_follow_after_the_buffer_wraps(self):
+        async def scenario():
+            run = ChatRun(generate_uuid(), "alice", on_detached=lambda: None, buffer_frames=4)
+            for index in range(10):
+                run.append(f"{index}\n")
+            run.finish()
+            self.assertEqual((run.first_seq, run.next_seq), (6, 10))
+            return [frame async for frame in run.follow(7)], [frame async for frame in run.follow(2)]
+
+        resumed, behind = asyncio.run(scenario())
+        self.assertEqual(resumed, ["7\n", "8\n", "9\n"])
+        # Frames 2 to 5 are gone, so nothing is sent rather than a gap
+        self.assertEqual(behind, [])
+
+
+class BlockingSearchBackend(LocalSearchBackend):
+    """Local backend whose hybrid search waits until released, to stop a run during a tool call."""
+
+    def __init__(self, path):
+        super().__init__(path=path)
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def hybrid_search(self, *args, **kwargs):
+        self.entered.set()
+        self.released.wait(10)
+        return super().hybrid_search(*args, **kwargs)
+
+
+class ChatRouteTestCase(unittest.TestCase):
+    """The chat routes with the agent graph, the fake model calling the search tool for every question."""
+
+    response_tokens = 5
+
+    def setUp(self):
+        from agent.graph import close_graph, init_graph
+        from benchmarks.fakes import install_fakes
+        from routes.chat_conversation import chat_conversation_route
+
+        directory = tempfile.TemporaryDirectory(prefix="chat-runs-test-")
+        self.addCleanup(directory.cleanup)
+        install_fakes(self.chat_model(), directory.name)
+        self.search = BlockingSearchBackend(directory.name)
+        self.search.released.set()
+        set_search_backend(self.search)
+        self.addCleanup(azure_clients.reset)
+        self.addCleanup(set_search_backend, None)
+        self.addCleanup(setattr, agent_model, "model", None)
+        self.addCleanup(self.search.released.set)
+
+        @asynccontextmanager
+        async def lifespan(app):
+            init_graph()
+            yield
+            await close_graph()
+
+        app = FastAPI(lifespan=lifespan)
+        app.include_router(chat_conversation_route)
+        self.client = TestClient(app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+    def chat_model(self):
+        from benchmarks.fakes import FakeChatModel
+
+        return FakeChatModel(tokens_per_second=0, response_tokens=self.response_tokens, tool_call_ratio=1.0)
+
+    def new_conversation(self):
+        conversation_id = generate_uuid()
+        db_manager.create_conversation(conversation_id, USER["userid"])
+        return conversation_id
+
+    def chat(self, conversation_id, question="What drove revenue?"):
+        return self.client.post(f"/conversations/{conversation_id}/chat", json={"messages": [{"role": "user", "content": question}]}, headers=USER, auth=AUTH)
+
+    def in_thread(self, request):
+        """Send a request from a thread; returns a function waiting for its response."""
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(request()))
+        thread.start()
+
+        def response():
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+            return responses[0]
+
+        return response
+
+    def chat_in_thread(self, conversation_id, question="What drove revenue?"):
+        return self.in_thread(lambda: self.chat(conversation_id, question))
+
+    def messages(self, conversation_id):
+        from agent.graph import get_graph
+
+        snapshot = self.client.portal.call(get_graph().aget_state, {"configurable": {"thread_id": conversation_id}})
+        return snapshot, snapshot.values.get("messages", [])
+
+
+class StopTest(ChatRouteTestCase):
+    def test_stop_answers_the_pending_tool_call(self):
+        from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+        conversation_id = self.new_conversation()
+        self.search.released.clear()
+        response = self.chat_in_thread(conversation_id)
+        self.assertTrue(self.search.entered.wait(10))
+
+        stopped = self.client.post(f"/conversations/{conversation_id}/stop", headers=USER, auth=AUTH)
+        self.assertEqual(stopped.status_code, 200)
+        frames = response().text.splitlines()
+        self.assertEqual([frame[:2] for frame in frames], ["f:", "b:", "c:", "c:", "d:"])
+
+        snapshot, messages = self.messages(conversation_id)
+        self.assertEqual(snapshot.next, ())
+        self.assertEqual([type(message) for message in messages], [HumanMessage, AIMessage, ToolMessage, AIMessage])
+        self.assertEqual(messages[2].tool_call_id, messages[1].tool_calls[0]["id"])
+        self.assertEqual(messages[2].content, "Stopped by the user before this tool call finished.")
+        self.assertEqual(messages[3].content, "(Response stopped.)")
+
+        # The conversation continues from there
+        self.search.released.set()
+        follow_up = self.chat(conversation_id, "And costs?")
+        self.assertEqual(follow_up.status_code, 200)
+        self.assertEqual([frame[:2] for frame in follow_up.text.splitlines()], ["f:", "b:", "c:", "c:", "a:"] + ["0:"] * self.response_tokens + ["d:"])
+        _, messages = self.messages(conversation_id)
+        self.assertEqual(len(messages), 8)
+
+    def test_stop_without_a_run(self):
+        conversation_id = self.new_conversation()
+        response = self.client.post(f"/conversations/{conversation_id}/stop", headers=USER, auth=AUTH)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(f"/conversations/{generate_uuid()}/stop", headers=USER, auth=AUTH)
+        self.assertEqual(response.status_code, 404)
+
+
+class ResumeTest(ChatRouteTestCase):
+    response_tokens = 30
+
+    def resume(self, run_id, from_seq, headers=USER):
+        return self.client.get(f"/runs/{run_id}/stream", params={"from": from_seq}, headers=headers, auth=AUTH)
+
+    def test_resume_from_an_offset(self):
+        response = self.chat(self.new_conversation())
+        frames = response.text.splitlines(keepends=True)
+        self.assertEqual(len(frames), 5 + self.response_tokens + 1)
+        run_id = response.headers["x-run-id"]
+
+        resumed = self.resume(run_id, 4)
+        self.assertEqual(resumed.status_code, 200)
+        self.assertEqual(resumed.headers["x-run-id"], run_id)
+        self.assertEqual(resumed.text, "".join(frames[4:]))
+        self.assertEqual(self.resume(run_id, len(frames)).text, "")
+
+        self.assertEqual(self.resume(run_id, len(frames) + 1).status_code, 400)
+        self.assertEqual(self.resume(generate_uuid(), 0).status_code, 404)
+        # Only the user of the run can follow it
+        self.assertEqual(self.resume(run_id, 0, headers={"userid": "bob"}).status_code, 404)
+
+    def test_resume_after_the_buffer_wraps(self):
+        with mock.patch.object(chat_runs_module, "ChatRun", functools.partial(ChatRun, buffer_frames=8)):
+            response = self.chat(self.new_conversation())
+        frames = response.text.splitlines(keepends=True)
+        run_id = response.headers["x-run-id"]
+        first_seq = len(frames) - 8
+
+        resumed = self.resume(run_id, first_seq)
+        self.assertEqual(resumed.status_code, 200)
+        self.assertEqual(resumed.text, "".join(frames[first_seq:]))
+        self.assertEqual(self.resume(run_id, first_seq - 1).status_code, 410)
+
+
+class RunInProgressTest(ChatRouteTestCase):
+    def test_second_chat_gets_the_run_in_progress(self):
+        conversation_id = self.new_conversation()
+        self.search.released.clear()
+        response = self.chat_in_thread(conversation_id)
+        self.assertTrue(self.search.entered.wait(10))
+        run_id = chat_runs.active_run(conversation_id).run_id
+
+        second = self.chat(conversation_id, "And costs?")
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.headers["x-run-id"], run_id)
+
+        # The client resumes the run in progress instead, and follows it to the end
+        resumed = self.in_thread(lambda: self.client.get(f"/runs/{run_id}/stream", headers=USER, auth=AUTH))
+        self.search.released.set()
+        self.assertEqual(response().status_code, 200)
+        self.assertEqual(resumed().text, response().text)
+
+        self.assertEqual(self.chat(conversation_id, "And costs?").status_code, 200)
+
+    def test_run_of_another_worker(self):
+        conversation_id = self.new_conversation()
+        # A live process other than this one; the marker of a process that is gone is taken over
+        with db_manager.get_connection() as conn:
+            conn.execute("INSERT INTO active_runs (conversation_id, run_id, pid, started_at) VALUES (?, ?, 1, 0)", (conversation_id, "other-run"))
+            conn.commit()
+        response = self.chat(conversation_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers["x-run-id"], "other-run")
+
+        db_manager.release_active_run(conversation_id, "other-run")
+        self.assertEqual(self.chat(conversation_id).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Tests for the context window management of the agent (agent/context.py)."""
+import unittest
+from unittest import mock
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from agent import context
+
+TOOL_OUTPUT = "x" * 2000  # about 500 tokens
+
+
+class FakeSummaryModel:
+    """Answers each summary request with "summary <n>", recording the prompts."""
+
+    def __init__(self, fail=False):
+        self.prompts = []
+        self.fail = fail
+
+    def with_config(self, **kwargs):
+        return self
+
+    def invoke(self, messages):
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        self.prompts.append(messages)
+        return AIMessage(content=f"summary {len(self.prompts)}")
+
+
+def turn(number, tool_rounds=1):
+    """A user turn: the question, rounds of a search call and its output, and the answer."""
+    messages = [HumanMessage(content=f"question {number}", id=f"h{number}")]
+    for round_number in range(tool_rounds):
+        call_id = f"call{number}_{round_number}"
+        messages += [
+            AIMessage(content="", id=f"a{number}_{round_number}", tool_calls=[{"id": call_id, "name": "search", "args": {"query": f"q{number}"}}]),
+            ToolMessage(content=TOOL_OUTPUT, tool_call_id=call_id, name="search", id=f"t{number}_{round_number}"),
+        ]
+    messages.append(AIMessage(content=f"answer {number}", id=f"r{number}"))
+    return messages
+
+
+def conversation(turns):
+    return [message for number in range(1, turns + 1) for message in turn(number)]
+
+
+class ContextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeSummaryModel()
+        for patcher in (
+            mock.patch.object(context, "CONTEXT_TOKEN_BUDGET", 1500),
+            mock.patch.object(context, "CONTEXT_KEEP_RECENT_TURNS", 2),
+            mock.patch.object(context, "CONTEXT_TOOL_OUTPUT_MAX_TOKENS", 50),
+            mock.patch.object(context, "get_model", lambda: self.model),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertToolCallsAnswered(self, messages):
+        """Every tool output follows the AI message that called it, and starts no window."""
+        called = set()
+        for message in messages:
+            if isinstance(message, AIMessage):
+                called.update(tool_call["id"] for tool_call in message.tool_calls)
+            elif isinstance(message, ToolMessage):
+                self.assertIn(message.tool_call_id, called)
+
+
+class TrimWindowTest(ContextTestCase):
+    def test_trims_tool_outputs_before_the_recent_turns(self):
+        messages = context._trim_window(conversation(4))
+        tool_outputs = {message.id: message.content for message in messages if isinstance(message, ToolMessage)}
+        for old in ("t1_0", "t2_0"):
+            self.assertTrue(tool_outputs[old].startswith("x" * 200 + "\n[... 450 more tokens of tool output trimmed]"))
+        for recent in ("t3_0", "t4_0"):
+            self.assertEqual(tool_outputs[recent], TOOL_OUTPUT)
+
+    def test_keep_zero_keeps_only_the_latest_tool_round(self):
+        # The model is about to answer the second round of tool calls of the last turn
+        window = conversation(1) + turn(2, tool_rounds=2)[:-1]
+        with mock.patch.object(context, "CONTEXT_KEEP_RECENT_TURNS", 0):
+            messages = context._trim_window(window)
+        tool_outputs = {message.id: message.content for message in messages if isinstance(message, ToolMessage)}
+        self.assertEqual(tool_outputs["t2_1"], TOOL_OUTPUT)
+        self.assertLess(len(tool_outputs["t1_0"]), 300)
+        self.assertLess(len(tool_outputs["t2_0"]), 300)
+
+    def test_keep_zero_without_tool_calls(self):
+        with mock.patch.object(context, "CONTEXT_KEEP_RECENT_TURNS", 0):
+            window = [HumanMessage(content="hello", id="h1")]
+            self.assertEqual(context._trim_window(window), window)
+
+
+class BuildContextTest(ContextTestCase):
+    def test_window_after_the_summary(self):
+        messages = conversation(3)
+        built = context.build_context({"messages": messages, "summary": "earlier", "summarized_through": "r1"})
+        self.assertIsInstance(built[0], SystemMessage)
+        self.assertIn("earlier", built[0].content)
+        self.assertEqual([message.id for message in built[1:]], [message.id for message in messages[4:]])
+
+    def test_drops_whole_turns_when_over_budget(self):
+        # Summarizing failed, so the window is over budget even once trimmed
+        built = context.build_context({"messages": conversation(20)})
+        self.assertLessEqual(context.count_tokens_approximately(built), context.CONTEXT_TOKEN_BUDGET)
+        self.assertIsInstance(built[0], HumanMessage)
+        self.assertEqual(built[-1].id, "r20")
+        self.assertToolCallsAnswered(built)
+
+    def test_one_long_turn_keeps_its_tool_calls(self):
+        # Over the budget: all but the output the model is about to read are trimmed
+        built = context.build_context({"messages": turn(1, tool_rounds=4)[:-1]})
+        self.assertEqual(len(built), 9)
+        self.assertToolCallsAnswered(built)
+        self.assertEqual(built[-1].content, TOOL_OUTPUT)
+        self.assertLess(len(built[-3].content), 300)
+
+
+class ManageContextTest(ContextTestCase):
+    def test_nothing_to_do_within_the_budget(self):
+        self.assertEqual(context.manage_context({"messages": conversation(1)}), {})
+        self.assertEqual(self.model.prompts, [])
+
+    def test_folds_the_oldest_whole_turns(self):
+        # 14 turns are over the budget even with all but the latest tool output trimmed
+        self.assertEqual(context.manage_context({"messages": conversation(13)}), {})
+        messages = conversation(14)
+        update = context.manage_context({"messages": messages})
+        # Folded through the end of a turn, leaving turns that fit half the budget
+        self.assertEqual(update["summarized_through"], "r8")
+        # In batches of at most the budget, each prompt carrying the summary so far
+        self.assertGreater(len(self.model.prompts), 1)
+        self.assertEqual(update["summary"], f"summary {len(self.model.prompts)}")
+        transcripts = [prompt[1].content for prompt in self.model.prompts]
+        self.assertIn("Current summary:\n(none)", transcripts[0])
+        self.assertIn("Current summary:\nsummary 1", transcripts[1])
+        transcript = "\n".join(transcripts)
+        self.assertIn("User: question 1", transcript)
+        self.assertIn("Assistant called search with {'query': 'q8'}", transcript)
+        self.assertIn("Tool search returned: xxx", transcript)
+        self.assertNotIn("question 9", transcript)
+
+        built = context.build_context({"messages": messages, **update})
+        self.assertEqual(built[1].id, "h9")
+        self.assertEqual(len(built), 1 + 6 * 4)
+        self.assertToolCallsAnswered(built)
+
+    def test_summary_advances(self):
+        state = {"messages": conversation(14)}
+        state.update(context.manage_context(state))
+        first_summary = state["summary"]
+        self.assertEqual(context.manage_context(state), {})
+        first_prompts = len(self.model.prompts)
+
+        state["messages"] = conversation(22)
+        update = context.manage_context(state)
+        self.assertEqual(update["summarized_through"], "r16")
+        self.assertNotEqual(update["summary"], first_summary)
+        transcripts = [prompt[1].content for prompt in self.model.prompts[first_prompts:]]
+        self.assertIn(f"Current summary:\n{first_summary}", transcripts[0])
+        transcript = "\n".join(transcripts)
+        self.assertNotIn("question 8", transcript)
+        self.assertIn("question 9", transcript)
+        self.assertIn("question 16", transcript)
+
+    def test_keep_zero(self):
+        with mock.patch.object(context, "CONTEXT_KEEP_RECENT_TURNS", 0):
+            self.assertEqual(context.manage_context({"messages": conversation(13)}), {})
+            update = context.manage_context({"messages": conversation(14)})
+            built = context.build_context({"messages": conversation(14), **update})
+        self.assertEqual(update["summarized_through"], "r8")
+        self.assertEqual(built[1].id, "h9")
+        # The last turn is answered, so no tool output is kept whole
+        self.assertEqual([len(message.content) == len(TOOL_OUTPUT) for message in built if isinstance(message, ToolMessage)], [False] * 6)
+
+    def test_only_the_current_turn_is_never_folded(self):
+        self.assertEqual(context.manage_context({"messages": turn(1, tool_rounds=4)}), {})
+
+    def test_summarizer_failure_leaves_the_state(self):
+        self.model.fail = True
+        with self.assertLogs(context.logger, "ERROR"):
+            self.assertEqual(context.manage_context({"messages": conversation(14)}), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Tests for the local search backend (lib/search/local_search.py)."""
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.search.local_search import LocalSearchBackend
+
+
+def document(doc_id, content, userid="alice", file_id="f1", chunk_index=0, vector=None):
+    doc = {
+        "id": doc_id,
+        "content": content,
+        "file_id": file_id,
+        "filename": f"{file_id}.txt",
+        "userid": userid,
+        "chunk_index": chunk_index,
+    }
+    if vector is not None:
+        doc["content_vector"] = list(vector)
+    return doc
+
+
+class LocalSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory(prefix="local-search-test-")
+        self.path = self._directory.name
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.close()
+        self._directory.cleanup()
+
+    def open_backend(self, path=None, **kwargs):
+        backend = LocalSearchBackend(path=path or self.path, **kwargs)
+        self.backends.append(backend)
+        return backend
+
+
+class TextSearchTest(LocalSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = self.open_backend()
+        self.backend.upload_documents([
+            document("once", "revenue grew in the north region"),
+            document("twice", "revenue revenue grew"),
+            document("rare", "margin improved while revenue grew"),
+            document("none", "costs rose slowly"),
+            document("long", "revenue " + "filler " * 200),
+            document("bob", "revenue revenue revenue", userid="bob"),
+        ])
+
+    def ids(self, results):
+        return [result["id"] for result in results]
+
+    def test_ranks_by_bm25(self):
+        results = self.backend.text_search("revenue", top=10)
+        ids = self.ids(results)
+        self.assertNotIn("none", ids)
+        # Higher term frequency ranks first; a long document ranks last for the same frequency
+        self.assertLess(ids.index("twice"), ids.index("once"))
+        self.assertEqual(ids[-1], "long")
+        scores = [result["@search.score"] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_rare_terms_weigh_more(self):
+        # "margin" is in one document, "revenue" in nearly all
+        self.assertEqual(self.ids(self.backend.text_search("margin revenue", top=1)), ["rare"])
+
+    def test_filter_and_top(self):
+        self.assertEqual(self.ids(self.backend.text_search("revenue", top=10, filter="userid eq 'bob'")), ["bob"])
+        self.assertEqual(len(self.backend.text_search("revenue", top=2)), 2)
+        self.assertEqual(self.backend.text_search("nothingmatches", top=5), [])
+
+    def test_wildcard_matches_everything(self):
+        self.assertEqual(len(self.backend.text_search("*", top=100)), 6)
+
+
+class FilterTest(LocalSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = self.open_backend()
+        self.backend.upload_documents([
+            document(f"{userid}-{file_id}-{index}", "text", userid=userid, file_id=file_id, chunk_index=index)
+            for userid in ("alice", "bob")
+            for file_id in ("f1", "f2")
+            for index in range(3)
+        ])
+
+    def find(self, filter):
+        return set(self.backend.find_ids(filter))
+
+    def test_equality_and_boolean_operators(self):
+        self.assertEqual(len(self.find("userid eq 'alice'")), 6)
+        self.assertEqual(len(self.find("userid ne 'alice'")), 6)
+        self.assertEqual(self.find("userid eq 'alice' and file_id eq 'f2' and chunk_index eq 1"), {"alice-f2-1"})
+        self.assertEqual(len(self.find("userid eq 'alice' or file_id eq 'f1'")), 9)
+        self.assertEqual(len(self.find("not (userid eq 'alice')")), 6)
+
+    def test_search_in_and_ranges(self):
+        self.assertEqual(len(self.find("search.in(userid, 'alice,bob') and file_id eq 'f1'")), 6)
+        self.assertEqual(self.find("userid eq 'bob' and file_id eq 'f1' and chunk_index ge 2"), {"bob-f1-2"})
+        self.assertEqual(len(self.find("chunk_index lt 1")), 4)
+
+    def test_rejects_unknown_fields_and_syntax(self):
+        with self.assertRaises(ValueError):
+            self.find("content_vector eq 'x'")
+        with self.assertRaises(ValueError):
+            self.find("userid eq")
+
+
+class VectorSearchTest(LocalSearchTestCase):
+    def test_ivf_recall_against_brute_force(self):
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((20, 32))
+        vectors = centres[rng.integers(0, 20, size=3000)] + 0.3 * rng.standard_normal((3000, 32))
+        documents = [document(f"d{index}", "text", vector=vector) for index, vector in enumerate(vectors)]
+
+        brute = self.open_backend(path=f"{self.path}/brute", index_type="brute")
+        ivf = self.open_backend(path=f"{self.path}/ivf", index_type="ivf", nprobe=8)
+        brute.upload_documents(documents)
+        ivf.upload_documents(documents)
+
+        recalls = []
+        for query in vectors[rng.integers(0, 3000, size=30)] + 0.1 * rng.standard_normal((30, 32)):
+            exact = {result["id"] for result in brute.vector_search(query.tolist(), top=10)}
+            approximate = {result["id"] for result in ivf.vector_search(query.tolist(), top=10)}
+            recalls.append(len(exact & approximate) / len(exact))
+        self.assertIsNotNone(ivf._centroids)
+        self.assertGreaterEqual(np.mean(recalls), 0.9)
+
+    def test_scores_are_cosine_similarities(self):
+        backend = self.open_backend(index_type="brute")
+        backend.upload_documents([
+            document("same", "a", vector=[2.0, 0.0]),
+            document("orthogonal", "b", vector=[0.0, 1.0]),
+            document("opposite", "c", vector=[-1.0, 0.0]),
+        ])
+        results = backend.vector_search([1.0, 0.0], top=3)
+        self.assertEqual([result["id"] for result in results], ["same", "orthogonal", "opposite"])
+        self.assertAlmostEqual(results[0]["@search.score"], 1.0, places=5)
+        self.assertAlmostEqual(results[2]["@search.score"], -1.0, places=5)
+        with self.assertRaises(ValueError):
+            backend.vector_search([1.0, 0.0, 0.0])
+
+    def test_hybrid_search_fuses_both_lists(self):
+        backend = self.open_backend(index_type="brute")
+        backend.upload_documents([
+            document("text-match", "quarterly revenue", vector=[0.0, 1.0]),
+            document("vector-match", "unrelated", vector=[1.0, 0.0]),
+            document("neither", "other", vector=[-1.0, 0.0]),
+        ])
+        ids = [result["id"] for result in backend.hybrid_search("revenue", lambda _: [1.0, 0.0], top=2)]
+        self.assertEqual(set(ids), {"text-match", "vector-match"})
+
+
+class PersistenceTest(LocalSearchTestCase):
+    def test_delete_and_reopen(self):
+        backend = self.open_backend(index_type="brute")
+        backend.upload_documents([
+            document(f"d{index}", f"word{index} shared", file_id=f"f{index % 2}", vector=[1.0, float(index)])
+            for index in range(6)
+        ])
+        self.assertEqual(backend.delete_documents(["d0", "d1", "missing"]), 2)
+        self.assertEqual(sorted(backend.delete_matching("file_id eq 'f0'")), ["d2", "d4"])
+        backend.upload_documents([document("d3", "replaced", file_id="f1", vector=[0.0, 1.0])])
+        backend.close()
+        self.backends.remove(backend)
+
+        reopened = self.open_backend(index_type="brute")
+        self.assertIsNone(reopened.get_document("d0"))
+        self.assertEqual(sorted(reopened.find_ids("file_id eq 'f1'")), ["d3", "d5"])
+        self.assertEqual(reopened.get_document("d3")["content"], "replaced")
+        self.assertAlmostEqual(reopened.get_document("d5", ["id", "content_vector"])["content_vector"][0], 1 / np.sqrt(26), places=6)
+        self.assertEqual([result["id"] for result in reopened.text_search("shared", top=10)], ["d5"])
+        self.assertEqual([result["id"] for result in reopened.vector_search([0.0, 1.0], top=1)], ["d3"])
+
+        # Row numbers continue after the reopened ones
+        reopened.upload_documents([document("d6", "new shared", vector=[1.0, 0.0])])
+        self.assertEqual(sorted(result["id"] for result in reopened.text_search("shared", top=10)), ["d5", "d6"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""Tests for the bulk re-indexing job routes (routes/file_indexing.py) and their one-job-at-a-time guard."""
+import os
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from lib import database
+from lib.database import DatabaseManager
+from routes import file_indexing
+from tests import TEST_DIR
+
+AUTH = ("tests", "tests")
+
+
+class FakeOrchestrator:
+    """Starts no workflows, but records them as processing until told otherwise."""
+
+    def __init__(self):
+        self.workflows = {}
+
+    def invoke_workflow(self, name, **kwargs):
+        workflow_id = str(uuid.uuid4())
+        self.workflows[workflow_id] = {"name": name, "input": kwargs, "status": "processing"}
+        return workflow_id
+
+    def get_workflow_status(self, workflow_id):
+        workflow = self.workflows.get(workflow_id)
+        return {"status": workflow["status"]} if workflow else None
+
+
+def new_database():
+    return DatabaseManager(db_path=os.path.join(TEST_DIR, f"reindex-{uuid.uuid4()}.db"))
+
+
+class ReindexRoutesTest(unittest.TestCase):
+    def setUp(self):
+        self.db = new_database()
+        self.orchestrator = FakeOrchestrator()
+        for patcher in (
+            mock.patch.object(file_indexing, "db_manager", self.db),
+            mock.patch.object(file_indexing, "get_orchestrator", lambda: self.orchestrator),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for index in range(3):
+            self.db.create_file(f"file-{index}", "alice" if index < 2 else "bob", f"f{index}.txt", f"blob-{index}")
+
+        app = FastAPI()
+        app.include_router(file_indexing.file_indexing_route)
+        self.client = TestClient(app)
+
+    def start_job(self, **body):
+        return self.client.post("/admin/reindex", json=body, auth=AUTH)
+
+    def driver(self, job):
+        return self.orchestrator.workflows[job["workflow_id"]]
+
+    def test_creates_a_job_and_starts_its_driver(self):
+        response = self.start_job(userid="alice", max_concurrency=2)
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job["filters"], {"userid": "alice"})
+        self.assertEqual(job["max_concurrency"], 2)
+        self.assertEqual(job["progress"]["pending"], 2)
+        self.assertEqual(self.driver(job), {"name": "reindex_files_v1", "input": {"job_id": job["job_id"]}, "status": "processing"})
+        self.assertEqual([item.file_id for item in self.db.get_reindex_job_items(job["job_id"])], ["file-0", "file-1"])
+
+    def test_max_concurrency_leaves_an_orchestrator_thread_free(self):
+        self.assertEqual(self.start_job(max_concurrency=4).status_code, 422)
+        self.assertEqual(self.start_job(max_concurrency=0).status_code, 422)
+
+    def test_one_job_at_a_time(self):
+        first = self.start_job().json()
+        response = self.start_job()
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(first["job_id"], response.json()["detail"])
+        self.assertEqual(len(self.db.list_reindex_jobs()), 1)
+
+        # Once its driver is done, the next job can start
+        self.driver(first)["status"] = "done"
+        self.db.update_reindex_job(first["job_id"], "completed")
+        self.assertEqual(self.start_job().status_code, 200)
+
+    def test_resume(self):
+        job = self.start_job().json()
+        resume_url = f"/admin/reindex/{job['job_id']}/resume"
+        self.assertEqual(self.client.post(resume_url, auth=AUTH).status_code, 409)
+
+        # The driver failed partway through; resuming starts a new one
+        self.driver(job)["status"] = "failed"
+        self.db.update_reindex_job(job["job_id"], "failed")
+        self.db.update_reindex_job_item(job["job_id"], "file-0", "completed")
+        response = self.client.post(resume_url, auth=AUTH)
+        self.assertEqual(response.status_code, 200)
+        resumed = response.json()
+        self.assertEqual(resumed["status"], "pending")
+        self.assertNotEqual(resumed["workflow_id"], job["workflow_id"])
+        self.assertEqual(self.driver(resumed)["status"], "processing")
+        self.assertEqual(resumed["progress"]["completed"], 1)
+
+        self.assertEqual(self.start_job().status_code, 409)
+        self.assertEqual(self.client.post("/admin/reindex/missing/resume", auth=AUTH).status_code, 404)
+
+        self.db.update_reindex_job(job["job_id"], "completed")
+        self.assertEqual(self.client.post(resume_url, auth=AUTH).status_code, 409)
+
+    def test_reindexing_drops_the_cached_chunks(self):
+        for file_id in ("file-0", "file-1", "file-2"):
+            file_indexing.chunk_cache.set(f"{file_id}_0", {"id": f"{file_id}_0", "file_id": file_id})
+        self.addCleanup(file_indexing.chunk_cache.clear)
+
+        response = self.client.post("/files/file-2/reindex", auth=AUTH, headers={"userid": "bob"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(file_indexing.chunk_cache.get("file-2_0"))
+        self.assertIsNotNone(file_indexing.chunk_cache.get("file-0_0"))
+
+        self.assertEqual(self.start_job(userid="alice").status_code, 200)
+        self.assertIsNone(file_indexing.chunk_cache.get("file-0_0"))
+        self.assertIsNone(file_indexing.chunk_cache.get("file-1_0"))
+
+    def test_a_failed_driver_start_does_not_block_other_jobs(self):
+        with mock.patch.object(self.orchestrator, "invoke_workflow", side_effect=RuntimeError("orchestrator down")):
+            self.assertEqual(self.start_job().status_code, 500)
+        self.assertEqual([job.status for job in self.db.list_reindex_jobs()], ["failed"])
+        self.assertEqual(self.start_job().status_code, 200)
+
+
+class ReindexJobClaimTest(unittest.TestCase):
+    def test_job_being_started_counts_as_running_for_a_while(self):
+        db = new_database()
+        self.assertIsNone(db.create_reindex_job("job-1", {}, 3, [], lambda workflow_id: False))
+        # Created, and its driver not started yet
+        self.assertEqual(db.create_reindex_job("job-2", {}, 3, [], lambda workflow_id: False), "job-1")
+        self.assertEqual(db.restart_reindex_job("job-1", lambda workflow_id: False), "job-1")
+        # ... unless its worker died before starting it
+        with mock.patch.object(database, "REINDEX_START_TIMEOUT_SECONDS", 0):
+            self.assertIsNone(db.create_reindex_job("job-2", {}, 3, [], lambda workflow_id: False))
+
+    def test_workers_creating_jobs_at_once_create_one(self):
+        # Separate managers, like worker processes, on the same database file
+        path = os.path.join(TEST_DIR, f"reindex-{uuid.uuid4()}.db")
+        managers = [DatabaseManager(db_path=path) for _ in range(4)]
+
+        def slow_check(workflow_id):
+            time.sleep(0.05)
+            return True
+
+        results = {}
+        barrier = threading.Barrier(len(managers))
+
+        def create(index):
+            barrier.wait()
+            results[index] = managers[index].create_reindex_job(f"job-{index}", {}, 3, ["file-0"], slow_check)
+
+        threads = [threading.Thread(target=create, args=(index,)) for index in range(len(managers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        created = [f"job-{index}" for index, running_job_id in results.items() if running_job_id is None]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(set(results.values()), {None, created[0]})
+        self.assertEqual([job.job_id for job in managers[0].list_reindex_jobs()], created)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""Tests for deleting the documents matching a filter (SearchBackend.delete_matching)."""
+import asyncio
+import re
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import tests  # noqa: F401 - test settings, before the app modules
+from lib.azure_clients import azure_clients
+from lib.search import SearchDeleteError, set_search_backend
+from lib.search import azure_search
+from lib.search.azure_search import AzureSearchBackend
+from lib.search.local_search import LocalSearchBackend
+
+
+class FakeSearchClient:
+    """The search and delete calls of an Azure SearchClient over documents with a file_id."""
+
+    def __init__(self, documents):
+        self.documents = dict(documents)
+        # Id -> how many more deletes of it fail; -1 for always
+        self.failures = {}
+        self.failing_batches = 0
+        self.batch_sizes = []
+        self.max_concurrent_deletes = 0
+        self._concurrent_deletes = 0
+        self._lock = threading.Lock()
+
+    def search(self, search_text, filter, select, top, skip=0):
+        file_id = re.fullmatch(r"file_id eq '(.*)'", filter).group(1)
+        ids = [doc_id for doc_id, doc_file_id in self.documents.items() if doc_file_id == file_id]
+        return [{"id": doc_id} for doc_id in ids[skip:skip + top]]
+
+    def delete_documents(self, documents):
+        with self._lock:
+            self.batch_sizes.append(len(documents))
+            self._concurrent_deletes += 1
+            self.max_concurrent_deletes = max(self.max_concurrent_deletes, self._concurrent_deletes)
+        try:
+            time.sleep(0.01)
+            with self._lock:
+                if self.failing_batches:
+                    self.failing_batches -= 1
+                    raise ConnectionError("connection reset")
+                results = []
+                for document in documents:
+                    doc_id = document["id"]
+                    failures = self.failures.get(doc_id, 0)
+                    if failures:
+                        self.failures[doc_id] = failures - 1 if failures > 0 else failures
+                        results.append(SimpleNamespace(key=doc_id, succeeded=False, status_code=503))
+                    else:
+                        self.documents.pop(doc_id, None)
+                        results.append(SimpleNamespace(key=doc_id, succeeded=True, status_code=200))
+                return results
+        finally:
+            with self._lock:
+                self._concurrent_deletes -= 1
+
+    def close(self):
+        pass
+
+
+class AzureDeleteMatchingTest(unittest.TestCase):
+    def setUp(self):
+        documents = {f"f1_{index}": "f1" for index in range(2100)}
+        documents.update({f"f2_{index}": "f2" for index in range(10)})
+        self.client = FakeSearchClient(documents)
+        azure_clients.override("search_client", self.client)
+        self.addCleanup(azure_clients.reset)
+        for patcher in (
+            mock.patch.object(azure_search, "DELETE_RETRY_SECONDS", 0),
+            mock.patch.object(azure_search, "DELETE_REFRESH_SECONDS", 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.backend = AzureSearchBackend()
+
+    def test_deletes_every_match_in_concurrent_batches(self):
+        deleted_ids = self.backend.delete_matching("file_id eq 'f1'")
+        self.assertEqual(sorted(deleted_ids), sorted(f"f1_{index}" for index in range(2100)))
+        self.assertEqual(sorted(self.client.documents), sorted(f"f2_{index}" for index in range(10)))
+        self.assertLessEqual(max(self.client.batch_sizes), azure_search.SEARCH_DELETE_BATCH_SIZE)
+        self.assertGreater(self.client.max_concurrent_deletes, 1)
+
+    def test_retries_failed_deletes(self):
+        self.client.failures = {"f2_1": 2, "f2_5": azure_search.DELETE_RETRY_ATTEMPTS}
+        self.assertEqual(sorted(self.backend.delete_matching("file_id eq 'f2'")), sorted(f"f2_{index}" for index in range(10)))
+        self.assertEqual(self.client.documents.keys(), {f"f1_{index}" for index in range(2100)})
+
+    def test_reports_the_deletes_that_keep_failing(self):
+        self.client.failures = {"f2_3": -1}
+        with self.assertRaises(SearchDeleteError) as raised:
+            self.backend.delete_matching("file_id eq 'f2'")
+        self.assertEqual(raised.exception.failed_ids, ["f2_3"])
+        self.assertEqual(sorted(raised.exception.deleted_ids), sorted(f"f2_{index}" for index in range(10) if index != 3))
+        self.assertIn("f2_3", self.client.documents)
+
+    def test_reports_a_failed_batch(self):
+        self.client.failing_batches = 1
+        with self.assertRaises(SearchDeleteError) as raised:
+            self.backend.delete_matching("file_id eq 'f2'")
+        self.assertEqual(sorted(raised.exception.failed_ids), sorted(f"f2_{index}" for index in range(10)))
+        self.assertEqual(raised.exception.deleted_ids, [])
+        self.assertIsInstance(raised.exception.__cause__, ConnectionError)
+
+
+class FlakyLocalSearchBackend(LocalSearchBackend):
+    """Local backend failing to delete some ids, and losing others to a concurrent delete."""
+
+    undeletable = set()
+    deleted_concurrently = set()
+
+    def delete_documents(self, ids):
+        super().delete_documents([doc_id for doc_id in ids if doc_id in self.deleted_concurrently])
+        return super().delete_documents([doc_id for doc_id in ids if doc_id not in self.undeletable])
+
+
+class DefaultDeleteMatchingTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix="search-delete-test-")
+        self.addCleanup(directory.cleanup)
+        self.backend = FlakyLocalSearchBackend(path=directory.name)
+        self.addCleanup(self.backend.close)
+        self.backend.upload_documents([
+            {"id": f"{file_id}_{index}", "content": "text", "file_id": file_id, "filename": "a.txt", "userid": "alice", "chunk_index": index}
+            for file_id in ("f1", "f2")
+            for index in range(5)
+        ])
+
+    def test_documents_deleted_concurrently_are_gone_too(self):
+        self.backend.deleted_concurrently = {"f1_2"}
+        self.assertEqual(sorted(self.backend.delete_matching("file_id eq 'f1'")), [f"f1_{index}" for index in range(5)])
+        self.assertEqual(self.backend.find_ids("file_id eq 'f1'"), [])
+
+    def test_raises_for_documents_left_in_the_index(self):
+        self.backend.undeletable = {"f1_4"}
+        with self.assertRaises(SearchDeleteError) as raised:
+            self.backend.delete_matching("file_id eq 'f1'")
+        self.assertEqual(raised.exception.failed_ids, ["f1_4"])
+        self.assertEqual(sorted(raised.exception.deleted_ids), ["f1_0", "f1_1", "f1_2", "f1_3"])
+
+    def test_delete_file_chunks_counts_and_uncaches_the_deleted_chunks(self):
+        from routes.file_indexing import _delete_file_chunks, chunk_cache
+
+        set_search_backend(self.backend)
+        self.addCleanup(set_search_backend, None)
+        for index in range(5):
+            chunk_cache.set(f"f1_{index}", {"id": f"f1_{index}"})
+        self.backend.undeletable = {"f1_4"}
+        with self.assertRaises(SearchDeleteError):
+            asyncio.run(_delete_file_chunks("f1"))
+        self.assertEqual([chunk_cache.get(f"f1_{index}") is None for index in range(5)], [True] * 4 + [False])
+
+        self.backend.undeletable = set()
+        self.assertEqual(asyncio.run(_delete_file_chunks("f1")), 1)
+        self.assertIsNone(chunk_cache.get("f1_4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
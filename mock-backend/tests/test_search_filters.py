@@ -0,0 +1,84 @@
+"""Tests for the OData filter parser of the search backends (lib/search/filters.py)."""
+import unittest
+
+from lib.search.filters import parse_filter, quote_literal, scope_filter_to_user
+
+
+class ParseFilterTest(unittest.TestCase):
+    def test_comparisons(self):
+        self.assertEqual(parse_filter("userid eq 'alice'"), ("cmp", "eq", "userid", "alice"))
+        self.assertEqual(parse_filter("userid ne 'alice'"), ("cmp", "ne", "userid", "alice"))
+        self.assertEqual(parse_filter("chunk_index ge 3"), ("cmp", "ge", "chunk_index", 3))
+        self.assertEqual(parse_filter("score lt -1.5"), ("cmp", "lt", "score", -1.5))
+
+    def test_literals(self):
+        self.assertEqual(parse_filter("flag eq true"), ("cmp", "eq", "flag", True))
+        self.assertEqual(parse_filter("flag eq FALSE"), ("cmp", "eq", "flag", False))
+        self.assertEqual(parse_filter("filename eq null"), ("cmp", "eq", "filename", None))
+
+    def test_quoted_strings(self):
+        self.assertEqual(parse_filter("filename eq 'O''Brien.pdf'"), ("cmp", "eq", "filename", "O'Brien.pdf"))
+        self.assertEqual(parse_filter("filename eq 'a and b or (c)'"), ("cmp", "eq", "filename", "a and b or (c)"))
+        self.assertEqual(parse_filter("filename eq ''"), ("cmp", "eq", "filename", ""))
+
+    def test_and_binds_tighter_than_or(self):
+        self.assertEqual(
+            parse_filter("a eq 1 or b eq 2 and c eq 3"),
+            ("or", ("cmp", "eq", "a", 1), ("and", ("cmp", "eq", "b", 2), ("cmp", "eq", "c", 3)))
+        )
+
+    def test_parentheses_and_not(self):
+        self.assertEqual(
+            parse_filter("not (a eq 1 or b eq 2) and c eq 3"),
+            ("and", ("not", ("or", ("cmp", "eq", "a", 1), ("cmp", "eq", "b", 2))), ("cmp", "eq", "c", 3))
+        )
+
+    def test_search_in(self):
+        self.assertEqual(parse_filter("search.in(file_id, '1,2, 3')"), ("in", "file_id", ["1", "2", "3"]))
+        self.assertEqual(parse_filter("search.in(file_id, 'a b|c', '|')"), ("in", "file_id", ["a b", "c"]))
+        self.assertEqual(
+            parse_filter("userid eq 'u' and search.in(file_id, 'x')"),
+            ("and", ("cmp", "eq", "userid", "u"), ("in", "file_id", ["x"]))
+        )
+
+    def test_rejects_unsupported_expressions(self):
+        for expression in [
+            "",
+            "userid",
+            "userid eq",
+            "userid like 'a%'",
+            "userid eq 'alice",
+            "(userid eq 'alice'",
+            "userid eq 'alice')",
+            "userid eq 'alice' extra",
+            "userid eq 'a' and",
+            "search.in(file_id)",
+            "userid eq \"alice\"",
+        ]:
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    parse_filter(expression)
+
+
+class ScopeFilterTest(unittest.TestCase):
+    def test_quote_literal_round_trips(self):
+        for value in ["alice", "O'Brien", "''", "a) or (true"]:
+            with self.subTest(value=value):
+                self.assertEqual(parse_filter(f"userid eq {quote_literal(value)}"), ("cmp", "eq", "userid", value))
+
+    def test_scopes_to_user(self):
+        self.assertEqual(scope_filter_to_user("alice"), "userid eq 'alice'")
+        self.assertEqual(
+            parse_filter(scope_filter_to_user("alice", "file_id eq '1' or file_id eq '2'")),
+            ("and", ("cmp", "eq", "userid", "alice"), ("or", ("cmp", "eq", "file_id", "1"), ("cmp", "eq", "file_id", "2")))
+        )
+
+    def test_rejects_filters_escaping_their_parentheses(self):
+        for expression in ["file_id eq '1') or (userid ne 'alice'", "file_id eq '1' or (", "file_id eq 'x"]:
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    scope_filter_to_user("alice", expression)
+
+
+if __name__ == "__main__":
+    unittest.main()
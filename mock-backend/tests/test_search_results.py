@@ -0,0 +1,73 @@
+"""Tests for the rendering of search results for the agent (utils/search_results.py)."""
+import unittest
+
+from utils.search_results import CHARS_PER_TOKEN, ELLIPSIS, format_search_results
+
+WORDS = "revenue grew in every region while costs rose more slowly than sales".split()
+
+
+def text(length, offset=0):
+    """Words of WORDS from `offset` on, cut to `length` characters."""
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(WORDS[(offset + len(words)) % len(WORDS)])
+    return " ".join(words)[:length]
+
+
+def result(doc_id, content, file_id="f1", chunk_index=0):
+    return {"id": doc_id, "content": content, "file_id": file_id, "filename": f"{file_id}.pdf", "chunk_index": chunk_index}
+
+
+class FormatSearchResultsTest(unittest.TestCase):
+    def test_renders_all_results_within_the_budget(self):
+        output = format_search_results([result("a", "alpha"), result("b", "beta", chunk_index=5)], "Found 2 results:")
+        self.assertTrue(output.startswith("Found 2 results:\n\n# f1.pdf 0\n- chunk_id/id: a\n"))
+        self.assertIn("```\nbeta\n```", output)
+        self.assertNotIn("[Showing", output)
+
+    def test_stays_within_the_token_budget(self):
+        results = [result(f"r{index}", text(2000, index), file_id=f"f{index}") for index in range(10)]
+        output = format_search_results(results, "Found 10 results:", token_budget=1000)
+        self.assertLessEqual(len(output), 1000 * CHARS_PER_TOKEN)
+        self.assertIn("# f0.pdf 0", output)
+        self.assertNotIn("# f9.pdf 0", output)
+        self.assertRegex(output, r"\[Showing 2 of 10 results; ~\d+ tokens elided to stay within the 1000-token budget \(8 results omitted, 1 truncated\)\.")
+        self.assertIn("Refine the query or lower `top`", output)
+
+    def test_truncates_at_a_word_boundary(self):
+        content = text(3000)
+        output = format_search_results([result("a", content)], "Found 1 result:", token_budget=200)
+        shown = output.split("```\n")[1]
+        self.assertTrue(shown.endswith(ELLIPSIS + "\n"))
+        self.assertTrue(content.startswith(shown[:-len(ELLIPSIS) - 1]))
+        self.assertEqual(content[len(shown) - len(ELLIPSIS) - 1], " ")
+        self.assertIn("(0 results omitted, 1 truncated)", output)
+
+    def test_skips_duplicate_content(self):
+        output = format_search_results(
+            [result("a", "same text"), result("b", "same text", file_id="f2"), result("c", "other")],
+            "Found 3 results:"
+        )
+        self.assertEqual(output.count("same text"), 1)
+        self.assertIn("[Showing 2 of 3 results; 1 results with duplicate content skipped.]", output)
+
+    def test_shows_the_overlap_of_neighbouring_chunks_once(self):
+        shared = " ".join(f"shared{index}" for index in range(15))
+        first, second = text(400) + " " + shared, shared + " " + text(400, 7)
+        output = format_search_results([result("c1", second, chunk_index=1), result("c0", first, chunk_index=0)], "Found 2 results:")
+        self.assertEqual(output.count(shared), 1)
+        # The chunk shown first keeps the overlap; its neighbour shown after it drops it
+        self.assertIn(f"```\n{second}\n```", output)
+        self.assertIn(f"```\n{first[:-len(shared)]}{ELLIPSIS}\n```", output)
+        self.assertIn(f"~{len(shared) // CHARS_PER_TOKEN} tokens of overlap between neighbouring chunks shown once", output)
+
+    def test_overlap_of_an_omitted_chunk_is_not_counted(self):
+        shared = " ".join(f"shared{index}" for index in range(15))
+        first, second = text(400) + " " + shared, shared + " " + text(4000, 7)
+        output = format_search_results([result("c0", first), result("c1", second, chunk_index=1)], "Found 2 results:", token_budget=250)
+        self.assertIn("(1 results omitted, 0 truncated)", output)
+        self.assertNotIn("overlap", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests for the token usage a chat reports in its finish (d:) frame and records per conversation."""
+import json
+import unittest
+from typing import Any, Dict, List
+
+from pydantic import Field
+
+from benchmarks.fakes import FakeChatModel
+from tests.test_chat_runs import AUTH, USER, ChatRouteTestCase
+
+
+class RecordingChatModel(FakeChatModel):
+    """Fake model recording the usage it reports for each call."""
+
+    usages: List[Dict[str, int]] = Field(default_factory=list)
+
+    def _chunks(self, messages, tool_names):
+        for chunk in super()._chunks(messages, tool_names):
+            if chunk.message.usage_metadata:
+                self.usages.append(chunk.message.usage_metadata)
+            yield chunk
+
+
+def finish_usage(response) -> Dict[str, Any]:
+    frames = response.text.splitlines()
+    assert frames[-1].startswith("d:"), frames[-1]
+    return json.loads(frames[-1][2:])["usage"]
+
+
+class UsageTest(ChatRouteTestCase):
+    def chat_model(self):
+        self.model = RecordingChatModel(tokens_per_second=0, response_tokens=self.response_tokens, tool_call_ratio=1.0)
+        return self.model
+
+    def totals(self, usages):
+        prompt_tokens = sum(usage["input_tokens"] for usage in usages)
+        completion_tokens = sum(usage["output_tokens"] for usage in usages)
+        return prompt_tokens, completion_tokens
+
+    def test_finish_frame_and_stored_totals_match_the_model(self):
+        user_before = self.client.get("/usage", headers=USER, auth=AUTH).json()
+        conversation_id = self.new_conversation()
+
+        response = self.chat(conversation_id)
+        # The search tool call and the answer
+        self.assertEqual(len(self.model.usages), 2)
+        first_run = self.totals(self.model.usages)
+        usage = finish_usage(response)
+        self.assertEqual((usage["promptTokens"], usage["completionTokens"]), first_run)
+
+        # The second run reads the whole conversation so far, and adds to the totals
+        response = self.chat(conversation_id, "And costs?")
+        second_run = self.totals(self.model.usages[2:])
+        usage = finish_usage(response)
+        self.assertEqual((usage["promptTokens"], usage["completionTokens"]), second_run)
+        self.assertGreater(second_run[0], first_run[0])
+
+        prompt_tokens, completion_tokens = self.totals(self.model.usages)
+        stored = self.client.get(f"/conversations/{conversation_id}/usage", headers=USER, auth=AUTH).json()
+        self.assertEqual(stored["promptTokens"], prompt_tokens)
+        self.assertEqual(stored["completionTokens"], completion_tokens)
+        self.assertEqual(stored["totalTokens"], prompt_tokens + completion_tokens)
+        self.assertEqual(stored["llmCalls"], 4)
+        self.assertEqual(stored["runs"], 2)
+
+        user_after = self.client.get("/usage", headers=USER, auth=AUTH).json()
+        self.assertEqual(user_after["conversations"], user_before["conversations"] + 1)
+        for key, added in (("promptTokens", prompt_tokens), ("completionTokens", completion_tokens), ("llmCalls", 4), ("runs", 2)):
+            self.assertEqual(user_after[key], user_before[key] + added, key)
+
+    def test_conversation_without_runs(self):
+        conversation_id = self.new_conversation()
+        stored = self.client.get(f"/conversations/{conversation_id}/usage", headers=USER, auth=AUTH).json()
+        self.assertEqual((stored["totalTokens"], stored["runs"]), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
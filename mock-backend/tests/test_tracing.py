@@ -0,0 +1,217 @@
+"""Tests for the OpenTelemetry tracing (lib/tracing.py and the traced checkpointer of agent/graph.py).
+
+The spans go to an in-memory exporter, in place of the tracer TRACING_EXPORTER sets up.
+Needs the tracing extra (`uv sync --extra tracing`); skipped without it.
+"""
+import asyncio
+import contextvars
+import os
+import unittest
+from unittest import mock
+
+import aiosqlite
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import tool
+from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode, tools_condition
+
+from lib import tracing
+from tests import TEST_DIR
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+except ImportError:
+    TracerProvider = None
+
+
+@unittest.skipIf(TracerProvider is None, "needs the OpenTelemetry SDK (uv sync --extra tracing)")
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        patcher = mock.patch.multiple(
+            tracing, create=True,
+            tracer=provider.get_tracer(__name__), TRACING_ENABLED=True,
+            trace=trace, propagate=propagate, otel_context=otel_context,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spans(self, name=None):
+        return [span for span in self.exporter.get_finished_spans() if name is None or span.name == name]
+
+    def only_span(self, name):
+        spans = self.spans(name)
+        self.assertEqual(len(spans), 1, f"spans named {name!r}")
+        return spans[0]
+
+    def assertChildOf(self, child, parent):
+        self.assertEqual(child.parent.span_id, parent.context.span_id)
+        self.assertEqual(child.context.trace_id, parent.context.trace_id)
+
+
+class SpanTest(TracingTestCase):
+    def test_traced_and_nested_spans(self):
+        @tracing.traced("inner")
+        def inner():
+            return 42
+
+        def run():
+            with tracing.span("outer", {"extra": 1}):
+                tracing.bind_attributes(conversation_id="c1", userid="alice")
+                return inner()
+
+        # In a copy of the context, as bind_attributes outlives the block
+        self.assertEqual(contextvars.copy_context().run(run), 42)
+        outer, inner_span = self.only_span("outer"), self.only_span("inner")
+        self.assertChildOf(inner_span, outer)
+        self.assertEqual(outer.attributes["extra"], 1)
+        self.assertEqual(outer.attributes["conversation_id"], "c1")
+        self.assertEqual(dict(inner_span.attributes), {"conversation_id": "c1", "userid": "alice"})
+
+    def test_child_only_spans_need_a_parent(self):
+        with tracing.span("query", child_only=True) as query_span:
+            self.assertIsNone(query_span)
+        with tracing.span("request"):
+            with tracing.span("query", child_only=True):
+                pass
+        self.assertChildOf(self.only_span("query"), self.only_span("request"))
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("failing", current=False):
+                raise ValueError("boom")
+        failing = self.only_span("failing")
+        self.assertEqual(failing.status.status_code, trace.StatusCode.ERROR)
+        self.assertEqual(failing.events[0].name, "exception")
+
+
+class MiddlewareTest(TracingTestCase):
+    def setUp(self):
+        super().setUp()
+        app = FastAPI()
+
+        @app.get("/conversations/{conversation_id}")
+        def get_conversation(conversation_id: str):
+            with tracing.span("db.get_conversation", child_only=True):
+                return {"id": conversation_id}
+
+        @app.get("/broken")
+        def broken():
+            return JSONResponse({"detail": "broken"}, status_code=503)
+
+        self.client = TestClient(tracing.TracingMiddleware(app))
+
+    def test_request_span_is_named_after_the_route(self):
+        response = self.client.get("/conversations/c1", headers={"userid": "alice"})
+        self.assertEqual(response.status_code, 200)
+        request = self.only_span("GET /conversations/{conversation_id}")
+        self.assertEqual(request.kind, trace.SpanKind.SERVER)
+        self.assertEqual(request.attributes["http.route"], "/conversations/{conversation_id}")
+        self.assertEqual(request.attributes["url.path"], "/conversations/c1")
+        self.assertEqual(request.attributes["http.response.status_code"], 200)
+        self.assertEqual(request.attributes["conversation_id"], "c1")
+        self.assertEqual(request.attributes["userid"], "alice")
+        query = self.only_span("db.get_conversation")
+        self.assertChildOf(query, request)
+        self.assertEqual(query.attributes["userid"], "alice")
+
+    def test_continues_an_incoming_trace(self):
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        self.client.get("/conversations/c1", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+        request = self.only_span("GET /conversations/{conversation_id}")
+        self.assertEqual(request.context.trace_id, int(trace_id, 16))
+        self.assertEqual(request.parent.span_id, int(parent_id, 16))
+
+    def test_server_errors_set_the_status(self):
+        self.client.get("/broken")
+        self.assertEqual(self.only_span("GET /broken").status.status_code, trace.StatusCode.ERROR)
+
+
+@tool
+def hybrid_search(query: str) -> str:
+    """Search the documents."""
+    return "Error: the search index is unavailable"
+
+
+class GraphTracingTest(TracingTestCase):
+    """A graph calling the fake model, which calls the search tool and then answers, checkpointed by the traced saver."""
+
+    def run_graph(self, path, thread_id="c1", parent_span=True):
+        from agent.graph import TracedAsyncSqliteSaver
+        from benchmarks.fakes import FakeChatModel
+
+        model = FakeChatModel(tokens_per_second=0, response_tokens=3, tool_call_ratio=1.0).bind_tools([hybrid_search])
+
+        async def agent(state):
+            return {"messages": [await model.ainvoke(state["messages"])]}
+
+        workflow = StateGraph(MessagesState)
+        workflow.add_node("agent", agent)
+        workflow.add_node("tools", ToolNode([hybrid_search]))
+        workflow.add_edge(START, "agent")
+        workflow.add_conditional_edges("agent", tools_condition)
+        workflow.add_edge("tools", "agent")
+
+        async def run():
+            async with aiosqlite.connect(path) as conn:
+                graph = workflow.compile(checkpointer=TracedAsyncSqliteSaver(conn))
+                config = {"configurable": {"thread_id": thread_id}}
+                if not parent_span:
+                    await graph.ainvoke({"messages": [HumanMessage("What drove revenue?")]}, config)
+                    return
+                with tracing.span("request"):
+                    config["callbacks"] = [tracing.TracingCallbackHandler()]
+                    await graph.ainvoke({"messages": [HumanMessage("What drove revenue?")]}, config)
+                    return [checkpoint async for checkpoint in graph.checkpointer.alist(config)]
+
+        return asyncio.run(run())
+
+    def test_callback_handler_spans(self):
+        self.run_graph(os.path.join(TEST_DIR, "tracing-graph.db"))
+        request, graph = self.only_span("request"), self.only_span("graph LangGraph")
+        self.assertChildOf(graph, request)
+
+        nodes = sorted(self.spans("node agent"), key=lambda span: span.attributes["langgraph.step"])
+        self.assertEqual([span.attributes["langgraph.step"] for span in nodes], [1, 3])
+        tools_node = self.only_span("node tools")
+        for node in nodes + [tools_node]:
+            self.assertChildOf(node, graph)
+
+        chats = self.spans("chat model")
+        self.assertEqual(len(chats), 2)
+        self.assertEqual({chat.parent.span_id for chat in chats}, {node.context.span_id for node in nodes})
+        self.assertTrue(all(chat.attributes["gen_ai.usage.output_tokens"] > 0 for chat in chats))
+
+        # The tool returned an error string to the model, which marks its span failed
+        tool_span = self.only_span("tool hybrid_search")
+        self.assertChildOf(tool_span, tools_node)
+        self.assertEqual(tool_span.status.status_code, trace.StatusCode.ERROR)
+
+    def test_checkpointer_spans(self):
+        checkpoints = self.run_graph(os.path.join(TEST_DIR, "tracing-checkpoints.db"), thread_id="c2")
+        self.assertTrue(checkpoints)
+        request = self.only_span("request")
+        for name in ("checkpoint.get_tuple", "checkpoint.put", "checkpoint.put_writes", "checkpoint.list"):
+            with self.subTest(name=name):
+                spans = self.spans(name)
+                self.assertTrue(spans)
+                for checkpoint_span in spans:
+                    self.assertChildOf(checkpoint_span, request)
+                    self.assertEqual(checkpoint_span.attributes["conversation_id"], "c2")
+        self.assertTrue(all(span.attributes["checkpoint.writes"] > 0 for span in self.spans("checkpoint.put_writes")))
+
+    def test_checkpointer_outside_a_trace_records_nothing(self):
+        self.run_graph(os.path.join(TEST_DIR, "tracing-untraced.db"), thread_id="c3", parent_span=False)
+        self.assertEqual(self.spans(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for the expiring in-memory cache (utils/ttl_cache.py)."""
+import unittest
+from unittest import mock
+
+from utils import ttl_cache
+from utils.ttl_cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(ttl_cache.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = TTLCache(ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=30)
+        self.now += 9.9
+        self.assertEqual((cache.get("a"), cache.get("b")), (1, 2))
+        self.now += 0.1
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        self.now += 20
+        self.assertIsNone(cache.get("b"))
+
+    def test_setting_again_renews_the_ttl(self):
+        cache = TTLCache(ttl=10)
+        cache.set("a", 1)
+        self.now += 8
+        cache.set("a", 2)
+        self.now += 8
+        self.assertEqual(cache.get("a"), 2)
+
+    def test_evicts_the_least_recently_used(self):
+        cache = TTLCache(ttl=10, max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+    def test_delete(self):
+        cache = TTLCache(ttl=10)
+        for index in range(4):
+            cache.set(f"f{index % 2}_{index}", {"file_id": f"f{index % 2}"})
+        cache.delete("f0_0")
+        cache.delete("missing")
+        self.assertIsNone(cache.get("f0_0"))
+        self.assertEqual(cache.delete_where(lambda key, value: value["file_id"] == "f1"), 2)
+        self.assertEqual([cache.get(key) for key in ("f0_2", "f1_1", "f1_3")], [{"file_id": "f0"}, None, None])
+        cache.clear()
+        self.assertIsNone(cache.get("f0_2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Fast JSON encoding for stream frames and API responses.
+
+Uses orjson, or msgspec, when installed (orjson comes with langsmith on CPython)
+and falls back to the standard json module otherwise. All encoders produce
+compact JSON (the json module escapes non-ASCII characters, the others write UTF-8). JSON_ENCODER forces one: "auto" (default), "orjson",
+"msgspec" or "json".
+"""
+import os
+import json
+import logging
+from typing import Any, Callable
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+# Built once: json.dumps with non-default options creates a new encoder on every call
+_stdlib_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def _stdlib_dumpb(obj: Any) -> bytes:
+    return _stdlib_encoder.encode(obj).encode("ascii")
+
+
+def _load_encoder(name: str) -> Callable[[Any], bytes]:
+    if name == "orjson":
+        import orjson
+        return lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    if name == "msgspec":
+        import msgspec
+        return msgspec.json.Encoder().encode
+    if name == "json":
+        return _stdlib_dumpb
+    raise ValueError(f"Unknown JSON_ENCODER: {name}")
+
+
+def _select_encoder():
+    requested = os.getenv("JSON_ENCODER", "auto")
+    for name in (["orjson", "msgspec", "json"] if requested == "auto" else [requested]):
+        try:
+            return name, _load_encoder(name)
+        except ImportError:
+            continue
+    logger.warning(f"JSON encoder '{requested}' is not installed; using the json module")
+    return "json", _stdlib_dumpb
+
+
+json_encoder_name, _fast_dumpb = _select_encoder()
+
+
+def dumpb(obj: Any) -> bytes:
+    """Encode an object as JSON bytes."""
+    try:
+        return _fast_dumpb(obj)
+    except Exception:
+        # e.g. integers beyond 64 bits, which only the json module supports
+        return _stdlib_dumpb(obj)
+
+
+def dumps(obj: Any) -> str:
+    """Encode an object as a JSON string."""
+    if json_encoder_name == "json":
+        return _stdlib_encoder.encode(obj)
+    return dumpb(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with the fastest installed encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumpb(content)
@@ -0,0 +1,151 @@
+"""Formatting of search results for the agent's search tools.
+
+Results are rendered in rank order within a token budget, so a broad search
+cannot flood the prompt of every following agent step. Chunks of the same file
+that are neighbours overlap by up to CHUNK_OVERLAP characters (see the text
+splitter in orchestration/file_indexing.py); when both neighbours are in the
+results the overlapping text is shown only once, and chunks with identical
+content are shown once. A closing note tells the model what was left out.
+
+SEARCH_RESULT_TOKEN_BUDGET sets the default budget (4000 tokens).
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+# Rough number of characters per token of English text for OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("SEARCH_RESULT_TOKEN_BUDGET", "4000"))
+
+# Chunk overlap used by the indexer, and the shortest overlap worth removing
+CHUNK_OVERLAP = 200
+MIN_OVERLAP = 20
+
+# A result is only shown if at least this many tokens of its content fit
+MIN_SNIPPET_TOKENS = 40
+
+ELLIPSIS = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text."""
+    return _chars_to_tokens(len(text))
+
+
+def _chars_to_tokens(chars: int) -> int:
+    return -(-chars // CHARS_PER_TOKEN)
+
+
+def _overlap_length(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    # The splitter trims whitespace at chunk edges, so allow some slack over CHUNK_OVERLAP
+    longest = min(len(left), len(right), CHUNK_OVERLAP * 2)
+    for length in range(longest, MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    """Cut a text to at most max_chars characters, at a word boundary if there is one nearby."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - len(ELLIPSIS))]
+    boundary = cut.rfind(" ")
+    if boundary > len(cut) * 0.8:
+        cut = cut[:boundary]
+    return cut.rstrip() + ELLIPSIS
+
+
+def _render_result(result: Dict[str, Any], content: str) -> str:
+    return (
+        f"# {result.get('filename', 'Unknown')} {result.get('chunk_index', 0)}\n"
+        f"- chunk_id/id: {result.get('id', 'Unknown')}\n"
+        "Content:\n```\n"
+        f"{content}\n"
+        "```\n\n"
+    )
+
+
+def format_search_results(results: List[Dict[str, Any]], heading: str, token_budget: Optional[int] = None) -> str:
+    """Render search results as text for the model, within a token budget.
+
+    Args:
+        results: Search results in rank order (documents with id, content, filename and chunk_index)
+        heading: First line of the output, e.g. "Found 5 results for 'query':"
+        token_budget: Approximate maximum size of the output in tokens (default: SEARCH_RESULT_TOKEN_BUDGET)
+
+    Returns:
+        str: The formatted results, followed by a note on anything that was elided
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    # Keep some room for the closing note
+    remaining = token_budget * CHARS_PER_TOKEN - len(heading) - 300
+
+    parts = [f"{heading}\n\n"]
+    shown_contents: Dict[tuple, str] = {}
+    seen_contents = set()
+    shown = truncated = omitted = duplicates = 0
+    elided_chars = overlap_chars = 0
+
+    for result in results:
+        original = str(result.get("content", "No content"))
+        if original in seen_contents:
+            duplicates += 1
+            continue
+        seen_contents.add(original)
+
+        content = original
+        # Counted only once the result is shown
+        trimmed_chars = 0
+        file_id, chunk_index = result.get("file_id"), result.get("chunk_index")
+        if file_id is not None and isinstance(chunk_index, int):
+            previous = shown_contents.get((file_id, chunk_index - 1))
+            if previous is not None:
+                overlap = _overlap_length(previous, content)
+                if overlap:
+                    content = ELLIPSIS + content[overlap:]
+                    trimmed_chars += overlap
+            following = shown_contents.get((file_id, chunk_index + 1))
+            if following is not None:
+                overlap = _overlap_length(content, following)
+                if overlap:
+                    content = content[:len(content) - overlap] + ELLIPSIS
+                    trimmed_chars += overlap
+
+        available = remaining - len(_render_result(result, ""))
+        if available < min(len(content), MIN_SNIPPET_TOKENS * CHARS_PER_TOKEN):
+            omitted += 1
+            elided_chars += len(content)
+            continue
+        if len(content) > available:
+            shortened = _truncate(content, available)
+            truncated += 1
+            elided_chars += len(content) - len(shortened) + len(ELLIPSIS)
+            content = shortened
+
+        block = _render_result(result, content)
+        parts.append(block)
+        remaining -= len(block)
+        shown += 1
+        overlap_chars += trimmed_chars
+        if file_id is not None and isinstance(chunk_index, int):
+            shown_contents[(file_id, chunk_index)] = original
+
+    notes = []
+    if omitted or truncated:
+        notes.append(
+            f"~{_chars_to_tokens(elided_chars)} tokens elided to stay within the {token_budget}-token budget "
+            f"({omitted} results omitted, {truncated} truncated)"
+        )
+    if duplicates:
+        notes.append(f"{duplicates} results with duplicate content skipped")
+    if overlap_chars:
+        notes.append(f"~{_chars_to_tokens(overlap_chars)} tokens of overlap between neighbouring chunks shown once")
+    if notes:
+        parts.append(f"[Showing {shown} of {len(results)} results; " + "; ".join(notes) + ".")
+        if omitted or truncated:
+            parts.append(" Refine the query or lower `top` to see the rest.")
+        parts.append("]\n")
+
+    return "".join(parts)
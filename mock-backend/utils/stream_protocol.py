@@ -1,80 +1,375 @@
-import json
+import os
+import time
 import uuid
+import asyncio
+import logging
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import AIMessageChunk, AIMessage, ToolMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
 
 from langgraph.graph.state import CompiledStateGraph
 
-from typing import List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
-async def generate_stream(graph: CompiledStateGraph, input_message: List[HumanMessage], conversation_id: str):
-    # Generate unique message ID
-    message_id = str(uuid.uuid4())
+from lib.chat_runs import chat_runs
+from lib.database import db_manager
+from lib.metrics import chat_streams_active, chat_stream_first_token_seconds, chat_stream_duration_seconds
+from lib.tracing import bind_attributes, run_callbacks
+from utils.json_encoding import dumps
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Text delta coalescing (0 disables a limit; with both disabled every model chunk is its own 0: frame):
+# buffered text is sent once it is STREAM_COALESCE_MS old or STREAM_COALESCE_CHARS long
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "0"))
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "0"))
+
+# Yielded by _read_run when buffered text is due before the next stream item
+FLUSH_DUE = object()
+
+
+class UsageTracker(BaseCallbackHandler):
+    """Callback handler summing the token usage reported by every model call of a run.
+
+    This covers all agent steps and tool-loop iterations, and also model calls whose
+    output is not streamed (such as conversation summaries).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = None
+        for generations in response.generations:
+            for generation in generations:
+                if isinstance(generation, ChatGeneration) and isinstance(generation.message, AIMessage):
+                    usage = generation.message.usage_metadata or usage
+        with self._lock:
+            self.llm_calls += 1
+            if usage:
+                self.prompt_tokens += usage.get("input_tokens", 0)
+                self.completion_tokens += usage.get("output_tokens", 0)
+
+
+class TextDeltaCoalescer:
+    """Buffer of text deltas that are sent together as a single TextDelta (0:) frame."""
+
+    __slots__ = ("max_delay", "max_chars", "_parts", "_chars", "_deadline")
+
+    def __init__(self, max_delay_ms: float = 0, max_chars: int = 0):
+        self.max_delay = max_delay_ms / 1000
+        self.max_chars = max_chars
+        self._parts: List[str] = []
+        self._chars = 0
+        self._deadline: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_delay > 0 or self.max_chars > 0
+
+    def add(self, text: str) -> Optional[str]:
+        """Buffer a text delta; returns the frame to send if the buffer is due."""
+        if not self._parts and self.max_delay > 0:
+            self._deadline = time.monotonic() + self.max_delay
+        self._parts.append(text)
+        self._chars += len(text)
+        if not self.enabled or (self.max_chars > 0 and self._chars >= self.max_chars):
+            return self.flush()
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """Get the frame for all buffered text, or None if nothing is buffered."""
+        if not self._parts:
+            return None
+        text = self._parts[0] if len(self._parts) == 1 else "".join(self._parts)
+        self._parts.clear()
+        self._chars = 0
+        self._deadline = None
+        return f"0:{dumps(text)}\n"
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the buffered text is due, or None if there is no deadline."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+
+class RunStopped(Exception):
+    """The graph run was cancelled, by a stop request or because no client followed it anymore."""
+
+
+class PartialMessage:
+    """Text streamed so far by the model call in progress, to save if the run is stopped."""
+
+    __slots__ = ("message_id", "parts")
+
+    def __init__(self):
+        self.message_id: Optional[str] = None
+        self.parts: List[str] = []
+
+    def add(self, chunk: AIMessageChunk) -> None:
+        if chunk.id != self.message_id:
+            self.message_id = chunk.id
+            self.parts = []
+        self.parts.append(str(chunk.content))
+
+    def message(self) -> Optional[AIMessage]:
+        if not self.parts:
+            return None
+        return AIMessage(content="".join(self.parts), id=self.message_id)
+
+
+async def _drive_graph(
+    stream: AsyncIterator,
+    queue: asyncio.Queue,
+    config: Dict[str, Any],
+    on_stopped: Optional[Callable[[Dict[str, Any], Optional[AIMessage]], Awaitable[None]]]
+) -> None:
+    """Consume a graph stream into a queue, ending it with (False, None | exception).
+
+    Runs as its own task, so that the run can be cancelled independently of the HTTP
+    response, and so that waiting for items with a timeout never cancels the stream.
+    """
+    partial = PartialMessage()
+    try:
+        async for item in stream:
+            msg = item[0]
+            if isinstance(msg, AIMessageChunk) and msg.content:
+                partial.add(msg)
+            await queue.put((True, item))
+        await queue.put((False, None))
+    except asyncio.CancelledError:
+        await stream.aclose()
+        if on_stopped is not None:
+            try:
+                # Shielded: a second cancellation (e.g. the client leaving after a stop) must not interrupt the save
+                await asyncio.shield(on_stopped(config, partial.message()))
+            except Exception as e:
+                logger.error(f"Failed to save the stopped run of conversation {config['configurable']['thread_id']}: {str(e)}")
+        # Nobody may be reading anymore; drop the oldest items rather than wait for room
+        while True:
+            try:
+                queue.put_nowait((False, RunStopped()))
+                break
+            except asyncio.QueueFull:
+                queue.get_nowait()
+    except Exception as e:
+        await queue.put((False, e))
+
+
+async def _read_run(queue: asyncio.Queue, time_left: Callable[[], Optional[float]]) -> AsyncIterator:
+    """Iterate the items a run puts in its queue, yielding FLUSH_DUE whenever time_left() runs out first."""
+    while True:
+        if not queue.empty():
+            has_item, value = queue.get_nowait()
+        else:
+            timeout = time_left()
+            if timeout is None:
+                has_item, value = await queue.get()
+            else:
+                try:
+                    has_item, value = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield FLUSH_DUE
+                    continue
+        if not has_item:
+            if value is not None:
+                raise value
+            return
+        yield value
+
+
+class StreamState:
+    """Per-stream state of generate_stream.
+
+    Text and tool call arguments are forwarded as they arrive and never accumulated,
+    so the state stays small however long the response is.
+    """
+
+    __slots__ = ("message_id", "text_deltas", "usage", "tool_call_ids", "started_at")
+
+    def __init__(self, text_deltas: TextDeltaCoalescer):
+        self.message_id = str(uuid.uuid4())
+        self.text_deltas = text_deltas
+        self.usage = UsageTracker()
+        # Tool call ID per tool call chunk index of the current model call
+        self.tool_call_ids: Dict[int, str] = {}
+        self.started_at = time.monotonic()
+
+
+async def generate_stream(
+    graph: CompiledStateGraph,
+    input_message: List[HumanMessage],
+    conversation_id: str,
+    userid: str,
+    coalesce_ms: Optional[float] = None,
+    coalesce_chars: Optional[int] = None,
+    on_stopped: Optional[Callable[[Dict[str, Any], Optional[AIMessage]], Awaitable[None]]] = None
+):
+    """Stream a graph run in the AI SDK data stream protocol.
+
+    The run can be stopped with chat_runs.stop(conversation_id); the stream then ends
+    with a regular finish frame.
+
+    Args:
+        graph: Agent graph to run
+        input_message: New messages of the conversation
+        conversation_id: Conversation (thread) ID
+        userid: User the agent answers
+        coalesce_ms: Send buffered text deltas at most this many ms after the first (default: STREAM_COALESCE_MS)
+        coalesce_chars: Send buffered text deltas once this many characters are buffered (default: STREAM_COALESCE_CHARS)
+        on_stopped: Called with the run config and the partially streamed AI message (if any) after the run is stopped
+    """
+    state = StreamState(TextDeltaCoalescer(
+        STREAM_COALESCE_MS if coalesce_ms is None else coalesce_ms,
+        STREAM_COALESCE_CHARS if coalesce_chars is None else coalesce_chars
+    ))
+    text_deltas = state.text_deltas
+    coalescing = text_deltas.enabled
+    usage = state.usage
+    awaiting_first_token = True
+    outcome = "completed"
     
     # Send StartStep (f:) - Start of message processing
-    yield f"f:{json.dumps({'messageId': message_id})}\n"
-    
-    tool_calls = {}
-    tool_calls_by_idx = {}
-    accumulated_text = ""
-    token_count = 0
+    yield f"f:{dumps({'messageId': state.message_id})}\n"
+
+    # Spans of this run (and of a new conversation's request) belong to the conversation
+    bind_attributes(conversation_id=conversation_id, userid=userid)
+
+    # The tools read userid from the config to scope document searches to this user
+    config = {"configurable": {"thread_id": conversation_id, "userid": userid}, "callbacks": [usage, *run_callbacks()]}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+    run = asyncio.create_task(_drive_graph(
+        graph.astream({"messages": input_message}, config=config, stream_mode="messages"),
+        queue,
+        config,
+        on_stopped
+    ))
+    chat_runs.register(conversation_id, run)
+    chat_streams_active.inc()
 
     try:
-        async for msg, metadata in graph.astream(
-            {"messages": input_message},
-            config={"configurable": {"thread_id": conversation_id}},
-            stream_mode="messages",
-        ):
+        # Wake up to send buffered text when the model pauses
+        items = _read_run(queue, text_deltas.time_left)
+        async for item in items:
+            if item is FLUSH_DUE:
+                frame = text_deltas.flush()
+                if frame:
+                    yield frame
+                continue
+            msg, metadata = item
             
             if isinstance(msg, ToolMessage):
+                # Keep buffered text ahead of any other frame
+                frame = text_deltas.flush()
+                if frame:
+                    yield frame
+
                 # Handle tool results - ToolCallResult (a:)
-                tool_call_id = msg.tool_call_id
-                yield f"a:{json.dumps({'toolCallId': tool_call_id, 'result': msg.content})}\n"
+                yield f"a:{dumps({'toolCallId': msg.tool_call_id, 'result': msg.content})}\n"
 
-            elif isinstance(msg, AIMessageChunk) or isinstance(msg, AIMessage):
+            elif isinstance(msg, AIMessage):
                 # Handle text content - TextDelta (0:)
                 if msg.content:
-                    # Send text delta - properly escape the content
-                    content = str(msg.content)
-                    yield f"0:{json.dumps(content)}\n"
-                    accumulated_text += content
-                    token_count += len(content.split())
+                    if awaiting_first_token:
+                        awaiting_first_token = False
+                        chat_stream_first_token_seconds.observe(time.monotonic() - state.started_at)
+                    # Send text delta (or buffer it when coalescing) - properly escape the content
+                    if coalescing:
+                        frame = text_deltas.add(str(msg.content))
+                        if frame:
+                            yield frame
+                    else:
+                        yield f"0:{dumps(str(msg.content))}\n"
+
+                tool_call_chunks = getattr(msg, 'tool_call_chunks', None)
+                if not msg.tool_calls and not tool_call_chunks:
+                    continue
+
+                # Keep buffered text ahead of any other frame
+                frame = text_deltas.flush()
+                if frame:
+                    yield frame
+
+                # Remember which tool call each chunk index belongs to; indexes restart with every model call
+                for chunk in tool_call_chunks or ():
+                    if chunk.get("id"):
+                        state.tool_call_ids[chunk.get("index", 0)] = chunk["id"]
 
                 # Handle tool calls
-                if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                    for tool_call in msg.tool_calls:
-                        tool_call_id = tool_call.get('id', str(uuid.uuid4()))
-                        tool_name = tool_call.get('name', '')
-
-                        if tool_name == "":
-                            continue
-
-                        tool_calls_by_idx[len(tool_calls_by_idx)] = tool_call_id
-                        tool_calls[tool_call_id] = {"name": tool_name, "args": ""}
-                        
-                        # Send StartToolCall (b:)
-                        yield f"b:{json.dumps({'toolCallId': tool_call_id, 'toolName': tool_name})}\n"
-                        
-                        # # Send ToolCall (9:) with complete args
-                        # yield f"9:{json.dumps({'toolCallId': tool_call_id, 'toolName': tool_name, 'args': tool_args})}\n"
+                for tool_call in msg.tool_calls:
+                    tool_call_id = tool_call.get('id') or str(uuid.uuid4())
+                    tool_name = tool_call.get('name', '')
+
+                    if tool_name == "":
+                        continue
+                    
+                    # Send StartToolCall (b:)
+                    yield f"b:{dumps({'toolCallId': tool_call_id, 'toolName': tool_name})}\n"
+                    
+                    # # Send ToolCall (9:) with complete args
+                    # yield f"9:{dumps({'toolCallId': tool_call_id, 'toolName': tool_name, 'args': tool_args})}\n"
                 
-                # Handle streaming tool call chunks
-                if hasattr(msg, 'tool_call_chunks') and msg.tool_call_chunks:
-                    for chunk in msg.tool_call_chunks:
-                        tool_name = chunk.get("name", "")
-                        args_chunk = chunk.get("args", "")
-                        chunk_index = chunk.get("index", 0)
-                        tool_call_id = tool_calls_by_idx.get(chunk_index, -1)
-
-                        # Accumulate args and send ToolCallArgsTextDelta (c:)
-                        if tool_call_id != -1 and args_chunk:
-                            tool_calls[tool_call_id]["args"] += args_chunk
-                            yield f"c:{json.dumps({'toolCallId': tool_call_id, 'argsTextDelta': args_chunk})}\n"
-                        
+                # Handle streaming tool call chunks - ToolCallArgsTextDelta (c:)
+                for chunk in tool_call_chunks or ():
+                    args_chunk = chunk.get("args")
+                    tool_call_id = state.tool_call_ids.get(chunk.get("index", 0))
+                    if tool_call_id and args_chunk:
+                        yield f"c:{dumps({'toolCallId': tool_call_id, 'argsTextDelta': args_chunk})}\n"
+
+        frame = text_deltas.flush()
+        if frame:
+            yield frame
 
         # Send FinishMessage (d:) with usage stats
-        yield f"d:{json.dumps({'finishReason': 'stop', 'usage': {'promptTokens': token_count, 'completionTokens': token_count}})}\n"
+        yield f"d:{dumps({'finishReason': 'stop', 'usage': {'promptTokens': usage.prompt_tokens, 'completionTokens': usage.completion_tokens}})}\n"
         
+    except RunStopped:
+        outcome = "stopped"
+        frame = text_deltas.flush()
+        if frame:
+            yield frame
+
+        # Send FinishMessage (d:) for what was generated until the run was stopped
+        yield f"d:{dumps({'finishReason': 'stop', 'usage': {'promptTokens': usage.prompt_tokens, 'completionTokens': usage.completion_tokens}})}\n"
+
     except Exception as e:
+        outcome = "error"
+        frame = text_deltas.flush()
+        if frame:
+            yield frame
+
         # Send Error (3:)
         error_message = str(e)
-        yield f"3:{json.dumps(error_message)}\n"
+        yield f"3:{dumps(error_message)}\n"
+
+    finally:
+        # A stream closed early stops the run too
+        run.cancel()
+        duration = time.monotonic() - state.started_at
+        chat_streams_active.dec()
+        chat_stream_duration_seconds.labels(outcome=outcome).observe(duration)
+
+        # Record usage for failed and interrupted runs too, since their tokens were still spent
+        try:
+            db_manager.add_conversation_usage(
+                conversation_id,
+                userid,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                llm_calls=usage.llm_calls,
+                duration_ms=int(duration * 1000)
+            )
+        except Exception as e:
+            logger.error(f"Failed to record usage of conversation {conversation_id}: {str(e)}")